@@ -0,0 +1,116 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+"""
+Topic ACL benchmark: TopicAccessControlListPlugin checks against a generated ACL
+
+Each user gets ENTRIES allowed topics, mixing plain topics, ``+`` and ``#`` wildcards and a ``%c`` template.
+Checks, half allowed and half denied, are run with the compiled ACL used by the plugin and with the previous
+implementation which compares the requested topic with every allowed topic of the user (``topic_ac``).
+The plugin compiles the ACL of a user on its first check: the ``compiled (cold)`` run includes compilation, the
+``compiled`` run reuses the compiled ACLs.
+
+Usage:
+    acl.py [-u USERS] [-e ENTRIES] [-n CHECKS]
+    acl.py (-h | --help)
+
+Options:
+    -h --help   Show this screen.
+    -u USERS    Number of users in the ACL [default: 10000]
+    -e ENTRIES  Number of allowed topics per user [default: 100]
+    -n CHECKS   Number of topic checks [default: 100000]
+"""
+import logging
+import random
+import time
+
+from docopt import docopt
+
+from hbmqtt.plugins.manager import BaseContext
+from hbmqtt.plugins.topic_checking import TopicAccessControlListPlugin
+from hbmqtt.session import Session
+
+
+def build_acl(users, entries):
+    acl = dict()
+    for u in range(users):
+        allowed = ['devices/%c/#']
+        for e in range(entries - 1):
+            kind = e % 3
+            if kind == 0:
+                allowed.append('site/%d/room/%d/temperature' % (u, e))
+            elif kind == 1:
+                allowed.append('site/%d/room/+/sensor/%d' % (u, e))
+            else:
+                allowed.append('site/%d/zone/%d/#' % (u, e))
+        acl['user%d' % u] = allowed
+    return acl
+
+
+def build_checks(users, entries, count):
+    rand = random.Random(0)
+    checks = []
+    for i in range(count):
+        u = rand.randrange(users)
+        e = rand.randrange(entries - 1)
+        session = Session()
+        session.username = 'user%d' % u
+        session.client_id = 'device%d' % u
+        kind = e % 3
+        if i % 2:
+            # Denied: same shape, other room
+            topic = 'site/%d/room/%d/humidity' % (u, e)
+        elif kind == 0:
+            topic = 'site/%d/room/%d/temperature' % (u, e)
+        elif kind == 1:
+            topic = 'site/%d/room/kitchen/sensor/%d' % (u, e)
+        else:
+            topic = 'site/%d/zone/%d/a/b' % (u, e)
+        checks.append((session, topic))
+    return checks
+
+
+def bench_compiled(plugin, checks):
+    start = time.perf_counter()
+    allowed = 0
+    for session, topic in checks:
+        if plugin.topic_filtering(session=session, topic=topic):
+            allowed += 1
+    return time.perf_counter() - start, allowed
+
+
+def bench_topic_ac(acl, checks):
+    start = time.perf_counter()
+    allowed = 0
+    for session, topic in checks:
+        for allowed_topic in acl[session.username]:
+            if TopicAccessControlListPlugin.topic_ac(topic, allowed_topic):
+                allowed += 1
+                break
+    return time.perf_counter() - start, allowed
+
+
+def main():
+    arguments = docopt(__doc__)
+    users = int(arguments['-u'])
+    entries = int(arguments['-e'])
+    count = int(arguments['-n'])
+    acl = build_acl(users, entries)
+    checks = build_checks(users, entries, count)
+    context = BaseContext()
+    context.logger = logging.getLogger(__name__)
+    context.config = {'topic-check': {'enabled': True, 'acl': acl}}
+
+    start = time.perf_counter()
+    plugin = TopicAccessControlListPlugin(context)
+    load_time = time.perf_counter() - start
+    print("%d users, %d allowed topics per user, %d checks" % (users, entries, count))
+    print("ACL loaded in %.3f s" % load_time)
+    for name, (elapsed, allowed) in (('compiled (cold)', bench_compiled(plugin, checks)),
+                                     ('compiled', bench_compiled(plugin, checks)),
+                                     ('topic_ac', bench_topic_ac(acl, checks))):
+        print("%-16s %8.3f s %12.0f checks/s %8d allowed" % (name, elapsed, count / elapsed, allowed))
+
+
+if __name__ == '__main__':
+    main()
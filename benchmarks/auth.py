@@ -0,0 +1,124 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+"""
+Authentication benchmark: CONNECTs per second accepted by each authentication plugin
+
+Every CONNECT of a distinct client is authenticated once with the ``authenticate`` method the broker calls, all
+CONNECTs being submitted concurrently. ``file`` checks passlib hashes (sha512_crypt) with its verification cache
+disabled, ``ecdsa`` checks BIP schnorr signatures by batches in the event loop with its verification cache disabled
+and ``token`` checks HMAC-SHA256 tokens built by ``encode_token``.
+
+Usage:
+    auth.py [-n COUNT]
+    auth.py (-h | --help)
+
+Options:
+    -h --help   Show this screen.
+    -n COUNT    Number of CONNECTs per plugin [default: 100]
+"""
+import asyncio
+import binascii
+import datetime
+import logging
+import os
+import tempfile
+import time
+
+from docopt import docopt
+from passlib.apps import custom_app_context as pwd_context
+
+from hbmqtt.plugins.authentication import (
+    AnonymousAuthPlugin, EcdsaAuthPlugin, FileAuthPlugin, TokenAuthPlugin, encode_token)
+from hbmqtt.plugins.manager import BaseContext
+from hbmqtt.plugins.secp256k1 import PublicKey, hash_sha256, point_mul, G
+from hbmqtt.plugins.secp256k1 import schnorr
+from hbmqtt.session import Session
+
+
+def new_session(i, username=None, password=None):
+    session = Session()
+    session.client_id = 'device%d' % i
+    session.username = username
+    session.password = password
+    return session
+
+
+def anonymous_sessions(count):
+    return [new_session(i) for i in range(count)]
+
+
+def file_sessions(count, password_file):
+    with open(password_file, 'w') as f:
+        for i in range(count):
+            f.write('user%d:%s\n' % (i, pwd_context.hash('password%d' % i)))
+    return [new_session(i, 'user%d' % i, 'password%d' % i) for i in range(count)]
+
+
+def ecdsa_sessions(count):
+    iso_now = datetime.datetime.utcnow().isoformat()[:18]
+    sessions = []
+    for i in range(count):
+        prk = hash_sha256('secret %d' % i)
+        puk = binascii.hexlify(PublicKey.from_seed(prk).encode()).decode()
+        msg = hash_sha256(iso_now + 'device%d' % i)
+        sessions.append(new_session(i, puk, binascii.hexlify(schnorr.sign(msg, prk)).decode()))
+    return sessions
+
+
+def token_sessions(count, secret):
+    expiry = time.time() + 3600
+    return [new_session(i, None, encode_token(secret, 'device%d' % i, expiry, ['devices/device%d/' % i]))
+            for i in range(count)]
+
+
+def bench(loop, plugin, sessions):
+    start = time.perf_counter()
+    results = loop.run_until_complete(
+        asyncio.gather(*[plugin.authenticate(session=session) for session in sessions], loop=loop))
+    elapsed = time.perf_counter() - start
+    assert all(results), "%d CONNECTs refused" % results.count(False)
+    return elapsed
+
+
+def new_context(loop, auth_config):
+    context = BaseContext()
+    context.loop = loop
+    context.logger = logging.getLogger(__name__)
+    context.config = {'auth': auth_config}
+    return context
+
+
+def main():
+    arguments = docopt(__doc__)
+    count = int(arguments['-n'])
+    loop = asyncio.new_event_loop()
+    point_mul(G, 1)
+    secret = os.urandom(32)
+    fd, password_file = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        runs = (
+            ('anonymous', AnonymousAuthPlugin, {'allow-anonymous': True}, lambda: anonymous_sessions(count)),
+            ('file', FileAuthPlugin, {'password-file': password_file, 'password-cache-size': 0},
+             lambda: file_sessions(count, password_file)),
+            ('ecdsa', EcdsaAuthPlugin, {'allow-anonymous': False, 'ecdsa-cache-size': 0, 'schnorr-batch-workers': 0},
+             lambda: ecdsa_sessions(count)),
+            ('token', TokenAuthPlugin, {'token-secret': secret}, lambda: token_sessions(count, secret)),
+        )
+        print("%d CONNECTs per plugin" % count)
+        for name, plugin_class, auth_config, build_sessions in runs:
+            # Signatures are only valid for the current 10 s window: sessions are built right before the run
+            sessions = build_sessions()
+            plugin = plugin_class(new_context(loop, auth_config))
+            elapsed = bench(loop, plugin, sessions)
+            if hasattr(plugin, 'on_broker_post_shutdown'):
+                loop.run_until_complete(plugin.on_broker_post_shutdown())
+            print("%-16s %8.3f s %12.1f CONNECT/s" % (name, elapsed, count / elapsed))
+    finally:
+        os.remove(password_file)
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+"""
+Packet decoding benchmark: stream adapter path against the sans-IO decoder used by ``tcp-buffered`` listeners
+
+The same pipelined PUBLISH packets are received by chunks, as a socket would give them, then decoded:
+
+* ``stream``: StreamReader fed with the chunks, read with StreamReaderAdapter as the ``tcp`` listener does
+* ``buffered``: chunks written in the PacketDecoder buffer as BufferedProtocol does for ``tcp-buffered`` listeners
+
+Usage:
+    decode.py [-n COUNT] [-s SIZE] [-c CHUNK]
+    decode.py (-h | --help)
+
+Options:
+    -h --help   Show this screen.
+    -n COUNT    Number of PUBLISH packets [default: 100000]
+    -s SIZE     Payload size in bytes [default: 64]
+    -c CHUNK    Receive size in bytes [default: 65536]
+"""
+import asyncio
+import time
+
+from docopt import docopt
+
+from hbmqtt.adapters import StreamReaderAdapter
+from hbmqtt.mqtt import packet_class
+from hbmqtt.mqtt.codec import PacketDecoder
+from hbmqtt.mqtt.packet import MQTTFixedHeader
+from hbmqtt.mqtt.publish import PublishPacket
+from hbmqtt.mqtt.constants import QOS_1
+
+
+def build_data(count, size):
+    return b''.join(PublishPacket.build('bench/topic', b'x' * size, i % 65535 + 1, False, QOS_1, False).to_bytes()
+                    for i in range(count))
+
+
+def chunks(data, chunk_size):
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def bench_stream(loop, received, count):
+    @asyncio.coroutine
+    def read_all():
+        stream = asyncio.StreamReader(loop=loop)
+        reader = StreamReaderAdapter(stream)
+        for chunk in received:
+            stream.feed_data(chunk)
+        stream.feed_eof()
+        for i in range(count):
+            fixed_header = yield from MQTTFixedHeader.from_stream(reader)
+            yield from packet_class(fixed_header).from_stream(reader, fixed_header=fixed_header)
+
+    start = time.perf_counter()
+    loop.run_until_complete(read_all())
+    return time.perf_counter() - start
+
+
+def bench_buffered(received, count):
+    start = time.perf_counter()
+    decoder = PacketDecoder()
+    decoded = 0
+    for chunk in received:
+        buffer = decoder.get_buffer(len(chunk))
+        buffer[:len(chunk)] = chunk
+        decoded += len(decoder.buffer_updated(len(chunk)))
+    elapsed = time.perf_counter() - start
+    assert decoded == count
+    return elapsed
+
+
+def main():
+    arguments = docopt(__doc__)
+    count = int(arguments['-n'])
+    size = int(arguments['-s'])
+    received = chunks(build_data(count, size), int(arguments['-c']))
+    loop = asyncio.new_event_loop()
+    try:
+        results = [
+            ('stream', bench_stream(loop, received, count)),
+            ('buffered', bench_buffered(received, count)),
+        ]
+    finally:
+        loop.close()
+    print("%d PUBLISH packets, %d bytes payload, %d bytes chunks" % (count, size, int(arguments['-c'])))
+    for name, elapsed in results:
+        print("%-10s %8.3f s %12.0f packets/s" % (name, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
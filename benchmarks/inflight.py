@@ -0,0 +1,123 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+"""
+In-flight log benchmark: QoS 1 and QoS 2 message rates of a broker with and without ``inflight-log``
+
+``qos1`` measures messages delivered per second to a persistent QoS 1 subscriber: with the log, every message
+sent and every PUBACK received is recorded. ``qos2`` measures QoS 2 messages received per second from persistent
+publishers: with the log, the broker waits for the group commit of each message before sending its PUBREC.
+Messages are published concurrently, ``-c`` at a time.
+
+Usage:
+    inflight.py [-n COUNT] [-c CONCURRENCY] [-s SIZE] [-i INTERVAL]
+    inflight.py (-h | --help)
+
+Options:
+    -h --help       Show this screen.
+    -n COUNT        Number of messages per run [default: 5000]
+    -c CONCURRENCY  Number of messages published at once [default: 100]
+    -s SIZE         Payload size in bytes [default: 64]
+    -i INTERVAL     Group commit interval in seconds [default: 0.005]
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from docopt import docopt
+
+from hbmqtt.broker import Broker
+from hbmqtt.client import MQTTClient
+from hbmqtt.mqtt.constants import QOS_1, QOS_2
+
+URL = 'mqtt://127.0.0.1:1889/'
+
+config = {
+    'listeners': {
+        'default': {
+            'type': 'tcp',
+            'bind': '127.0.0.1:1889',
+        },
+    },
+    'sys_interval': 0,
+    'auth': {
+        'allow-anonymous': True,
+    },
+}
+
+
+@asyncio.coroutine
+def publish(loop, client, count, concurrency, payload, qos):
+    for i in range(0, count, concurrency):
+        yield from asyncio.gather(*[client.publish('bench/%d' % j, payload, qos)
+                                    for j in range(i, min(count, i + concurrency))], loop=loop)
+
+
+@asyncio.coroutine
+def bench_qos1(loop, count, concurrency, payload):
+    subscriber = MQTTClient(client_id='bench-subscriber', loop=loop)
+    yield from subscriber.connect(URL, cleansession=False)
+    yield from subscriber.subscribe([('bench/#', QOS_1)])
+    publisher = MQTTClient(loop=loop)
+    yield from publisher.connect(URL)
+
+    @asyncio.coroutine
+    def receive():
+        for i in range(count):
+            yield from subscriber.deliver_message()
+
+    start = time.perf_counter()
+    yield from asyncio.gather(publish(loop, publisher, count, concurrency, payload, QOS_1), receive(), loop=loop)
+    elapsed = time.perf_counter() - start
+    yield from publisher.disconnect()
+    yield from subscriber.disconnect()
+    return elapsed
+
+
+@asyncio.coroutine
+def bench_qos2(loop, count, concurrency, payload):
+    publisher = MQTTClient(client_id='bench-publisher', loop=loop)
+    yield from publisher.connect(URL, cleansession=False)
+    start = time.perf_counter()
+    yield from publish(loop, publisher, count, concurrency, payload, QOS_2)
+    elapsed = time.perf_counter() - start
+    yield from publisher.disconnect()
+    return elapsed
+
+
+def run(loop, bench, broker_config, *args):
+    broker = Broker(broker_config, loop=loop, plugin_namespace='hbmqtt.benchmark.plugins')
+    loop.run_until_complete(broker.start())
+    try:
+        elapsed = loop.run_until_complete(bench(loop, *args))
+    finally:
+        loop.run_until_complete(broker.shutdown())
+    return elapsed
+
+
+def main():
+    arguments = docopt(__doc__)
+    count = int(arguments['-n'])
+    concurrency = int(arguments['-c'])
+    payload = os.urandom(int(arguments['-s']))
+    interval = float(arguments['-i'])
+    logging.basicConfig(level=logging.ERROR)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    print("%d messages, %d at once, commit interval %.3f s" % (count, concurrency, interval))
+    with tempfile.TemporaryDirectory() as directory:
+        durable_config = dict(config, **{'inflight-log': {
+            'file': os.path.join(directory, 'inflight.log'), 'commit-interval': interval}})
+        try:
+            for name, bench in (('qos1', bench_qos1), ('qos2', bench_qos2)):
+                for mode, broker_config in (('volatile', config), ('durable', durable_config)):
+                    elapsed = run(loop, bench, broker_config, count, concurrency, payload)
+                    print("%-6s %-10s %8.3f s %12.1f messages/s" % (name, mode, elapsed, count / elapsed))
+        finally:
+            loop.close()
+
+
+if __name__ == '__main__':
+    main()
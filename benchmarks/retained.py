@@ -0,0 +1,98 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+"""
+Retained messages store benchmark: opening time and memory of a RetainedStore holding many retained topics
+
+Topics are retained in a new store, which is closed and opened again with its index, then without it (replaying the
+whole log). Memory is the Python heap allocated by opening the store, compared with the same messages kept in a
+TopicTree as the broker does without ``retained-store``.
+
+Usage:
+    retained.py [-n COUNT] [-s SIZE] [-l LOOKUPS]
+    retained.py (-h | --help)
+
+Options:
+    -h --help   Show this screen.
+    -n COUNT    Number of retained topics [default: 100000]
+    -s SIZE     Payload size in bytes [default: 100]
+    -l LOOKUPS  Number of topics read after opening the store [default: 10000]
+"""
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from docopt import docopt
+
+from hbmqtt.retained import RetainedStore
+from hbmqtt.session import RetainedApplicationMessage
+from hbmqtt.topics import TopicTree
+
+
+def topic(i):
+    return 'devices/device%d/status' % i
+
+
+def open_store(path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    store = RetainedStore(path)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return store, elapsed, memory
+
+
+def main():
+    arguments = docopt(__doc__)
+    count = int(arguments['-n'])
+    payload = os.urandom(int(arguments['-s']))
+    lookups = int(arguments['-l'])
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'retained.log')
+        store = RetainedStore(path)
+        start = time.perf_counter()
+        for i in range(count):
+            store[topic(i)] = RetainedApplicationMessage(None, topic(i), payload, 1)
+        elapsed = time.perf_counter() - start
+        print("%d retained topics, %d bytes payloads" % (count, len(payload)))
+        print("%-24s %10.3f s %12.1f messages/s" % ('retain', elapsed, count / elapsed))
+        start = time.perf_counter()
+        store.close()
+        print("%-24s %10.3f s" % ('close (write index)', time.perf_counter() - start))
+
+        store, elapsed, memory = open_store(path)
+        print("%-24s %10.3f ms %10.1f KiB" % ('open', elapsed * 1000, memory / 1024))
+        start = time.perf_counter()
+        for i in random.sample(range(count), min(lookups, count)):
+            store[topic(i)]
+        elapsed = time.perf_counter() - start
+        print("%-24s %10.3f s %12.1f lookups/s" % ('lookup', elapsed, lookups / elapsed))
+        start = time.perf_counter()
+        matched = len(store.filter('devices/device1234/#'))
+        print("%-24s %10.3f ms %8d topics" % ('filter', (time.perf_counter() - start) * 1000, matched))
+        store._file.close()
+        store._map.close()
+        store._index.close()
+        store._file = None
+
+        os.remove(store.index_path)
+        store, elapsed, memory = open_store(path)
+        print("%-24s %10.3f ms %10.1f KiB" % ('open without index', elapsed * 1000, memory / 1024))
+        store._file.close()
+        store._map.close()
+        store._file = None
+
+    tracemalloc.start()
+    tree = TopicTree()
+    for i in range(count):
+        tree[topic(i)] = RetainedApplicationMessage(None, topic(i), bytes(payload), 1)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("%-24s %10s    %10.1f KiB" % ('in memory TopicTree', '', memory / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+"""
+secp256k1 benchmark: signature verifications per second, as run by EcdsaAuthPlugin for each CONNECT
+
+ECDSA and BIP schnorr signatures are verified with hbmqtt.plugins.secp256k1 and with the former affine
+double-and-add arithmetic (one modular inversion per point addition, two separate scalar multiplications).
+Signatures per second, as made by hbmqtt_pub --ecdsa/--schnorr, are measured too. The fixed-base table of G is
+built before timing. ``schnorr batch`` checks schnorr signatures by batches of 64, as EcdsaAuthPlugin does for
+concurrent connections.
+
+Usage:
+    secp256k1.py [-n COUNT]
+    secp256k1.py (-h | --help)
+
+Options:
+    -h --help   Show this screen.
+    -n COUNT    Number of signatures verified per scheme [default: 200]
+"""
+import time
+
+from docopt import docopt
+
+from hbmqtt.plugins.secp256k1 import (
+    G, n, PublicKey, hash_sha256, int_from_bytes, is_quad, point_add, point_mul, sig_from_der, tagged_hash)
+from hbmqtt.plugins.secp256k1 import ecdsa, schnorr
+
+
+def affine_mul(P, k):
+    R = None
+    for i in range(256):
+        if (k >> i) & 1:
+            R = point_add(R, P)
+        P = point_add(P, P)
+    return R
+
+
+def affine_ecdsa_verify(msg, pubkey, sig):
+    r, s = sig_from_der(sig)
+    c = pow(s, n - 2, n)
+    GQ = point_add(affine_mul(G, (int_from_bytes(msg) * c) % n),
+                   affine_mul(PublicKey.decode(pubkey), (r * c) % n))
+    return GQ[0] % n == r
+
+
+def affine_schnorr_verify(msg, pubkey, sig):
+    P = schnorr.point_from_bytes(pubkey)
+    r, s = int_from_bytes(sig[:32]), int_from_bytes(sig[32:])
+    e = int_from_bytes(tagged_hash("BIPSchnorr", sig[0:32] + pubkey + msg)) % n
+    R = point_add(affine_mul(G, s), affine_mul(P, n - e))
+    return is_quad(R[1]) and R[0] == r
+
+
+def build_signatures(count):
+    signatures = []
+    for i in range(count):
+        prk = hash_sha256("secret %d" % i)
+        msg = hash_sha256("message %d" % i)
+        puk = PublicKey.from_seed(prk).encode()
+        signatures.append((msg, puk, ecdsa.rfc6979_sign(msg, prk), schnorr.sign(msg, prk)))
+    return signatures
+
+
+def bench(verify, arguments):
+    start = time.perf_counter()
+    for args in arguments:
+        assert verify(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    arguments = docopt(__doc__)
+    count = int(arguments['-n'])
+    start = time.perf_counter()
+    point_mul(G, 1)
+    print("G table built in %.3f s" % (time.perf_counter() - start))
+    signatures = build_signatures(count)
+    ecdsa_args = [(msg, puk, sig) for msg, puk, sig, _ in signatures]
+    schnorr_args = [(msg, puk[1:], sig) for msg, puk, _, sig in signatures]
+    sign_args = [(msg, hash_sha256("secret %d" % i)) for i, (msg, _, _, _) in enumerate(signatures)]
+    print("%d signatures per scheme" % count)
+    for name, sign in (('ecdsa sign', ecdsa.rfc6979_sign), ('schnorr sign', schnorr.sign)):
+        elapsed = bench(sign, sign_args)
+        print("%-16s %8.3f s %10.1f sign/s" % (name, elapsed, count / elapsed))
+    for name, verify, args in (
+            ('ecdsa', ecdsa.verify, ecdsa_args),
+            ('ecdsa affine', affine_ecdsa_verify, ecdsa_args),
+            ('schnorr', schnorr.verify, schnorr_args),
+            ('schnorr affine', affine_schnorr_verify, schnorr_args)):
+        elapsed = bench(verify, args)
+        print("%-16s %8.3f s %10.1f verify/s" % (name, elapsed, count / elapsed))
+    batches = [list(zip(*schnorr_args[i:i + 64])) for i in range(0, count, 64)]
+    elapsed = bench(lambda *args: all(schnorr.verify_batch(*args)), batches)
+    print("%-16s %8.3f s %10.1f verify/s" % ('schnorr batch', elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+"""
+Packet sending benchmark: send syscalls per message
+
+Bursts of PUBACK or PUBLISH packets are sent on a local socket pair, either packet by packet with
+MQTTPacket.to_stream() (one write and one drain per packet), or with ProtocolHandler._send_packet() which
+coalesces packets sent during the same loop iteration and writes large payloads without copying them.
+The sending socket counts its send() calls.
+
+Usage:
+    send.py [-n COUNT] [-b BURST] [-s SIZE]
+    send.py (-h | --help)
+
+Options:
+    -h --help   Show this screen.
+    -n COUNT    Number of packets sent [default: 100000]
+    -b BURST    Number of packets sent concurrently, like per-packet handler tasks do [default: 50]
+    -s SIZE     PUBLISH payload size in bytes [default: 64]
+"""
+import asyncio
+import socket
+import time
+
+from docopt import docopt
+
+from hbmqtt.adapters import StreamReaderAdapter, StreamWriterAdapter
+from hbmqtt.mqtt.protocol.handler import ProtocolHandler
+from hbmqtt.mqtt.puback import PubackPacket
+from hbmqtt.mqtt.publish import PublishPacket
+from hbmqtt.mqtt.constants import QOS_0
+from hbmqtt.plugins.manager import PluginManager
+from hbmqtt.session import Session
+
+
+class CountingSocket(socket.socket):
+    sends = 0
+
+    def send(self, *args):
+        CountingSocket.sends += 1
+        return super().send(*args)
+
+
+def bench(loop, packets, burst, coalesced):
+    @asyncio.coroutine
+    def receive(reader, length):
+        while length > 0:
+            data = yield from reader.read(65536)
+            length -= len(data)
+
+    @asyncio.coroutine
+    def to_stream(packet):
+        # Previous ProtocolHandler._send_packet implementation
+        with (yield from write_lock):
+            yield from packet.to_stream(writer)
+
+    @asyncio.coroutine
+    def send():
+        for i in range(0, len(packets), burst):
+            if coalesced:
+                yield from asyncio.gather(*[handler._send_packet(packet) for packet in packets[i:i + burst]],
+                                          loop=loop)
+            else:
+                yield from asyncio.gather(*[to_stream(packet) for packet in packets[i:i + burst]], loop=loop)
+
+    sock, peer = socket.socketpair()
+    sock = CountingSocket(sock.family, sock.type, sock.proto, sock.detach())
+    reader, writer = loop.run_until_complete(asyncio.open_connection(sock=sock, loop=loop))
+    peer_reader, peer_writer = loop.run_until_complete(asyncio.open_connection(sock=peer, loop=loop))
+    writer = StreamWriterAdapter(writer)
+    write_lock = asyncio.Lock(loop=loop)
+    handler = ProtocolHandler(PluginManager("hbmqtt.benchmark.plugins", context=None, loop=loop), loop=loop)
+    handler.attach(Session(), StreamReaderAdapter(reader), writer)
+    length = sum(len(packet.to_bytes()) for packet in packets)
+
+    CountingSocket.sends = 0
+    start = time.perf_counter()
+    loop.run_until_complete(asyncio.gather(send(), receive(peer_reader, length), loop=loop))
+    elapsed = time.perf_counter() - start
+    sends = CountingSocket.sends
+    loop.run_until_complete(writer.close())
+    peer_writer.close()
+    return elapsed, sends, length
+
+
+def main():
+    arguments = docopt(__doc__)
+    count = int(arguments['-n'])
+    burst = int(arguments['-b'])
+    size = int(arguments['-s'])
+    workloads = [
+        ('PUBACK', [PubackPacket.build(i % 65535 + 1) for i in range(count)]),
+        ('PUBLISH', [PublishPacket.build('bench/topic', b'x' * size, None, False, QOS_0, False)
+                     for i in range(count)]),
+    ]
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    print("%d packets, bursts of %d" % (count, burst))
+    try:
+        for name, packets in workloads:
+            for mode, coalesced in (('to_stream', False), ('_send_packet', True)):
+                elapsed, sends, length = bench(loop, packets, burst, coalesced)
+                print("%-8s %-13s %8.3f s %12.0f packets/s %8.3f send/packet %10.1f MB/s" %
+                      (name, mode, elapsed, count / elapsed, sends / count, length / elapsed / 1e6))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
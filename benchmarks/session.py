@@ -0,0 +1,72 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+"""
+Session memory benchmark: bytes allocated per idle session
+
+Sessions are built like the broker builds them from CONNECT packets, then connected and disconnected once.
+Memory is the Python heap allocated per session, measured with tracemalloc.
+
+Usage:
+    session.py [-n COUNT]
+    session.py (-h | --help)
+
+Options:
+    -h --help   Show this screen.
+    -n COUNT    Number of sessions [default: 10000]
+"""
+import asyncio
+import time
+import tracemalloc
+
+from docopt import docopt
+
+from hbmqtt.session import Session
+
+
+def new_session(loop, i):
+    session = Session(loop)
+    session.client_id = 'device%d' % i
+    session.clean_session = False
+    session.will_flag = False
+    session.username = 'user%d' % i
+    session.keep_alive = 60
+    return session
+
+
+def idle_session(loop, i):
+    session = new_session(loop, i)
+    session.transitions.connect()
+    session.topic_filtering_cache.clear()
+    session.transitions.disconnect()
+    return session
+
+
+def bench(loop, count, build):
+    tracemalloc.start()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    sessions = [build(loop, i) for i in range(count)]
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0] - start_memory
+    tracemalloc.stop()
+    del sessions
+    return elapsed, memory
+
+
+def main():
+    arguments = docopt(__doc__)
+    count = int(arguments['-n'])
+    loop = asyncio.new_event_loop()
+    print("%d sessions" % count)
+    try:
+        for name, build in (('new', new_session), ('idle', idle_session)):
+            elapsed, memory = bench(loop, count, build)
+            print("%-6s %8.3f s %12.1f sessions/s %10.0f bytes/session" %
+                  (name, elapsed, count / elapsed, memory / count))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,32 @@
 #
 # See the file license.txt for copying permission.
 import asyncio
+import collections
 import io
+import sys
 from websockets.protocol import WebSocketCommonProtocol
 from websockets.exceptions import ConnectionClosed
 from asyncio import StreamReader, StreamWriter
 import logging
 
 
+# Selector transports send the buffers given to writelines() with a single sendmsg() call since Python 3.12.
+# Before, writelines() joins them into a new bytes object: buffers are written one by one instead.
+TRANSPORT_WRITELINES = sys.version_info >= (3, 12)
+
+
+# Bytes waiting to be sent by a WebSocketsWriter before drain() is needed
+WEBSOCKET_HIGH_WATER = 64 * 1024
+
+
+def transport_writelines(transport, buffers):
+    if TRANSPORT_WRITELINES:
+        transport.writelines(buffers)
+    else:
+        for data in buffers:
+            transport.write(data)
+
+
 class ReaderAdapter:
     """
     Base class for all network protocol reader adapter.
@@ -42,12 +61,27 @@ class WriterAdapter:
         write some data to the protocol layer
         """
 
+    def writelines(self, buffers):
+        """
+        write a list of bytes-like objects to the protocol layer, without concatenating them when the protocol
+        layer allows it
+        """
+        for data in buffers:
+            self.write(data)
+
     @asyncio.coroutine
     def drain(self):
         """
         Let the write buffer of the underlying transport a chance to be flushed.
         """
 
+    def needs_drain(self) -> bool:
+        """
+        Tell if drain() must be awaited after writing: the transport buffer is over its high-water mark, the
+        connection is closing, or the adapter only sends data when drained.
+        """
+        return True
+
     def get_peer_info(self):
         """
         Return peer socket info (remote address and remote port as tuple
@@ -64,67 +98,137 @@ class WebSocketsReader(ReaderAdapter):
     """
     WebSockets API reader adapter
     This adapter relies on WebSocketCommonProtocol to read from a WebSocket.
+    Received messages are queued as they are and consumed from a read offset, so the packets contained in a
+    message are read without copying the rest of the message again.
     """
     def __init__(self, protocol: WebSocketCommonProtocol):
         self._protocol = protocol
-        self._stream = io.BytesIO(b'')
+        self._messages = collections.deque()
+        self._offset = 0
+        self._size = 0
 
     @asyncio.coroutine
     def read(self, n=-1) -> bytes:
-        yield from self._feed_buffer(n)
-        data = self._stream.read(n)
-        return data
+        if n < 0:
+            n = self._size
+        while self._size < n:
+            received = yield from self._receive()
+            if not received:
+                n = self._size
+        return self._take(n)
 
     @asyncio.coroutine
-    def _feed_buffer(self, n=1):
+    def _receive(self):
         """
-        Feed the data buffer by reading a Websocket message.
-        :param n: if given, feed buffer until it contains at least n bytes
+        Read a Websocket message into the buffer
+        :return: False if the connection is closed
         """
-        buffer = bytearray(self._stream.read())
-        while len(buffer) < n:
-            try:
-                message = yield from self._protocol.recv()
-            except ConnectionClosed:
-                message = None
-            if message is None:
+        try:
+            message = yield from self._protocol.recv()
+        except ConnectionClosed:
+            message = None
+        if message is None:
+            return False
+        if not isinstance(message, bytes):
+            raise TypeError("message must be bytes")
+        if message:
+            self._messages.append(message)
+            self._size += len(message)
+        return True
+
+    def _take(self, n):
+        self._size -= n
+        pieces = []
+        while n:
+            message = self._messages[0]
+            offset = self._offset
+            available = len(message) - offset
+            if n < available:
+                pieces.append(message[offset:offset + n])
+                self._offset = offset + n
                 break
-            if not isinstance(message, bytes):
-                raise TypeError("message must be bytes")
-            buffer.extend(message)
-        self._stream = io.BytesIO(buffer)
+            pieces.append(message[offset:] if offset else message)
+            self._messages.popleft()
+            self._offset = 0
+            n -= available
+        if len(pieces) == 1:
+            return pieces[0]
+        return b''.join(pieces)
 
 
 class WebSocketsWriter(WriterAdapter):
     """
     WebSockets API writer adapter
     This adapter relies on WebSocketCommonProtocol to read from a WebSocket.
+    Data written during the same loop iteration is sent as a single websocket binary message by a background task.
+    drain() is only needed once ``high_water`` bytes are waiting to be sent.
     """
-    def __init__(self, protocol: WebSocketCommonProtocol):
+    def __init__(self, protocol: WebSocketCommonProtocol, high_water=WEBSOCKET_HIGH_WATER):
         self._protocol = protocol
-        self._stream = io.BytesIO(b'')
+        self._high_water = high_water
+        self._buffers = []
+        self._size = 0
+        self._send_task = None
+        self._exception = None
 
     def write(self, data):
         """
         write some data to the protocol layer
         """
-        self._stream.write(data)
+        self._buffers.append(data)
+        self._size += len(data)
+        self._schedule_send()
+
+    def writelines(self, buffers):
+        for data in buffers:
+            self._buffers.append(data)
+            self._size += len(data)
+        self._schedule_send()
+
+    def _schedule_send(self):
+        if self._send_task is None and self._exception is None:
+            self._send_task = asyncio.ensure_future(self._send(), loop=self._protocol.loop)
+
+    @asyncio.coroutine
+    def _send(self):
+        try:
+            while self._buffers:
+                # Buffers are only copied once, into the websocket message
+                data = b''.join(self._buffers)
+                self._buffers = []
+                self._size = 0
+                if len(data):
+                    yield from self._protocol.send(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Raised by next drain()
+            self._exception = e
+        finally:
+            self._send_task = None
+
+    def needs_drain(self) -> bool:
+        return self._exception is not None or self._size >= self._high_water
 
     @asyncio.coroutine
     def drain(self):
         """
-        Let the write buffer of the underlying transport a chance to be flushed.
+        Wait until all data written has been sent.
         """
-        data = self._stream.getvalue()
-        if len(data):
-            yield from self._protocol.send(data)
-        self._stream = io.BytesIO(b'')
+        if self._send_task is not None:
+            yield from asyncio.shield(self._send_task, loop=self._protocol.loop)
+        if self._exception is not None:
+            raise self._exception
 
     def get_peer_info(self):
         return self._protocol.remote_address
 
     @asyncio.coroutine
     def close(self):
+        try:
+            yield from self.drain()
+        except ConnectionClosed:
+            pass
         yield from self._protocol.close()
 
 
@@ -164,11 +268,26 @@ class StreamWriterAdapter(WriterAdapter):
         if not self.is_closed:
             self._writer.write(data)
 
+    def writelines(self, buffers):
+        if not self.is_closed:
+            transport_writelines(self._writer.transport, buffers)
+
     @asyncio.coroutine
     def drain(self):
         if not self.is_closed:
             yield from self._writer.drain()
 
+    def needs_drain(self):
+        if self.is_closed:
+            return False
+        transport = self._writer.transport
+        if transport.is_closing():
+            return True
+        try:
+            return transport.get_write_buffer_size() > transport.get_write_buffer_limits()[1]
+        except (AttributeError, NotImplementedError):
+            return True
+
     def get_peer_info(self):
         extra_info = self._writer.get_extra_info('peername')
         return extra_info[0], extra_info[1]
@@ -185,6 +304,213 @@ class StreamWriterAdapter(WriterAdapter):
             except AttributeError: pass
 
 
+class PacketReaderAdapter(ReaderAdapter):
+    """
+    Reader adapter for :class:`PacketProtocol` connections.
+    Packets are decoded by the protocol as data is received, so this adapter gives whole packets with
+    :meth:`read_packet` instead of bytes.
+    """
+    # Reading is paused while this number of decoded packets is waiting to be read
+    MAX_PENDING_PACKETS = 1000
+
+    def __init__(self, protocol, loop=None):
+        if loop is None:
+            self._loop = asyncio.get_event_loop()
+        else:
+            self._loop = loop
+        self._protocol = protocol
+        self._packets = collections.deque()
+        self._exception = None
+        self._eof = False
+        self._waiter = None
+        self._paused = False
+
+    def feed_packets(self, packets):
+        self._packets.extend(packets)
+        if not self._paused and len(self._packets) > self.MAX_PENDING_PACKETS:
+            self._paused = True
+            self._protocol.pause_reading()
+        self._wakeup()
+
+    def set_exception(self, exc):
+        self._exception = exc
+        self._wakeup()
+
+    def feed_eof(self):
+        self._eof = True
+        self._wakeup()
+
+    def _wakeup(self):
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @asyncio.coroutine
+    def read(self, n=-1) -> bytes:
+        raise NotImplementedError("%s gives decoded packets, use read_packet()" % type(self).__name__)
+
+    @asyncio.coroutine
+    def read_packet(self):
+        """
+        Get the next decoded packet. Packets decoded before an invalid one are given first, then the decoding
+        error is raised.
+        :return: packet instance, or None if EOF was received and all packets have been read
+        """
+        while not self._packets:
+            if self._exception is not None:
+                exc, self._exception = self._exception, None
+                raise exc
+            if self._eof:
+                return None
+            self._waiter = self._loop.create_future()
+            try:
+                yield from self._waiter
+            finally:
+                self._waiter = None
+        packet = self._packets.popleft()
+        if self._paused and len(self._packets) <= self.MAX_PENDING_PACKETS // 2:
+            self._paused = False
+            self._protocol.resume_reading()
+        return packet
+
+
+class PacketWriterAdapter(WriterAdapter):
+    """
+    Writer adapter for :class:`PacketProtocol` connections, writing directly to the transport
+    """
+    def __init__(self, protocol):
+        self._protocol = protocol
+        self.is_closed = False
+
+    def write(self, data):
+        if not self.is_closed:
+            self._protocol.transport.write(data)
+
+    def writelines(self, buffers):
+        if not self.is_closed:
+            transport_writelines(self._protocol.transport, buffers)
+
+    @asyncio.coroutine
+    def drain(self):
+        if not self.is_closed:
+            yield from self._protocol.drain()
+
+    def needs_drain(self):
+        return not self.is_closed and (self._protocol.transport.is_closing() or self._protocol.write_paused)
+
+    def get_peer_info(self):
+        extra_info = self._protocol.transport.get_extra_info('peername')
+        return extra_info[0], extra_info[1]
+
+    @asyncio.coroutine
+    def close(self):
+        if not self.is_closed:
+            self.is_closed = True
+            transport = self._protocol.transport
+            if transport.can_write_eof():
+                transport.write_eof()
+            transport.close()
+            yield from self._protocol.wait_closed()
+
+
+# asyncio.BufferedProtocol is available from Python 3.7: 'tcp-buffered' listeners can't be used before
+if hasattr(asyncio, 'BufferedProtocol'):
+    class PacketProtocol(asyncio.BufferedProtocol):
+        """
+        ``asyncio.BufferedProtocol`` driving a sans-IO packet decoder.
+        The event loop receives data straight into the decoder buffer; all the packets completed by a receive are
+        decoded in one pass and handed to a :class:`PacketReaderAdapter`.
+        :param decoder: decoder instance, see :class:`hbmqtt.mqtt.codec.PacketDecoder`
+        :param connected_cb: coroutine function called with the reader and writer adapters of a new connection
+        """
+        def __init__(self, decoder, connected_cb, loop=None):
+            if loop is None:
+                self._loop = asyncio.get_event_loop()
+            else:
+                self._loop = loop
+            self.logger = logging.getLogger(__name__)
+            self._decoder = decoder
+            self._connected_cb = connected_cb
+            self.transport = None
+            self.reader = None
+            self.writer = None
+            self._closed = self._loop.create_future()
+            self.write_paused = False
+            self._drain_waiter = None
+
+        def connection_made(self, transport):
+            self.transport = transport
+            self.reader = PacketReaderAdapter(self, loop=self._loop)
+            self.writer = PacketWriterAdapter(self)
+            asyncio.ensure_future(self._connected_cb(self.reader, self.writer), loop=self._loop)
+
+        def get_buffer(self, sizehint):
+            return self._decoder.get_buffer(sizehint)
+
+        def buffer_updated(self, nbytes):
+            try:
+                packets = self._decoder.buffer_updated(nbytes)
+            except Exception as e:
+                self.logger.warning("Invalid data received, closing connection: %r" % e)
+                self.reader.set_exception(e)
+                self.transport.close()
+            else:
+                if packets:
+                    self.reader.feed_packets(packets)
+
+        def eof_received(self):
+            self.reader.feed_eof()
+
+        def connection_lost(self, exc):
+            if self.reader is not None:
+                self.reader.feed_eof()
+            if not self._closed.done():
+                self._closed.set_result(None)
+            self._resume_drain(exc if exc is not None else ConnectionResetError('Connection lost'))
+
+        def pause_reading(self):
+            self.transport.pause_reading()
+
+        def resume_reading(self):
+            if not self.transport.is_closing():
+                self.transport.resume_reading()
+
+        def pause_writing(self):
+            self.write_paused = True
+
+        def resume_writing(self):
+            self.write_paused = False
+            self._resume_drain()
+
+        def _resume_drain(self, exc=None):
+            waiter = self._drain_waiter
+            if waiter is not None:
+                self._drain_waiter = None
+                if not waiter.done():
+                    if exc is None:
+                        waiter.set_result(None)
+                    else:
+                        waiter.set_exception(exc)
+
+        @asyncio.coroutine
+        def drain(self):
+            if self.transport.is_closing():
+                raise ConnectionResetError('Connection lost')
+            if not self.write_paused:
+                return
+            if self._drain_waiter is None or self._drain_waiter.done():
+                self._drain_waiter = self._loop.create_future()
+            yield from self._drain_waiter
+
+        @asyncio.coroutine
+        def wait_closed(self):
+            yield from self._closed
+else:
+    PacketProtocol = None
+
+
 class BufferReader(ReaderAdapter):
     """
     Byte Buffer reader adapter
@@ -216,6 +542,9 @@ class BufferWriter(WriterAdapter):
     def drain(self):
         pass
 
+    def needs_drain(self):
+        return False
+
     def get_buffer(self):
         return self._stream.getvalue()
 
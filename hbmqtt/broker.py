@@ -6,13 +6,17 @@ import ssl
 import websockets
 import asyncio
 import re
-from asyncio import CancelledError
 from collections import deque
 
 from functools import partial
 from transitions import Machine, MachineError
-from hbmqtt.session import Session
+from hbmqtt.session import Session, RetainedApplicationMessage
+from hbmqtt.topics import TopicTree
+from hbmqtt.retained import RetainedStore
+from hbmqtt.inflight import InflightLog
 from hbmqtt.mqtt.protocol.broker_handler import BrokerProtocolHandler
+from hbmqtt.mqtt.publish import PublishFrame
+from hbmqtt.mqtt.codec import PacketDecoder
 from hbmqtt.errors import HBMQTTException, MQTTException
 from hbmqtt.utils import format_client_message, gen_client_id
 from hbmqtt.adapters import (
@@ -21,12 +25,15 @@ from hbmqtt.adapters import (
     ReaderAdapter,
     WriterAdapter,
     WebSocketsReader,
-    WebSocketsWriter)
+    WebSocketsWriter,
+    PacketProtocol)
 from .plugins.manager import PluginManager, BaseContext
 
 
 _defaults = {
     'timeout-disconnect-delay': 2,
+    'outgoing-queue-size': 1000,
+    'max-inflight-messages': 100,
     'auth': {
         'allow-anonymous': True,
         'password-file': None
@@ -43,22 +50,14 @@ EVENT_BROKER_CLIENT_SUBSCRIBED = 'broker_client_subscribed'
 EVENT_BROKER_CLIENT_UNSUBSCRIBED = 'broker_client_unsubscribed'
 EVENT_BROKER_MESSAGE_RECEIVED = 'broker_message_received'
 
+# Maximum number of topic filtering decisions cached per session
+TOPIC_FILTERING_CACHE_SIZE = 1024
+
 
 class BrokerException(BaseException):
     pass
 
 
-class RetainedApplicationMessage:
-
-    __slots__ = ('source_session', 'topic', 'data', 'qos')
-
-    def __init__(self, source_session, topic, data, qos=None):
-        self.source_session = source_session
-        self.topic = topic
-        self.data = data
-        self.qos = qos
-
-
 class Server:
     def __init__(self, listener_name, server_instance, max_connections=-1, loop=None):
         self.logger = logging.getLogger(__name__)
@@ -130,12 +129,31 @@ class BrokerContext(BaseContext):
 
     @property
     def retained_messages(self):
+        """
+        Retained messages indexed by topic name, as a :class:`hbmqtt.topics.TopicTree`, or a
+        :class:`hbmqtt.retained.RetainedStore` when the ``retained-store`` section is configured.
+        Use ``retained_messages.filter(a_filter)`` to get the messages matching a subscription filter.
+        """
         return self._broker_instance._retained_messages
 
     @property
     def subscriptions(self):
         return self._broker_instance._subscriptions
 
+    @property
+    def plugins(self):
+        """
+        Plugins loaded by the broker, as :class:`hbmqtt.plugins.manager.Plugin` tuples
+        """
+        return self._broker_instance.plugins_manager.plugins
+
+    @property
+    def hook_stats(self):
+        """
+        Executor usage of the blocking plugin hooks, see :meth:`hbmqtt.plugins.manager.PluginManager.hook_stats`
+        """
+        return self._broker_instance.plugins_manager.hook_stats()
+
 
 class Broker:
     """
@@ -150,7 +168,8 @@ class Broker:
 
     def __init__(self, config=None, loop=None, plugin_namespace=None):
         self.logger = logging.getLogger(__name__)
-        self.config = _defaults
+        # Copy the defaults, so that the configuration of a broker does not leak into the next ones
+        self.config = dict(_defaults)
         if config is not None:
             self.config.update(config)
         self._build_listeners_config(self.config)
@@ -163,11 +182,25 @@ class Broker:
         self._servers = dict()
         self._init_states()
         self._sessions = dict()
-        self._subscriptions = dict()
-        self._retained_messages = dict()
+        self._subscriptions = TopicTree()
+        self._retained_messages = TopicTree()
+        self._retained_handle = None
+        self._retained_task = None
+        self._inflight_log = None
+        # Messages in flight of the persistent sessions read from the in-flight log, by client id
+        self._inflight_recovered = dict()
         self._broadcast_queue = asyncio.Queue(loop=self._loop)
+        # Broadcasts queued before the broadcast loop lets handlers writer tasks drain their outgoing queue, so that a
+        # burst of broadcasts does not overflow the queues of clients reading fast enough
+        outgoing_queue_size = self.config.get('outgoing-queue-size', 0)
+        self._broadcast_batch = max(1, outgoing_queue_size // 2) if outgoing_queue_size else 0
 
         self._broadcast_task = None
+        self._topic_filters = None
+        self._session_stores = None
+        # Session store calls, run in order by a single task: (method name, arguments, waiter) tuples
+        self._store_calls = deque()
+        self._store_task = None
 
         # Init plugins manager
         context = BrokerContext(self)
@@ -209,16 +242,30 @@ class Broker:
 
             This method is a *coroutine*.
         """
+        for listener_name, listener in self.listeners_config.items():
+            if listener.get('type') == 'tcp-buffered' and PacketProtocol is None:
+                raise BrokerException("Listener '%s' of type 'tcp-buffered' requires Python 3.7 or later" %
+                                      listener_name)
         try:
             self._sessions = dict()
-            self._subscriptions = dict()
-            self._retained_messages = dict()
+            self._subscriptions = TopicTree()
             self.transitions.start()
             self.logger.debug("Broker starting")
         except (MachineError, ValueError) as exc:
             # Backwards compat: MachineError is raised by transitions < 0.5.0.
             self.logger.warning("[WARN-0001] Invalid method call at this moment: %s" % exc)
             raise BrokerException("Broker instance can't be started: %s" % exc)
+        try:
+            self._retained_messages = self._open_retained_store()
+        except (OSError, ValueError) as exc:
+            self.transitions.starting_fail()
+            raise BrokerException("Can't open retained messages store: %s" % exc)
+        try:
+            self._open_inflight_log()
+        except OSError as exc:
+            yield from self._close_retained_store(self._retained_messages)
+            self.transitions.starting_fail()
+            raise BrokerException("Can't open in-flight log: %s" % exc)
 
         yield from self.plugins_manager.fire_event(EVENT_BROKER_PRE_START)
         try:
@@ -280,6 +327,12 @@ class Broker:
                         instance = yield from websockets.serve(cb_partial, address, port, ssl=sc, loop=self._loop,
                                                                subprotocols=['mqtt'])
                         self._servers[listener_name] = Server(listener_name, instance, max_connections, self._loop)
+                    elif listener['type'] == 'tcp-buffered':
+                        cb_partial = partial(self.client_connected, listener_name)
+                        instance = yield from self._loop.create_server(
+                            lambda: PacketProtocol(PacketDecoder(), cb_partial, loop=self._loop),
+                            address, port, reuse_address=True, ssl=sc)
+                        self._servers[listener_name] = Server(listener_name, instance, max_connections, self._loop)
 
                     self.logger.info("Listener '%s' bind to %s (max_connections=%d)" %
                                      (listener_name, listener['bind'], max_connections))
@@ -293,6 +346,8 @@ class Broker:
             self.logger.debug("Broker started")
         except Exception as e:
             self.logger.error("Broker startup failed: %s" % e)
+            yield from self._close_retained_store(self._retained_messages)
+            self._close_inflight_log()
             self.transitions.starting_fail()
             raise BrokerException("Broker instance can't be started: %s" % e)
 
@@ -304,9 +359,11 @@ class Broker:
             Closes all connected session, stop listening on network socket and free resources.
         """
         try:
+            sessions = self._sessions
+            retained_messages = self._retained_messages
             self._sessions = dict()
-            self._subscriptions = dict()
-            self._retained_messages = dict()
+            self._subscriptions = TopicTree()
+            self._retained_messages = TopicTree()
             self.transitions.shutdown()
         except (MachineError, ValueError) as exc:
             # Backwards compat: MachineError is raised by transitions < 0.5.0.
@@ -325,11 +382,117 @@ class Broker:
         for listener_name in self._servers:
             server = self._servers[listener_name]
             yield from server.close_instance()
+        # Sessions of connected clients are stored as if they disconnected
+        for (session, handler) in sessions.values():
+            yield from self._store_session(session)
+        yield from self._wait_store_calls()
+        yield from self._close_retained_store(retained_messages)
+        self._close_inflight_log()
         self.logger.debug("Broker closing")
         self.logger.info("Broker closed")
         yield from self.plugins_manager.fire_event(EVENT_BROKER_POST_SHUTDOWN)
+        yield from self.plugins_manager.shutdown_executor()
         self.transitions.stopping_success()
 
+    def _open_retained_store(self):
+        """
+        Open the retained messages store configured in the ``retained-store`` section, and schedule its maintenance.
+        Retained messages are kept in memory only without this section.
+        :return: retained messages mapping
+        """
+        store_config = self.config.get('retained-store')
+        if not store_config:
+            return TopicTree()
+        store = RetainedStore(
+            store_config['file'],
+            cache_size=store_config.get('cache-size', 1024),
+            compact_ratio=store_config.get('compact-ratio', 0.5),
+            checkpoint_size=store_config.get('checkpoint-size', 10000))
+        self.logger.debug("%d retained messages in '%s'" % (len(store), store.path))
+        interval = store_config.get('compact-interval', 60)
+        if interval > 0:
+            self._retained_handle = self._loop.call_later(interval, self._maintain_retained_store, store, interval)
+        return store
+
+    def _maintain_retained_store(self, store, interval):
+        self._retained_handle = None
+        self._retained_task = asyncio.ensure_future(self._run_retained_maintenance(store, interval), loop=self._loop)
+
+    @asyncio.coroutine
+    def _run_retained_maintenance(self, store, interval):
+        """
+        Write the retained messages store index, or compact its log, in the default executor: only taking the snapshot
+        and swapping the files run in the event loop
+        """
+        maintenance = None
+        try:
+            maintenance = store.start_maintenance()
+            if maintenance is not None:
+                yield from self._loop.run_in_executor(None, maintenance.run)
+                store.finish_maintenance(maintenance)
+        except OSError as e:
+            self.logger.warning("Retained messages store maintenance failed: %s" % e)
+            if maintenance is not None:
+                maintenance.discard()
+        self._retained_task = None
+        if self._retained_messages is store:
+            self._retained_handle = self._loop.call_later(interval, self._maintain_retained_store, store, interval)
+
+    @asyncio.coroutine
+    def _close_retained_store(self, retained_messages):
+        if self._retained_handle:
+            self._retained_handle.cancel()
+            self._retained_handle = None
+        if self._retained_task is not None:
+            # Let the running maintenance finish
+            yield from asyncio.wait([self._retained_task], loop=self._loop)
+        if isinstance(retained_messages, RetainedStore):
+            try:
+                retained_messages.close()
+            except OSError as e:
+                self.logger.warning("Can't close retained messages store: %s" % e)
+
+    def _open_inflight_log(self):
+        """
+        Open the in-flight log configured in the ``inflight-log`` section and read the messages in flight of the
+        persistent sessions, restored when their client connects again.
+        """
+        log_config = self.config.get('inflight-log')
+        self._inflight_recovered = dict()
+        if not log_config:
+            return
+        self._inflight_log = InflightLog(
+            log_config['file'],
+            commit_interval=log_config.get('commit-interval', 0.005),
+            max_size=log_config.get('max-size', 16 * 1024 * 1024),
+            loop=self._loop)
+        self._inflight_recovered = self._inflight_log.recover()
+        self.logger.debug("Messages in flight recovered for %d sessions" % len(self._inflight_recovered))
+
+    def _close_inflight_log(self):
+        if self._inflight_log is not None:
+            try:
+                self._inflight_log.close()
+            except OSError as e:
+                self.logger.warning("Can't close in-flight log: %s" % e)
+            self._inflight_log = None
+
+    def _restore_inflight(self, session):
+        """
+        Restore the messages in flight of a persistent session from the in-flight log. When the log is enabled, it
+        is more recent than the messages in flight of stored sessions.
+        """
+        if self._inflight_log is None:
+            return
+        inflight_out, inflight_in = self._inflight_recovered.pop(session.client_id, (None, None))
+        if inflight_out is not None:
+            self.logger.debug("Restoring %d messages in flight of session %s" %
+                              (len(inflight_out) + len(inflight_in), session.client_id))
+            session.inflight_out = inflight_out
+            session.inflight_in = inflight_in
+        else:
+            session.inflight_out.clear()
+
     @asyncio.coroutine
     def internal_message_broadcast(self, topic, data, qos=None):
         return (yield from self._broadcast_message(None, topic, data))
@@ -355,7 +518,10 @@ class Broker:
 
         # Wait for first packet and expect a CONNECT
         try:
-            handler, client_session = yield from BrokerProtocolHandler.init_from_connect(reader, writer, self.plugins_manager, loop=self._loop)
+            handler, client_session = yield from BrokerProtocolHandler.init_from_connect(
+                reader, writer, self.plugins_manager, loop=self._loop,
+                outgoing_queue_size=self.config.get('outgoing-queue-size', 0),
+                max_inflight_messages=self.config.get('max-inflight-messages', 0))
         except HBMQTTException as exc:
             self.logger.warning("[MQTT-3.1.0-1] %s: Can't read first packet an CONNECT: %s" %
                                 (format_client_message(address=remote_address, port=remote_port), exc))
@@ -369,6 +535,7 @@ class Broker:
             self.logger.debug("Connection closed")
             return
 
+        restore = False
         if client_session.clean_session:
             # Delete existing session and create a new one
             if client_session.client_id is not None and client_session.client_id != "":
@@ -383,19 +550,30 @@ class Broker:
                 (client_session, h) = self._sessions[client_session.client_id]
                 client_session.parent = 1
             else:
-                client_session.parent = 0
+                # Restored once the client is authenticated
+                restore = True
         if client_session.keep_alive > 0:
             client_session.keep_alive += self.config['timeout-disconnect-delay']
         self.logger.debug("Keep-alive timeout=%d" % client_session.keep_alive)
 
         handler.attach(client_session, reader, writer)
+        if not client_session.clean_session:
+            handler.inflight_log = self._inflight_log
         self._sessions[client_session.client_id] = (client_session, handler)
 
         authenticated = yield from self.authenticate(client_session, self.listeners_config[listener_name])
         if not authenticated:
             yield from writer.close()
             server.release_connection()  # Delete client from connections list
+            if restore:
+                # Don't keep the session, so that the stored one is restored on next authenticated connection
+                del self._sessions[client_session.client_id]
             return
+        if restore:
+            client_session.parent = 1 if (yield from self._restore_session(client_session)) else 0
+            self._restore_inflight(client_session)
+        # Topic filtering decisions of a resumed session may depend on previous credentials
+        client_session.clear_topic_filtering_cache()
 
         while True:
             try:
@@ -407,12 +585,14 @@ class Broker:
                 # Wait a bit may be client is reconnecting too fast
                 yield from asyncio.sleep(1, loop=self._loop)
         yield from handler.mqtt_connack_authorize(authenticated)
+        if not client_session.clean_session:
+            yield from self._store_call('save_session', client_session)
 
         yield from self.plugins_manager.fire_event(EVENT_BROKER_CLIENT_CONNECTED, client_id=client_session.client_id)
 
         self.logger.debug("%s Start messages handling" % client_session.client_id)
         yield from handler.start()
-        self.logger.debug("Retained messages queue size: %d" % client_session.retained_messages.qsize())
+        self.logger.debug("Retained messages queue size: %d" % client_session.retained_messages_count)
         yield from self.publish_session_retained_messages(client_session)
 
         # Init and start loop for handling client messages (publish, subscribe/unsubscribe, disconnect)
@@ -448,13 +628,15 @@ class Broker:
                     self.logger.debug("%s Disconnecting session" % client_session.client_id)
                     yield from self._stop_handler(handler)
                     client_session.transitions.disconnect()
+                    yield from self._store_session(client_session)
                     yield from self.plugins_manager.fire_event(EVENT_BROKER_CLIENT_DISCONNECTED, client_id=client_session.client_id)
                     connected = False
                 if unsubscribe_waiter in done:
                     self.logger.debug("%s handling unsubscription" % client_session.client_id)
                     unsubscription = unsubscribe_waiter.result()
                     for topic in unsubscription['topics']:
-                        self._del_subscription(topic, client_session)
+                        if self._del_subscription(topic, client_session) and not client_session.clean_session:
+                            yield from self._store_call('del_subscription', client_session.client_id, topic)
                         yield from self.plugins_manager.fire_event(
                             EVENT_BROKER_CLIENT_UNSUBSCRIBED,
                             client_id=client_session.client_id,
@@ -561,6 +743,41 @@ class Broker:
         # If all plugins returned True, authentication is success
         return auth_result
 
+    def _get_topic_filters(self):
+        """
+        Get the topic_filtering() methods of the plugins selected by 'topic-check' configuration.
+        Plain methods are called inline by topic_filtering(), only coroutines are scheduled.
+        :return: tuple of (plugin, method) lists for plain methods and coroutines
+        """
+        if self._topic_filters is None:
+            topic_plugins = None
+            topic_config = self.config.get('topic-check', None)
+            if topic_config and topic_config.get('enabled', False):
+                topic_plugins = topic_config.get('plugins', None)
+            sync_filters = []
+            coro_filters = []
+            for plugin in self.plugins_manager.plugins:
+                if plugin is None or (topic_plugins is not None and plugin.name not in topic_plugins):
+                    continue
+                method = getattr(plugin.object, 'topic_filtering', None)
+                if method is None:
+                    continue
+                if asyncio.iscoroutinefunction(method):
+                    coro_filters.append((plugin, method))
+                else:
+                    sync_filters.append((plugin, method))
+            self._topic_filters = (sync_filters, coro_filters)
+        return self._topic_filters
+
+    def clear_topic_filtering_cache(self):
+        """
+        Forget topic filtering decisions of all sessions, and plugins selected for topic filtering.
+        Must be called when 'topic-check' configuration or data used by topic filtering plugins is changed.
+        """
+        self._topic_filters = None
+        for (session, handler) in self._sessions.values():
+            session.clear_topic_filtering_cache()
+
     @asyncio.coroutine
     def topic_filtering(self, session: Session, topic):
         """
@@ -570,29 +787,43 @@ class Broker:
          - True if MQTT client can be subscribed to the topic
          - False if MQTT client is not allowed to subscribe to the topic
          - None if topic filtering can't be achieved (then plugin result is then ignored)
+        Plugins can implement topic_filtering() as a plain method, which is called without scheduling a task.
+        Decisions are cached in the session until it is authenticated again or clear_topic_filtering_cache()
+        is called.
         :param session:
         :param listener:
         :param topic: Topic in which the client wants to subscribe
         :return:
         """
-        topic_plugins = None
-        topic_config = self.config.get('topic-check', None)
-        if topic_config and topic_config.get('enabled', False):
-            topic_plugins = topic_config.get('plugins', None)
-        returns = yield from self.plugins_manager.map_plugin_coro(
-            "topic_filtering",
-            session=session,
-            topic=topic,
-            filter_plugins=topic_plugins)
+        cache = session.topic_filtering_cache
+        try:
+            return cache[topic]
+        except KeyError:
+            pass
+        sync_filters, coro_filters = self._get_topic_filters()
+        results = []
+        for plugin, method in sync_filters:
+            res = method(session=session, topic=topic)
+            if asyncio.iscoroutine(res):
+                res = yield from res
+            results.append((plugin, res))
+            if res is False:
+                break
+        else:
+            if coro_filters:
+                returns = yield from asyncio.gather(
+                    *[method(session=session, topic=topic) for plugin, method in coro_filters], loop=self._loop)
+                results.extend(zip([plugin for plugin, method in coro_filters], returns))
         topic_result = True
-        if returns:
-            for plugin in returns:
-                res = returns[plugin]
-                if res is False:
-                    topic_result = False
-                    self.logger.debug("Topic filtering failed due to '%s' plugin result: %s" % (plugin.name, res))
-                else:
-                    self.logger.debug("'%s' plugin result: %s" % (plugin.name, res))
+        for plugin, res in results:
+            if res is False:
+                topic_result = False
+                self.logger.debug("Topic filtering failed due to '%s' plugin result: %s" % (plugin.name, res))
+            elif self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("'%s' plugin result: %s" % (plugin.name, res))
+        if len(cache) >= TOPIC_FILTERING_CACHE_SIZE:
+            cache.clear()
+        cache[topic] = topic_result
         # If all plugins returned True, authentication is success
         return topic_result
 
@@ -600,7 +831,7 @@ class Broker:
         if data is not None and data != b'':
             # If retained flag set, store the message for further subscriptions
             self.logger.debug("Retaining message on topic %s" % topic_name)
-            retained_message = RetainedApplicationMessage(source_session, topic_name, data, qos)
+            retained_message = RetainedApplicationMessage(source_session, topic_name, bytes(data), qos)
             self._retained_messages[topic_name] = retained_message
         else:
             # [MQTT-3.3.1-10]
@@ -633,6 +864,8 @@ class Broker:
                 (s for (s, qos) in self._subscriptions[a_filter] if s.client_id == session.client_id), None)
             if not already_subscribed:
                 self._subscriptions[a_filter].append((session, qos))
+                if not session.clean_session:
+                    yield from self._store_call('add_subscription', session.client_id, a_filter, qos)
             else:
                 self.logger.debug("Client %s has already subscribed to %s" % (format_client_message(session=session), a_filter))
             return qos
@@ -687,49 +920,55 @@ class Broker:
 
     @asyncio.coroutine
     def _broadcast_loop(self):
-        running_tasks = deque()
-        try:
-            while True:
-                while running_tasks and running_tasks[0].done():
-                    task = running_tasks.popleft()
-                    try: task.result() # make asyncio happy and collect results
-                    except Exception: pass
-                broadcast = yield from self._broadcast_queue.get()
-                if self.logger.isEnabledFor(logging.DEBUG):
-                    self.logger.debug("broadcasting %r" % broadcast)
-                for k_filter in self._subscriptions:
-                    if broadcast['topic'].startswith("$") and (k_filter.startswith("+") or k_filter.startswith("#")):
-                        self.logger.debug("[MQTT-4.7.2-1] - ignoring brodcasting $ topic to subscriptions starting with + or #")
-                    elif self.matches(broadcast['topic'], k_filter):
-                        subscriptions = self._subscriptions[k_filter]
-                        for (target_session, qos) in subscriptions:
-                            if 'qos' in broadcast:
-                                qos = broadcast['qos']
-                            if target_session.transitions.state == 'connected':
-                                if self.logger.isEnabledFor(logging.DEBUG):
-                                    self.logger.debug("broadcasting application message from %s on topic '%s' to %s" %
-                                                      (format_client_message(session=broadcast['session']),
-                                                       broadcast['topic'], format_client_message(session=target_session)))
-                                handler = self._get_handler(target_session)
-                                task = asyncio.ensure_future(
-                                    handler.mqtt_publish(broadcast['topic'], broadcast['data'], qos, retain=False),
-                                    loop=self._loop)
-                                running_tasks.append(task)
-                            elif qos is not None and qos > 0:
-                                if self.logger.isEnabledFor(logging.DEBUG):
-                                    self.logger.debug("retaining application message from %s on topic '%s' to client '%s'" %
-                                                      (format_client_message(session=broadcast['session']),
-                                                       broadcast['topic'], format_client_message(session=target_session)))
-                                retained_message = RetainedApplicationMessage(
-                                    broadcast['session'], broadcast['topic'], broadcast['data'], qos)
-                                yield from target_session.retained_messages.put(retained_message)
-                                if self.logger.isEnabledFor(logging.DEBUG):
-                                    self.logger.debug(f'target_session.retained_messages={target_session.retained_messages.qsize()}')
-        except CancelledError:
-            # Wait until current broadcasting tasks end
-            if running_tasks:
-                yield from asyncio.wait(running_tasks, loop=self._loop)
-            raise # reraise per CancelledError semantics
+        batch = 0
+        while True:
+            if self._broadcast_batch and not self._broadcast_queue.empty():
+                # Queue.get() doesn't yield while broadcasts are waiting
+                batch += 1
+                if batch >= self._broadcast_batch:
+                    batch = 0
+                    yield from asyncio.sleep(0, loop=self._loop)
+            else:
+                batch = 0
+            broadcast = yield from self._broadcast_queue.get()
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("broadcasting %r" % broadcast)
+            # [MQTT-4.7.2-1] is handled by the subscription tree: $ topics are not routed to filters starting
+            # with + or #
+            # The PUBLISH packet is encoded once, on first delivery, and shared by all subscribers
+            frame = None
+            # Iterate over a snapshot of the subscribers, which may change while messages are queued
+            for subscriptions in self._subscriptions.match(broadcast['topic']):
+                for (target_session, qos) in tuple(subscriptions):
+                    if 'qos' in broadcast:
+                        qos = broadcast['qos']
+                    if target_session.transitions.state == 'connected':
+                        if self.logger.isEnabledFor(logging.DEBUG):
+                            self.logger.debug("broadcasting application message from %s on topic '%s' to %s" %
+                                              (format_client_message(session=broadcast['session']),
+                                               broadcast['topic'], format_client_message(session=target_session)))
+                        # Delivery is done by the handler writer task, in the order messages are queued. Queuing
+                        # never waits, so that a slow subscriber does not hold back other ones
+                        if frame is None:
+                            frame = PublishFrame(broadcast['topic'], broadcast['data'])
+                        handler = self._get_handler(target_session)
+                        handler.enqueue_message_nowait(frame, qos, False)
+                    elif qos is not None and qos > 0:
+                        if self.logger.isEnabledFor(logging.DEBUG):
+                            self.logger.debug("retaining application message from %s on topic '%s' to client '%s'" %
+                                              (format_client_message(session=broadcast['session']),
+                                               broadcast['topic'], format_client_message(session=target_session)))
+                        # Offline sessions queue the same frame, and payload, as connected subscribers
+                        if frame is None:
+                            frame = PublishFrame(broadcast['topic'], broadcast['data'])
+                        retained_message = RetainedApplicationMessage(
+                            broadcast['session'], broadcast['topic'], frame.data, qos, frame)
+                        target_session.retained_messages.put_nowait(retained_message)
+                        if not target_session.clean_session and self._get_session_stores():
+                            # Stores are not waited for, so that they don't hold back the broadcast
+                            self._queue_store_call('queue_message', target_session.client_id, retained_message)
+                        if self.logger.isEnabledFor(logging.DEBUG):
+                            self.logger.debug(f'target_session.retained_messages={target_session.retained_messages.qsize()}')
 
     @asyncio.coroutine
     def _broadcast_message_acl(self, session, topic, data, force_qos=None):
@@ -750,34 +989,25 @@ class Broker:
     @asyncio.coroutine
     def publish_session_retained_messages(self, session):
         self.logger.debug("Publishing %d messages retained for session %s" %
-                          (session.retained_messages.qsize(), format_client_message(session=session))
+                          (session.retained_messages_count, format_client_message(session=session))
                           )
-        publish_tasks = []
+        if not session.retained_messages_count:
+            return
         handler = self._get_handler(session)
         while not session.retained_messages.empty():
-            retained = yield from session.retained_messages.get()
-            publish_tasks.append(asyncio.ensure_future(
-                handler.mqtt_publish(
-                    retained.topic, retained.data, retained.qos, True), loop=self._loop))
-        if publish_tasks:
-            yield from asyncio.wait(publish_tasks, loop=self._loop)
+            retained = session.retained_messages.get_nowait()
+            yield from handler.mqtt_enqueue_message(retained.frame, retained.qos, True)
+        if not session.clean_session:
+            yield from self._store_call('save_queue', session.client_id, ())
 
     @asyncio.coroutine
     def publish_retained_messages_for_subscription(self, subscription, session):
         self.logger.debug("Begin broadcasting messages retained due to subscription on '%s' from %s" %
                           (subscription[0], format_client_message(session=session)))
-        publish_tasks = []
         handler = self._get_handler(session)
-        for d_topic in self._retained_messages:
-            self.logger.debug("matching : %s %s" % (d_topic, subscription[0]))
-            if self.matches(d_topic, subscription[0]):
-                self.logger.debug("%s and %s match" % (d_topic, subscription[0]))
-                retained = self._retained_messages[d_topic]
-                publish_tasks.append(asyncio.Task(
-                    handler.mqtt_publish(
-                        retained.topic, retained.data, subscription[1], True), loop=self._loop))
-        if publish_tasks:
-            yield from asyncio.wait(publish_tasks, loop=self._loop)
+        for retained in self._retained_messages.filter(subscription[0]):
+            self.logger.debug("%s and %s match" % (retained.topic, subscription[0]))
+            yield from handler.mqtt_enqueue_message(retained.frame, subscription[1], True)
         self.logger.debug("End broadcasting messages retained due to subscription on '%s' from %s" %
                           (subscription[0], format_client_message(session=session)))
 
@@ -787,6 +1017,12 @@ class Broker:
         :param client_id:
         :return:
         """
+        if self._get_session_stores():
+            # Queued before any later update of a new session with the same client id
+            self._queue_store_call('del_session', client_id)
+        if self._inflight_log is not None:
+            self._inflight_recovered.pop(client_id, None)
+            self._inflight_log.drop(client_id)
         try:
             session = self._sessions[client_id][0]
         except KeyError:
@@ -802,6 +1038,107 @@ class Broker:
         self.logger.debug("deleting existing session %s" % repr(self._sessions[client_id]))
         del self._sessions[client_id]
 
+    def _get_session_stores(self):
+        """
+        Get the plugins storing persistent sessions, selected by the 'plugins' parameter of the 'persistence'
+        configuration section. Sessions are not stored if this section is missing.
+        :return: list of plugin objects implementing find_session()
+        """
+        if self._session_stores is None:
+            stores = []
+            persistence_config = self.config.get('persistence', None)
+            if persistence_config:
+                store_plugins = persistence_config.get('plugins', None)
+                for plugin in self.plugins_manager.plugins:
+                    if plugin is None or (store_plugins is not None and plugin.name not in store_plugins):
+                        continue
+                    if getattr(plugin.object, 'find_session', None) is not None:
+                        stores.append(plugin.object)
+            self._session_stores = stores
+        return self._session_stores
+
+    def _queue_store_call(self, method_name, *args, waiter=None):
+        """
+        Queue a call of a coroutine of the session stores, without waiting for it. Calls run one at a time, in the
+        order they were queued, so that updates of a session are stored in order.
+        :param waiter: future set when the call is done
+        """
+        self._store_calls.append((method_name, args, waiter))
+        if self._store_task is None or self._store_task.done():
+            self._store_task = asyncio.ensure_future(self._run_store_calls(), loop=self._loop)
+
+    @asyncio.coroutine
+    def _run_store_calls(self):
+        while self._store_calls:
+            method_name, args, waiter = self._store_calls.popleft()
+            for store in self._get_session_stores():
+                try:
+                    yield from getattr(store, method_name)(*args)
+                except Exception as e:
+                    self.logger.error("Session store '%s' failed: %s" % (method_name, e))
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+    @asyncio.coroutine
+    def _store_call(self, method_name, *args):
+        """
+        Call a coroutine of the session stores, after the calls queued before
+        """
+        if not self._get_session_stores():
+            return
+        waiter = asyncio.Future(loop=self._loop)
+        self._queue_store_call(method_name, *args, waiter=waiter)
+        yield from waiter
+
+    @asyncio.coroutine
+    def _wait_store_calls(self):
+        """
+        Wait until queued session store calls are done
+        """
+        while self._store_task is not None and not self._store_task.done():
+            yield from asyncio.wait([self._store_task], loop=self._loop)
+
+    @asyncio.coroutine
+    def _store_session(self, session):
+        """
+        Store a persistent session of a disconnected client, with its offline queue
+        """
+        if not session.clean_session and self._get_session_stores():
+            yield from self._store_call('save_session', session)
+            yield from self._store_call('save_queue', session.client_id, session.retained_messages_snapshot())
+
+    @asyncio.coroutine
+    def _restore_session(self, session):
+        """
+        Restore a stored session in the session of a reconnecting client: messages in flight to the client, its
+        offline queue and its subscriptions. Sessions are restored on CONNECT only, so that starting the broker doesn't
+        depend on the number of stored sessions.
+        :return: True if a stored session has been found
+        """
+        if not self._get_session_stores():
+            return False
+        # Stores must read the updates queued before
+        yield from self._wait_store_calls()
+        for store in self._get_session_stores():
+            try:
+                stored = yield from store.find_session(session.client_id)
+                if stored is None:
+                    continue
+                subscriptions = yield from store.find_subscriptions(session.client_id)
+            except Exception as e:
+                self.logger.error("Failed restoring session %s: %s" % (session.client_id, e))
+                continue
+            self.logger.debug("Restoring stored session %s" % session.client_id)
+            session._packet_id = stored._packet_id
+            session.inflight_out = stored.inflight_out
+            session.retained_messages = stored.retained_messages
+            for a_filter, qos in subscriptions:
+                if a_filter not in self._subscriptions:
+                    self._subscriptions[a_filter] = []
+                self._subscriptions[a_filter].append((session, qos))
+            return True
+        return False
+
     def _get_handler(self, session):
         client_id = session.client_id
         if client_id:
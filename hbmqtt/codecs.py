@@ -2,10 +2,13 @@
 #
 # See the file license.txt for copying permission.
 import asyncio
-from struct import pack, unpack
+from struct import pack, unpack, Struct
 from hbmqtt.errors import NoDataException
 
 
+UINT16 = Struct('!H')
+
+
 def bytes_to_hex_str(data):
     """
     converts a sequence of bytes into its displayable hex representation, ie: 0x??????
@@ -121,3 +124,55 @@ def int_to_bytes_str(value: int) -> bytes:
     :return: bytes array
     """
     return str(value).encode('utf-8')
+
+
+def unpack_byte(buffer, offset: int):
+    """
+    Read a single byte from a buffer. NoDataException is raised if the buffer is exhausted
+    :param buffer: bytes-like object holding a packet
+    :param offset: position of the byte in buffer
+    :return: tuple (byte value, position following the byte)
+    """
+    if offset >= len(buffer):
+        raise NoDataException("No more data")
+    return buffer[offset], offset + 1
+
+
+def unpack_packet_id(buffer, offset: int):
+    """
+    Read a packet ID as 2-bytes int from a buffer according to MQTT specification (2.3.1)
+    :param buffer: bytes-like object holding a packet
+    :param offset: position of the packet ID in buffer
+    :return: tuple (packet ID, position following the packet ID)
+    """
+    if offset + 2 > len(buffer):
+        raise NoDataException("No more data")
+    return UINT16.unpack_from(buffer, offset)[0], offset + 2
+
+
+def unpack_data_with_length(buffer, offset: int):
+    """
+    Read data prefixed with 2 bytes length from a buffer
+    :param buffer: bytes-like object holding a packet
+    :param offset: position of the data length in buffer
+    :return: tuple (data bytes without length, position following the data)
+    """
+    data_length, offset = unpack_packet_id(buffer, offset)
+    end = offset + data_length
+    if end > len(buffer):
+        raise NoDataException("No more data")
+    return bytes(buffer[offset:end]), end
+
+
+def unpack_string(buffer, offset: int):
+    """
+    Read a string from a buffer and decode it according to MQTT string specification
+    :param buffer: bytes-like object holding a packet
+    :param offset: position of the string length in buffer
+    :return: tuple (UTF-8 string, position following the string)
+    """
+    byte_str, offset = unpack_data_with_length(buffer, offset)
+    try:
+        return byte_str.decode(encoding='utf-8'), offset
+    except UnicodeDecodeError:
+        return str(byte_str), offset
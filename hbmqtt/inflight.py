@@ -0,0 +1,344 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+import asyncio
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from hbmqtt.mqtt.pubrel import PubrelPacket
+from hbmqtt.session import OutgoingApplicationMessage, IncomingApplicationMessage
+
+# Record: crc32 of the body, body length, then the body: type, packet id, client id length, client id and for
+# PUBLISH records flags, topic length, payload length, topic and payload
+_RECORD = struct.Struct('!II')
+_ENTRY = struct.Struct('!BHH')
+_MESSAGE = struct.Struct('!BHI')
+
+PUBLISH_OUT = 1
+PUBREL_OUT = 2
+ACK_OUT = 3
+PUBLISH_IN = 4
+ACK_IN = 5
+DROP = 6
+
+_QOS_MASK = 0x03
+_RETAIN = 0x04
+_PUBREL_SENT = 0x08
+
+_OUT = 0
+_IN = 1
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_record(record_type, client_id, packet_id, flags=0, topic=None, data=None):
+    client_id = client_id.encode('utf-8')
+    parts = [_ENTRY.pack(record_type, packet_id or 0, len(client_id)), client_id]
+    if topic is not None:
+        topic = topic.encode('utf-8')
+        parts.append(_MESSAGE.pack(flags, len(topic), len(data)))
+        parts.append(topic)
+        parts.append(bytes(data))
+    body = b''.join(parts)
+    return _RECORD.pack(zlib.crc32(body), len(body)) + body
+
+
+def _message_flags(message):
+    return (message.qos & _QOS_MASK) | (_RETAIN if message.retain else 0)
+
+
+def iter_records(data):
+    """
+    Iterate over the records of a log, until its end or its first invalid record (written partially by a crash)
+    :param data: log content
+    :return: generator of (type, client id, packet id, flags, topic, payload) tuples
+    """
+    data = memoryview(data)
+    offset = 0
+    while offset + _RECORD.size <= len(data):
+        crc, length = _RECORD.unpack_from(data, offset)
+        start = offset + _RECORD.size
+        body = data[start:start + length]
+        if len(body) != length or zlib.crc32(body) != crc:
+            logger.warning("In-flight log truncated at %d: invalid record" % offset)
+            return
+        record_type, packet_id, client_id_length = _ENTRY.unpack_from(body)
+        position = _ENTRY.size + client_id_length
+        client_id = bytes(body[_ENTRY.size:position]).decode('utf-8')
+        flags, topic, payload = 0, None, None
+        if record_type in (PUBLISH_OUT, PUBLISH_IN):
+            flags, topic_length, payload_length = _MESSAGE.unpack_from(body, position)
+            position += _MESSAGE.size
+            topic = bytes(body[position:position + topic_length]).decode('utf-8')
+            position += topic_length
+            payload = bytes(body[position:position + payload_length])
+        yield record_type, client_id, packet_id, flags, topic, payload
+        offset = start + length
+
+
+class InflightLog:
+    """
+    Write-ahead log of the QoS 1 and QoS 2 messages in flight between the broker and persistent sessions, so that
+    they are delivered again after a broker crash.
+
+    The protocol handlers record PUBLISH packets sent to clients, PUBREL packets sent after a PUBREC and
+    acknowledgements (PUBACK, PUBCOMP), as well as QoS 2 PUBLISH packets received until their PUBREL. Records are
+    written by a thread which commits the records of all sessions with a single fsync every ``commit_interval``
+    seconds. Handlers wait for :meth:`commit` only before taking over a message, before sending PUBREC.
+
+    When more than ``max_size`` bytes were appended since the log was last rewritten, it is rewritten with the messages
+    still in flight.
+    """
+
+    def __init__(self, path, commit_interval=0.005, max_size=16 * 1024 * 1024, loop=None):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.max_size = max_size
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        # Messages in flight, by client id and (direction, packet id)
+        self._live = dict()
+        self._size = 0
+        self._condition = threading.Condition()
+        self._pending = []
+        self._appended = 0
+        self._synced = 0
+        self._waiters = []
+        self._closing = False
+        self._thread = None
+        self.commits = 0
+
+    def recover(self):
+        """
+        Read the log and start writing it
+        :return: dict of (inflight_out, inflight_in) tuples by client id, each one an OrderedDict of messages by
+        packet id
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        live = self._live
+        for record_type, client_id, packet_id, flags, topic, payload in iter_records(data):
+            if record_type == PUBLISH_OUT:
+                live.setdefault(client_id, OrderedDict())[(_OUT, packet_id)] = [flags, topic, payload]
+            elif record_type == PUBLISH_IN:
+                live.setdefault(client_id, OrderedDict())[(_IN, packet_id)] = [flags, topic, payload]
+            elif record_type == PUBREL_OUT:
+                entry = live.get(client_id, {}).get((_OUT, packet_id))
+                if entry is not None:
+                    entry[0] |= _PUBREL_SENT
+            elif record_type in (ACK_OUT, ACK_IN):
+                self._discard(client_id, (_OUT if record_type == ACK_OUT else _IN, packet_id))
+            elif record_type == DROP:
+                live.pop(client_id, None)
+        # Start from a log holding the messages still in flight only
+        snapshot = self._snapshot()
+        path = self.path + '.tmp'
+        with open(path, 'wb') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path, self.path)
+        self._thread = threading.Thread(target=self._run, name='hbmqtt-inflight-log', daemon=True)
+        self._thread.start()
+
+        sessions = dict()
+        for client_id, entries in live.items():
+            inflight_out, inflight_in = OrderedDict(), OrderedDict()
+            for (direction, packet_id), (flags, topic, payload) in entries.items():
+                if direction == _OUT:
+                    message = OutgoingApplicationMessage(packet_id, topic, flags & _QOS_MASK, payload,
+                                                         bool(flags & _RETAIN))
+                    # Recovered messages are resent as retries by the protocol handler
+                    message.publish_packet = message.build_publish_packet()
+                    if flags & _PUBREL_SENT:
+                        message.pubrel_packet = PubrelPacket.build(packet_id)
+                    inflight_out[packet_id] = message
+                else:
+                    message = IncomingApplicationMessage(packet_id, topic, flags & _QOS_MASK, payload,
+                                                         bool(flags & _RETAIN))
+                    message.publish_packet = message.build_publish_packet()
+                    inflight_in[packet_id] = message
+            sessions[client_id] = (inflight_out, inflight_in)
+        return sessions
+
+    def _discard(self, client_id, key):
+        entries = self._live.get(client_id)
+        if entries is not None:
+            entries.pop(key, None)
+            if not entries:
+                del self._live[client_id]
+
+    def _snapshot(self):
+        parts = []
+        for client_id, entries in self._live.items():
+            for (direction, packet_id), (flags, topic, payload) in entries.items():
+                parts.append(_encode_record(PUBLISH_OUT if direction == _OUT else PUBLISH_IN,
+                                            client_id, packet_id, flags, topic, payload))
+        return b''.join(parts)
+
+    def _append(self, record, snapshot=False):
+        with self._condition:
+            self._pending.append((snapshot, record))
+            self._appended += 1
+            if len(self._pending) == 1:
+                self._condition.notify()
+        if snapshot:
+            self._size = 0
+        else:
+            self._size += len(record)
+            if self._size > self.max_size:
+                self._append(self._snapshot(), True)
+
+    def publish_out(self, client_id, message):
+        """
+        Record a QoS 1 or QoS 2 message sent to a client
+        """
+        flags = _message_flags(message)
+        self._live.setdefault(client_id, OrderedDict())[(_OUT, message.packet_id)] = [
+            flags, message.topic, message.data]
+        self._append(_encode_record(PUBLISH_OUT, client_id, message.packet_id, flags, message.topic, message.data))
+
+    def pubrel_out(self, client_id, packet_id):
+        """
+        Record the PUBREL sent to a client for a QoS 2 message
+        """
+        entry = self._live.get(client_id, {}).get((_OUT, packet_id))
+        if entry is not None:
+            entry[0] |= _PUBREL_SENT
+            self._append(_encode_record(PUBREL_OUT, client_id, packet_id))
+
+    def ack_out(self, client_id, packet_id):
+        """
+        Record the PUBACK or PUBCOMP received for a message sent to a client
+        """
+        self._discard(client_id, (_OUT, packet_id))
+        self._append(_encode_record(ACK_OUT, client_id, packet_id))
+
+    def publish_in(self, client_id, message):
+        """
+        Record a QoS 2 message received from a client. Wait for :meth:`commit` before acknowledging it.
+        """
+        flags = _message_flags(message)
+        self._live.setdefault(client_id, OrderedDict())[(_IN, message.packet_id)] = [
+            flags, message.topic, message.data]
+        self._append(_encode_record(PUBLISH_IN, client_id, message.packet_id, flags, message.topic, message.data))
+
+    def ack_in(self, client_id, packet_id):
+        """
+        Record the PUBREL received for a QoS 2 message, once the message is delivered
+        """
+        self._discard(client_id, (_IN, packet_id))
+        self._append(_encode_record(ACK_IN, client_id, packet_id))
+
+    def drop(self, client_id):
+        """
+        Forget the messages in flight of a session, when it is deleted
+        """
+        if self._live.pop(client_id, None) is not None:
+            self._append(_encode_record(DROP, client_id, 0))
+
+    @asyncio.coroutine
+    def commit(self):
+        """
+        Wait until the records appended until now are written to disk
+        :raise OSError: if they could not be written
+        """
+        sequence = self._appended
+        if self._synced >= sequence or self._thread is None:
+            return
+        waiter = asyncio.Future(loop=self._loop)
+        self._waiters.append((sequence, waiter))
+        yield from waiter
+
+    def _committed(self, sequence):
+        waiters = []
+        for waiter_sequence, waiter in self._waiters:
+            if waiter_sequence <= sequence:
+                if not waiter.done():
+                    waiter.set_result(None)
+            else:
+                waiters.append((waiter_sequence, waiter))
+        self._waiters = waiters
+
+    def _failed(self, sequence, exc):
+        waiters = []
+        for waiter_sequence, waiter in self._waiters:
+            if waiter_sequence <= sequence:
+                if not waiter.done():
+                    waiter.set_exception(exc)
+            else:
+                waiters.append((waiter_sequence, waiter))
+        self._waiters = waiters
+        if self._thread is not None and not self._closing:
+            # Records of the failed batch are written again with the messages still in flight
+            self._append(self._snapshot(), True)
+
+    def _run(self):
+        f = None
+        try:
+            while True:
+                with self._condition:
+                    while not self._pending and not self._closing:
+                        self._condition.wait()
+                    closing = self._closing
+                if not closing:
+                    # Gather the records of all sessions appended meanwhile in the same commit
+                    time.sleep(self.commit_interval)
+                with self._condition:
+                    batch, self._pending = self._pending, []
+                    sequence = self._appended
+                if not batch:
+                    break
+                try:
+                    if f is None or f.closed:
+                        f = open(self.path, 'ab')
+                    f = self._write(f, batch)
+                except OSError as e:
+                    logger.error("Failed writing %d in-flight log records: %s" % (len(batch), e))
+                    self._loop.call_soon_threadsafe(self._failed, sequence, e)
+                    continue
+                self.commits += 1
+                self._synced = sequence
+                self._loop.call_soon_threadsafe(self._committed, sequence)
+        finally:
+            if f is not None:
+                f.close()
+
+    def _write(self, f, batch):
+        snapshots = [i for i, (snapshot, data) in enumerate(batch) if snapshot]
+        if snapshots:
+            # Records before the last snapshot are part of it
+            path = self.path + '.tmp'
+            with open(path, 'wb') as tmp:
+                tmp.writelines(data for snapshot, data in batch[snapshots[-1]:])
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            os.replace(path, self.path)
+            f.close()
+            return open(self.path, 'ab')
+        f.writelines(data for snapshot, data in batch)
+        f.flush()
+        os.fsync(f.fileno())
+        return f
+
+    def close(self):
+        """
+        Write the messages still in flight and stop the writer thread
+        """
+        if self._thread is None:
+            return
+        self._append(self._snapshot(), True)
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+        self._committed(self._synced)
+        self._failed(self._appended, OSError("In-flight log closed before records were written"))
@@ -0,0 +1,116 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+from hbmqtt.mqtt import packet_dict
+from hbmqtt.mqtt.packet import MQTTFixedHeader
+from hbmqtt.codecs import bytes_to_hex_str
+from hbmqtt.errors import MQTTException
+
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+class PacketDecoder:
+    """
+    Incremental MQTT packet decoder, free of any I/O.
+    Bytes are written into a preallocated buffer (:meth:`get_buffer` and :meth:`buffer_updated`, as used by
+    ``asyncio.BufferedProtocol``) or copied into it with :meth:`feed`. Every call decodes all the complete packets
+    available in the buffer and keeps the incomplete tail for the next call.
+    """
+
+    __slots__ = ('_buffer', '_start', '_end')
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self._buffer = bytearray(buffer_size)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        """
+        Number of bytes buffered and not decoded yet
+        """
+        return self._end - self._start
+
+    def get_buffer(self, sizehint=-1):
+        """
+        Get a writable view on the free space of the buffer. The buffer is compacted, or grown, so that at least
+        ``sizehint`` bytes, and at least a quarter of the buffer, are available.
+        :param sizehint: minimum free size wished, -1 for any
+        :return: memoryview
+        """
+        pending = self._end - self._start
+        wanted = max(sizehint, len(self._buffer) // 4, 1)
+        if len(self._buffer) - self._end < wanted:
+            size = len(self._buffer)
+            while size - pending < wanted:
+                size *= 2
+            if size == len(self._buffer):
+                # Move the incomplete tail to the start of the buffer
+                self._buffer[:pending] = self._buffer[self._start:self._end]
+            else:
+                # Views previously returned keep a reference to the old buffer, so it can't be resized
+                buffer = bytearray(size)
+                buffer[:pending] = self._buffer[self._start:self._end]
+                self._buffer = buffer
+            self._start = 0
+            self._end = pending
+        return memoryview(self._buffer)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """
+        Decode the packets completed by ``nbytes`` written into the view given by :meth:`get_buffer`
+        :param nbytes: number of bytes written
+        :return: list of decoded packets
+        """
+        self._end += nbytes
+        return self._decode()
+
+    def feed(self, data):
+        """
+        Copy data into the buffer and decode the packets it completes
+        :param data: bytes-like object
+        :return: list of decoded packets
+        """
+        buffer = self.get_buffer(len(data))
+        buffer[:len(data)] = data
+        return self.buffer_updated(len(data))
+
+    def _decode(self):
+        packets = []
+        buffer = self._buffer
+        start = self._start
+        end = self._end
+        with memoryview(buffer) as view:
+            while end - start >= 2:
+                # Fixed header: packet type and flags, then 1 to 4 bytes of remaining length
+                byte1 = buffer[start]
+                remaining_length = 0
+                multiplier = 1
+                pos = start + 1
+                while True:
+                    if pos == end:
+                        break
+                    encoded_byte = buffer[pos]
+                    pos += 1
+                    remaining_length += (encoded_byte & 0x7f) * multiplier
+                    if not encoded_byte & 0x80:
+                        break
+                    multiplier *= 128
+                    if multiplier > 128 * 128 * 128:
+                        raise MQTTException("Invalid remaining length bytes:%s, packet_type=%d" %
+                                            (bytes_to_hex_str(buffer[start + 1:pos]), byte1 >> 4))
+                if encoded_byte & 0x80 or pos + remaining_length > end:
+                    # Incomplete packet
+                    break
+                fixed_header = MQTTFixedHeader(byte1 >> 4, byte1 & 0x0f, remaining_length)
+                try:
+                    cls = packet_dict[fixed_header.packet_type]
+                except KeyError:
+                    raise MQTTException("Received reserved packet type %d" % fixed_header.packet_type)
+                packets.append(cls.from_bytes(fixed_header, view[pos:pos + remaining_length]))
+                start = pos + remaining_length
+        if start == end:
+            start = end = 0
+        self._start = start
+        self._end = end
+        return packets
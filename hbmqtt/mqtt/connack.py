@@ -4,7 +4,7 @@
 import asyncio
 from hbmqtt.mqtt.packet import CONNACK, MQTTPacket, MQTTFixedHeader, MQTTVariableHeader
 from hbmqtt.codecs import read_or_raise, bytes_to_int
-from hbmqtt.errors import HBMQTTException
+from hbmqtt.errors import HBMQTTException, NoDataException
 from hbmqtt.adapters import ReaderAdapter
 
 CONNECTION_ACCEPTED = 0x00
@@ -32,6 +32,12 @@ class ConnackVariableHeader(MQTTVariableHeader):
         return_code = bytes_to_int(data[1])
         return cls(session_parent, return_code)
 
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader):
+        if offset + 2 > len(buffer):
+            raise NoDataException("No more data")
+        return cls(buffer[offset] & 0x01, buffer[offset + 1]), offset + 2
+
     def to_bytes(self):
         out = bytearray(2)
         # Connect acknowledge flags
@@ -2,14 +2,20 @@
 #
 # See the file license.txt for copying permission.
 import asyncio
+from struct import Struct
 
-from hbmqtt.codecs import bytes_to_int, decode_data_with_length, decode_string, encode_data_with_length, encode_string, int_to_bytes, read_or_raise
+from hbmqtt.codecs import bytes_to_int, decode_data_with_length, decode_string, encode_data_with_length, encode_string, int_to_bytes, read_or_raise, \
+    unpack_data_with_length, unpack_string
 from hbmqtt.mqtt.packet import MQTTPacket, MQTTFixedHeader, CONNECT, MQTTVariableHeader, MQTTPayload
 from hbmqtt.errors import HBMQTTException, NoDataException
 from hbmqtt.adapters import ReaderAdapter
 from hbmqtt.utils import gen_client_id
 
 
+# Protocol level, connect flags and keep alive, following the protocol name in the variable header
+LEVEL_FLAGS_KEEP_ALIVE = Struct('!BBH')
+
+
 class ConnectVariableHeader(MQTTVariableHeader):
 
     __slots__ = ('proto_name', 'proto_level', 'flags', 'keep_alive')
@@ -118,6 +124,14 @@ class ConnectVariableHeader(MQTTVariableHeader):
 
         return cls(flags, keep_alive, protocol_name, protocol_level)
 
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader):
+        protocol_name, offset = unpack_string(buffer, offset)
+        if offset + LEVEL_FLAGS_KEEP_ALIVE.size > len(buffer):
+            raise NoDataException("No more data")
+        protocol_level, flags, keep_alive = LEVEL_FLAGS_KEEP_ALIVE.unpack_from(buffer, offset)
+        return cls(flags, keep_alive, protocol_name, protocol_level), offset + LEVEL_FLAGS_KEEP_ALIVE.size
+
     def to_bytes(self):
         out = bytearray()
 
@@ -198,6 +212,45 @@ class ConnectPayload(MQTTPayload):
 
         return payload
 
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader, variable_header: ConnectVariableHeader):
+        payload = cls()
+        #  Client identifier
+        try:
+            payload.client_id, offset = unpack_string(buffer, offset)
+        except NoDataException:
+            payload.client_id = None
+
+        if (payload.client_id is None or payload.client_id == ""):
+            # A Server MAY allow a Client to supply a ClientId that has a length of zero bytes
+            # [MQTT-3.1.3-6]
+            payload.client_id = gen_client_id()
+            # indicator to trow exception in case CLEAN_SESSION_FLAG is set to False
+            payload.client_id_is_random = True
+
+        # Read will topic, username and password
+        if variable_header.will_flag:
+            try:
+                payload.will_topic, offset = unpack_string(buffer, offset)
+                payload.will_message, offset = unpack_data_with_length(buffer, offset)
+            except NoDataException:
+                payload.will_topic = None
+                payload.will_message = None
+
+        if variable_header.username_flag:
+            try:
+                payload.username, offset = unpack_string(buffer, offset)
+            except NoDataException:
+                payload.username = None
+
+        if variable_header.password_flag:
+            try:
+                payload.password, offset = unpack_string(buffer, offset)
+            except NoDataException:
+                payload.password = None
+
+        return payload
+
     def to_bytes(self, fixed_header: MQTTFixedHeader, variable_header: ConnectVariableHeader):
         out = bytearray()
         # Client identifier
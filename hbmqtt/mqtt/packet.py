@@ -3,11 +3,10 @@
 # See the file license.txt for copying permission.
 import asyncio
 
-from hbmqtt.codecs import bytes_to_hex_str, decode_packet_id, int_to_bytes, read_or_raise
+from hbmqtt.codecs import bytes_to_hex_str, decode_packet_id, int_to_bytes, read_or_raise, unpack_packet_id
 from hbmqtt.errors import CodecException, MQTTException, NoDataException
 from hbmqtt.adapters import ReaderAdapter, WriterAdapter
 from datetime import datetime
-from struct import unpack
 
 
 RESERVED_0 = 0x00
@@ -78,36 +77,24 @@ class MQTTFixedHeader:
         Read and decode MQTT message fixed header from stream
         :return: FixedHeader instance
         """
-        @asyncio.coroutine
-        def decode_remaining_length():
-            """
-            Decode message length according to MQTT specifications
-            :return:
-            """
-            multiplier = 1
-            value = 0
-            buffer = bytearray()
-            while True:
-                encoded_byte = yield from reader.read(1)
-                int_byte = unpack('!B', encoded_byte)
-                buffer.append(int_byte[0])
-                value += (int_byte[0] & 0x7f) * multiplier
-                if (int_byte[0] & 0x80) == 0:
-                    break
-                else:
-                    multiplier *= 128
-                    if multiplier > 128 * 128 * 128:
-                        raise MQTTException("Invalid remaining length bytes:%s, packet_type=%d" % (bytes_to_hex_str(buffer), msg_type))
-            return value
-
         try:
-            byte1 = yield from read_or_raise(reader, 1)
-            int1 = unpack('!B', byte1)
-            msg_type = (int1[0] & 0xf0) >> 4
-            flags = int1[0] & 0x0f
-            remain_length = yield from decode_remaining_length()
-
-            return cls(msg_type, flags, remain_length)
+            # A fixed header holds at least 2 bytes: packet type and flags, then the remaining length
+            header = yield from read_or_raise(reader, 2)
+            if len(header) < 2:
+                return None
+            byte1, encoded_byte = header[0], header[1]
+            remain_length = encoded_byte & 0x7f
+            multiplier = 128
+            while encoded_byte & 0x80:
+                if multiplier > 128 * 128 * 128:
+                    raise MQTTException("Invalid remaining length bytes:%s, packet_type=%d" %
+                                        (bytes_to_hex_str(header), byte1 >> 4))
+                encoded_byte = (yield from read_or_raise(reader, 1))[0]
+                header += bytes((encoded_byte,))
+                remain_length += (encoded_byte & 0x7f) * multiplier
+                multiplier *= 128
+
+            return cls(byte1 >> 4, byte1 & 0x0f, remain_length)
         except NoDataException:
             return None
 
@@ -140,6 +127,16 @@ class MQTTVariableHeader:
     def from_stream(cls, reader: asyncio.StreamReader, fixed_header: MQTTFixedHeader):
         pass
 
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader):
+        """
+        Decode header data from a buffer holding the whole packet, without the fixed header
+        :param buffer: memoryview of the packet bytes
+        :param offset: position of the variable header in buffer
+        :param fixed_header: packet fixed header
+        :return: tuple (variable header instance, position following the variable header)
+        """
+
 
 class PacketIdVariableHeader(MQTTVariableHeader):
 
@@ -160,6 +157,11 @@ class PacketIdVariableHeader(MQTTVariableHeader):
         packet_id = yield from decode_packet_id(reader)
         return cls(packet_id)
 
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader):
+        packet_id, offset = unpack_packet_id(buffer, offset)
+        return cls(packet_id), offset
+
     def __repr__(self):
         return type(self).__name__ + '(packet_id={0})'.format(self.packet_id)
 
@@ -182,6 +184,17 @@ class MQTTPayload:
                     variable_header: MQTTVariableHeader):
         pass
 
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader, variable_header: MQTTVariableHeader):
+        """
+        Decode payload data from a buffer holding the whole packet, without the fixed header
+        :param buffer: memoryview of the packet bytes
+        :param offset: position of the payload in buffer, which extends up to the end of buffer
+        :param fixed_header: packet fixed header
+        :param variable_header: packet variable header
+        :return: payload instance
+        """
+
 
 class MQTTPacket:
 
@@ -199,10 +212,18 @@ class MQTTPacket:
 
     @asyncio.coroutine
     def to_stream(self, writer: asyncio.StreamWriter):
-        writer.write(self.to_bytes())
+        writer.writelines(self.to_buffers())
         yield from writer.drain()
         self.protocol_ts = datetime.now()
 
+    def to_buffers(self):
+        """
+        Serialize the packet as a list of bytes-like objects, whose concatenation is the packet encoding.
+        Packets carrying large data, like PUBLISH, reference their payload instead of copying it.
+        :return: list of bytes-like objects
+        """
+        return [self.to_bytes()]
+
     def to_bytes(self) -> bytes:
         if self.variable_header:
             variable_header_bytes = self.variable_header.to_bytes()
@@ -221,26 +242,55 @@ class MQTTPacket:
     @classmethod
     @asyncio.coroutine
     def from_stream(cls, reader: ReaderAdapter, fixed_header=None, variable_header=None):
+        """
+        Read a whole packet from stream with a single read and decode it with :meth:`from_bytes`
+        :param reader: reader adapter
+        :param fixed_header: packet fixed header, if it has already been read from stream
+        :param variable_header: packet variable header, if it has already been read from stream
+        :return: packet instance
+        """
         if fixed_header is None:
             fixed_header = yield from cls.FIXED_HEADER.from_stream(reader)
+        length = fixed_header.remaining_length
+        if variable_header is not None:
+            length -= variable_header.bytes_length
+        if length > 0:
+            data = yield from read_or_raise(reader, length)
+            if len(data) < length:
+                raise NoDataException("No more data")
+        else:
+            data = b''
+        instance = cls.from_bytes(fixed_header, data, variable_header)
+        instance.protocol_ts = datetime.now()
+        return instance
+
+    @classmethod
+    def from_bytes(cls, fixed_header: MQTTFixedHeader, data, variable_header=None):
+        """
+        Decode a packet from the bytes following its fixed header
+        :param fixed_header: packet fixed header
+        :param data: packet bytes, without the fixed header
+        :param variable_header: packet variable header, if data doesn't contain it
+        :return: packet instance
+        """
+        buffer = memoryview(data)
+        offset = 0
         if cls.VARIABLE_HEADER:
             if variable_header is None:
-                variable_header = yield from cls.VARIABLE_HEADER.from_stream(reader, fixed_header)
+                variable_header, offset = cls.VARIABLE_HEADER.decode(buffer, offset, fixed_header)
         else:
             variable_header = None
         if cls.PAYLOAD:
-            payload = yield from cls.PAYLOAD.from_stream(reader, fixed_header, variable_header)
+            payload = cls.PAYLOAD.decode(buffer, offset, fixed_header, variable_header)
         else:
             payload = None
 
         if fixed_header and not variable_header and not payload:
-            instance = cls(fixed_header)
+            return cls(fixed_header)
         elif fixed_header and not payload:
-            instance = cls(fixed_header, variable_header)
+            return cls(fixed_header, variable_header)
         else:
-            instance = cls(fixed_header, variable_header, payload)
-        instance.protocol_ts = datetime.now()
-        return instance
+            return cls(fixed_header, variable_header, payload)
 
     @property
     def bytes_length(self):
@@ -2,7 +2,7 @@
 #
 # See the file license.txt for copying permission.
 import asyncio
-from asyncio import futures, Queue
+from asyncio import futures, Queue, QueueFull
 from hbmqtt.mqtt.protocol.handler import ProtocolHandler
 from hbmqtt.mqtt.connack import (
     CONNECTION_ACCEPTED, UNACCEPTABLE_PROTOCOL_VERSION, IDENTIFIER_REJECTED,
@@ -10,37 +10,224 @@ from hbmqtt.mqtt.connack import (
 from hbmqtt.mqtt.connect import ConnectPacket
 from hbmqtt.mqtt.pingreq import PingReqPacket
 from hbmqtt.mqtt.pingresp import PingRespPacket
+from hbmqtt.mqtt.puback import PubackPacket
+from hbmqtt.mqtt.pubrec import PubrecPacket
+from hbmqtt.mqtt.pubrel import PubrelPacket
+from hbmqtt.mqtt.pubcomp import PubcompPacket
+from hbmqtt.mqtt.publish import PublishPacket, PublishFrame
 from hbmqtt.mqtt.subscribe import SubscribePacket
 from hbmqtt.mqtt.suback import SubackPacket
 from hbmqtt.mqtt.unsubscribe import UnsubscribePacket
 from hbmqtt.mqtt.unsuback import UnsubackPacket
 from hbmqtt.utils import format_client_message
-from hbmqtt.session import Session
+from hbmqtt.session import Session, OutgoingApplicationMessage, RetainedApplicationMessage
+from hbmqtt.mqtt.constants import QOS_0
 from hbmqtt.plugins.manager import PluginManager
-from hbmqtt.adapters import ReaderAdapter, WriterAdapter
+from hbmqtt.adapters import ReaderAdapter, WriterAdapter, PacketReaderAdapter
 from hbmqtt.errors import MQTTException
 from .handler import EVENT_MQTT_PACKET_RECEIVED, EVENT_MQTT_PACKET_SENT
 
 
 class BrokerProtocolHandler(ProtocolHandler):
-    def __init__(self, plugins_manager: PluginManager, session: Session=None, loop=None):
+    def __init__(self, plugins_manager: PluginManager, session: Session=None, loop=None, outgoing_queue_size=0,
+                 max_inflight_messages=0):
         super().__init__(plugins_manager, session, loop)
         self._disconnect_waiter = None
         self._pending_subscriptions = Queue(loop=self._loop)
         self._pending_unsubscriptions = Queue(loop=self._loop)
+        # Messages waiting to be sent to the client, drained in order by a single writer task
+        self._outgoing_queue = Queue(maxsize=outgoing_queue_size, loop=self._loop)
+        self._writer_task = None
+        # QOS_1 and QOS_2 messages sent by the writer task and not acknowledged yet. The writer task waits for
+        # acknowledgments before sending more than max_inflight_messages of them
+        self._max_inflight_messages = max_inflight_messages
+        self._inflight_sent = 0
+        self._inflight_waiter = None
+        # Message taken from the outgoing queue while the writer task waits for acknowledgments
+        self._held_message = None
+        # Set when the outgoing queue overflowed or the handler stopped: QOS_1 and QOS_2 messages are then queued
+        # in the session, to be delivered when the client reconnects without clean session
+        self._divert_to_session = False
 
     @asyncio.coroutine
     def start(self):
         yield from super().start()
         if self._disconnect_waiter is None:
             self._disconnect_waiter = futures.Future(loop=self._loop)
+        if self._writer_task is None:
+            self._writer_task = asyncio.ensure_future(self._writer_loop(), loop=self._loop)
+        self._divert_to_session = False
 
     @asyncio.coroutine
     def stop(self):
+        if self._writer_task is not None and not self._writer_task.done():
+            self._writer_task.cancel()
+            yield from asyncio.wait([self._writer_task], loop=self._loop)
+        self._divert_to_session = True
+        self._requeue_outgoing_messages()
         yield from super().stop()
         if self._disconnect_waiter is not None and not self._disconnect_waiter.done():
             self._disconnect_waiter.set_result(None)
 
+    def _requeue_outgoing_messages(self):
+        """
+        Move QOS_1 and QOS_2 messages not sent yet to the session queue, so they are delivered when the client
+        reconnects. They are queued before the messages already diverted to the session queue, which are more
+        recent. QOS_0 messages, and all messages of clean sessions, are discarded.
+        """
+        messages = []
+        keep = self.session is not None and not self.session.clean_session
+        if self._held_message is not None:
+            frame, qos, retain = self._held_message
+            self._held_message = None
+            if keep:
+                messages.append(RetainedApplicationMessage(None, frame.topic_name, frame.data, qos, frame))
+        while not self._outgoing_queue.empty():
+            frame, qos, retain = self._outgoing_queue.get_nowait()
+            if qos != QOS_0 and keep:
+                messages.append(RetainedApplicationMessage(None, frame.topic_name, frame.data, qos, frame))
+        if messages:
+            session_queue = self.session.retained_messages
+            while not session_queue.empty():
+                messages.append(session_queue.get_nowait())
+            for message in messages:
+                session_queue.put_nowait(message)
+
+    @asyncio.coroutine
+    def mqtt_enqueue_message(self, frame: PublishFrame, qos, retain):
+        """
+        Queue a message for delivery to the client. Messages are sent in the order they were queued by the handler
+        writer task, acknowledgments are handled when PUBACK, PUBREC and PUBCOMP packets are received.
+        When the queue is full, QOS_0 messages are discarded while this method waits for a free slot for
+        QOS_1 and QOS_2 messages. Used for messages sent to this client only, see enqueue_message_nowait() for
+        broadcasts.
+        :param frame: encoded topic and data, possibly shared with other subscribers
+        :param qos: quality of service to use for message flow
+        :param retain: retain message flag
+        """
+        if qos == QOS_0:
+            try:
+                self._outgoing_queue.put_nowait((frame, qos, retain))
+            except QueueFull:
+                self.logger.warning("outgoing messages queue full. QOS_0 message discarded")
+        else:
+            yield from self._outgoing_queue.put((frame, qos, retain))
+
+    def enqueue_message_nowait(self, frame: PublishFrame, qos, retain):
+        """
+        Queue a message for delivery to the client without waiting, so that a slow client does not hold back the
+        broadcast of messages to other clients.
+        When the queue is full, QOS_0 messages are discarded. QOS_1 and QOS_2 messages are queued in the session, as
+        for a disconnected client, and the client is disconnected: messages are delivered when it reconnects, unless
+        it uses a clean session, for which they are discarded.
+        :param frame: encoded topic and data, possibly shared with other subscribers
+        :param qos: quality of service to use for message flow
+        :param retain: retain message flag
+        """
+        if not self._divert_to_session:
+            try:
+                self._outgoing_queue.put_nowait((frame, qos, retain))
+                return
+            except QueueFull:
+                if qos == QOS_0:
+                    self.logger.warning("outgoing messages queue full. QOS_0 message discarded")
+                    return
+                self.logger.warning("%s outgoing messages queue full, disconnecting client" %
+                                    self.session.client_id)
+                self._divert_to_session = True
+                if self._disconnect_waiter is not None and not self._disconnect_waiter.done():
+                    self._disconnect_waiter.set_result(None)
+        if qos != QOS_0 and self.session is not None and not self.session.clean_session:
+            self.session.retained_messages.put_nowait(
+                RetainedApplicationMessage(None, frame.topic_name, frame.data, qos, frame))
+
+    @asyncio.coroutine
+    def _writer_loop(self):
+        self.logger.debug("%s Starting writer coro" % self.session.client_id)
+        while True:
+            try:
+                frame, qos, retain = yield from self._outgoing_queue.get()
+                if qos == QOS_0:
+                    packet = PublishPacket.build_from_frame(frame, None, False, qos, retain)
+                else:
+                    if self._max_inflight_messages and self._inflight_sent >= self._max_inflight_messages:
+                        self._held_message = (frame, qos, retain)
+                        while self._inflight_sent >= self._max_inflight_messages:
+                            self._inflight_waiter = futures.Future(loop=self._loop)
+                            yield from self._inflight_waiter
+                        self._held_message = None
+                    message = OutgoingApplicationMessage(
+                        self.session.next_packet_id, frame.topic_name, qos, frame.data, retain)
+                    self.session.inflight_out[message.packet_id] = message
+                    self._inflight_sent += 1
+                    if self.inflight_log is not None:
+                        self.inflight_log.publish_out(self.session.client_id, message)
+                    packet = message.publish_packet = PublishPacket.build_from_frame(
+                        frame, message.packet_id, False, qos, retain)
+                yield from self._send_packet(packet)
+            except asyncio.CancelledError:
+                self.logger.debug("Task cancelled, writer loop ending")
+                break
+            except Exception as e:
+                self.logger.warning("%s Unhandled exception in writer coro: %r" % (type(self).__name__, e))
+        self.logger.debug("Writer coro stopped")
+
+    def _inflight_acknowledged(self):
+        # Messages resent from a previous connection are acknowledged too, they are not counted
+        if self._inflight_sent > 0:
+            self._inflight_sent -= 1
+        waiter = self._inflight_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    @asyncio.coroutine
+    def handle_puback(self, puback: PubackPacket):
+        packet_id = puback.variable_header.packet_id
+        if packet_id in self._puback_waiters:
+            # Message flow started by mqtt_publish or a delivery retry
+            yield from super().handle_puback(puback)
+            return
+        message = self.session.inflight_out.pop(packet_id, None)
+        if message is None:
+            self.logger.warning("Received PUBACK for unknown pending message Id: '%d'" % packet_id)
+        else:
+            message.puback_packet = puback
+            self._inflight_acknowledged()
+            if self.inflight_log is not None:
+                self.inflight_log.ack_out(self.session.client_id, packet_id)
+
+    @asyncio.coroutine
+    def handle_pubrec(self, pubrec: PubrecPacket):
+        packet_id = pubrec.packet_id
+        if packet_id in self._pubrec_waiters:
+            yield from super().handle_pubrec(pubrec)
+            return
+        message = self.session.inflight_out.get(packet_id, None)
+        if message is None or message.pubrec_packet is not None:
+            self.logger.warning("Received PUBREC for unknown pending message with Id: %d" % packet_id)
+        else:
+            message.pubrec_packet = pubrec
+            message.pubrel_packet = PubrelPacket.build(packet_id)
+            if self.inflight_log is not None:
+                self.inflight_log.pubrel_out(self.session.client_id, packet_id)
+            yield from self._send_packet(message.pubrel_packet)
+
+    @asyncio.coroutine
+    def handle_pubcomp(self, pubcomp: PubcompPacket):
+        packet_id = pubcomp.packet_id
+        if packet_id in self._pubcomp_waiters:
+            yield from super().handle_pubcomp(pubcomp)
+            return
+        message = self.session.inflight_out.get(packet_id, None)
+        if message is None or message.pubrel_packet is None:
+            self.logger.warning("Received PUBCOMP for unknown pending message with Id: %d" % packet_id)
+        else:
+            message.pubcomp_packet = pubcomp
+            del self.session.inflight_out[packet_id]
+            self._inflight_acknowledged()
+            if self.inflight_log is not None:
+                self.inflight_log.ack_out(self.session.client_id, packet_id)
+
     @asyncio.coroutine
     def wait_disconnect(self):
         return (yield from self._disconnect_waiter)
@@ -116,17 +303,26 @@ class BrokerProtocolHandler(ProtocolHandler):
 
     @classmethod
     @asyncio.coroutine
-    def init_from_connect(cls, reader: ReaderAdapter, writer: WriterAdapter, plugins_manager, loop=None):
+    def init_from_connect(cls, reader: ReaderAdapter, writer: WriterAdapter, plugins_manager, loop=None,
+                          outgoing_queue_size=0, max_inflight_messages=0):
         """
 
         :param reader:
         :param writer:
         :param plugins_manager:
         :param loop:
+        :param outgoing_queue_size: maximum number of messages queued for delivery to the client, 0 for no limit
+        :param max_inflight_messages: maximum number of QOS_1 and QOS_2 messages sent to the client and not
+        acknowledged yet, 0 for no limit
         :return:
         """
         remote_address, remote_port = writer.get_peer_info()
-        connect = yield from ConnectPacket.from_stream(reader)
+        if isinstance(reader, PacketReaderAdapter):
+            connect = yield from reader.read_packet()
+            if not isinstance(connect, ConnectPacket):
+                raise MQTTException('[MQTT-3.1.0-1] First packet sent from client must be CONNECT, got %r' % connect)
+        else:
+            connect = yield from ConnectPacket.from_stream(reader)
         yield from plugins_manager.fire_event(EVENT_MQTT_PACKET_RECEIVED, packet=connect)
         #this shouldn't be required anymore since broker generates for each client a random client_id if not provided
         #[MQTT-3.1.3-6]
@@ -185,5 +381,6 @@ class BrokerProtocolHandler(ProtocolHandler):
         else:
             incoming_session.keep_alive = 0
 
-        handler = cls(plugins_manager, loop=loop)
+        handler = cls(plugins_manager, loop=loop, outgoing_queue_size=outgoing_queue_size,
+                      max_inflight_messages=max_inflight_messages)
         return handler, incoming_session
@@ -7,6 +7,7 @@ import itertools
 
 import asyncio
 from asyncio import InvalidStateError
+from datetime import datetime
 
 from hbmqtt.mqtt import packet_class
 from hbmqtt.mqtt.connack import ConnackPacket
@@ -27,7 +28,7 @@ from hbmqtt.mqtt.subscribe import SubscribePacket
 from hbmqtt.mqtt.unsubscribe import UnsubscribePacket
 from hbmqtt.mqtt.unsuback import UnsubackPacket
 from hbmqtt.mqtt.disconnect import DisconnectPacket
-from hbmqtt.adapters import ReaderAdapter, WriterAdapter
+from hbmqtt.adapters import ReaderAdapter, WriterAdapter, PacketReaderAdapter
 from hbmqtt.session import Session, OutgoingApplicationMessage, IncomingApplicationMessage, INCOMING, OUTGOING
 from hbmqtt.mqtt.constants import QOS_0, QOS_1, QOS_2
 from hbmqtt.plugins.manager import PluginManager
@@ -37,6 +38,9 @@ from hbmqtt.errors import HBMQTTException, MQTTException, NoDataException
 EVENT_MQTT_PACKET_SENT = 'mqtt_packet_sent'
 EVENT_MQTT_PACKET_RECEIVED = 'mqtt_packet_received'
 
+# Packet buffers smaller than this are copied together before being written, larger ones are written as is
+WRITE_COPY_LIMIT = 4096
+
 
 class ProtocolHandlerException(BaseException):
     pass
@@ -72,6 +76,14 @@ class ProtocolHandler:
         self._pubcomp_waiters = dict()
 
         self._write_lock = asyncio.Lock(loop=self._loop)
+        # Packets sent during the current loop iteration, written at once by _flush_write_buffer
+        self._write_buffer = []
+        # Exception raised by a deferred flush, raised again by the next _send_packet
+        self._write_exception = None
+        self._flush_handle = None
+        self._last_write_time = None
+        # hbmqtt.inflight.InflightLog recording the messages in flight of the session, if any
+        self.inflight_log = None
 
     def _init_session(self, session: Session):
         assert session
@@ -108,7 +120,8 @@ class ProtocolHandler:
         self._reader_task = asyncio.Task(self._reader_loop(), loop=self._loop)
         yield from asyncio.wait([self._reader_ready.wait()], loop=self._loop)
         if self.keepalive_timeout:
-            self._keepalive_task = self._loop.call_later(self.keepalive_timeout, self.handle_write_timeout)
+            self._last_write_time = self._loop.time()
+            self._keepalive_task = self._loop.call_later(self.keepalive_timeout, self._keepalive_expired)
 
         self.logger.debug("Handler tasks started")
         yield from self._retry_deliveries()
@@ -120,6 +133,7 @@ class ProtocolHandler:
         self._stop_waiters()
         if self._keepalive_task:
             self._keepalive_task.cancel()
+        self._flush_write_buffer()
         self.logger.debug("waiting for tasks to be stopped")
         if not self._reader_task.done():
             self._reader_task.cancel()
@@ -149,6 +163,8 @@ class ProtocolHandler:
         Handle [MQTT-4.4.0-1] by resending PUBLISH and PUBREL messages for pending out messages
         :return:
         """
+        if not self.session.inflight_in_count and not self.session.inflight_out_count:
+            return
         self.logger.debug("Begin messages delivery retries")
         tasks = []
         for message in itertools.chain(self.session.inflight_in.values(), self.session.inflight_out.values()):
@@ -179,7 +195,8 @@ class ProtocolHandler:
         else:
             packet_id = None
 
-        message = OutgoingApplicationMessage(packet_id, topic, qos, data, retain)
+        # Payload may be retried after this call returns: keep an immutable copy of mutable buffers
+        message = OutgoingApplicationMessage(packet_id, topic, qos, bytes(data), retain)
         # Handle message flow
         if ack_timeout is not None and ack_timeout > 0:
             yield from asyncio.wait_for(self._handle_message_flow(message), ack_timeout, loop=self._loop)
@@ -246,6 +263,8 @@ class ProtocolHandler:
             if app_message.packet_id not in self.session.inflight_out:
                 # Store message in session
                 self.session.inflight_out[app_message.packet_id] = app_message
+                if self.inflight_log is not None:
+                    self.inflight_log.publish_out(self.session.client_id, app_message)
             if app_message.publish_packet is not None:
                 # A Publish packet has already been sent, this is a retry
                 publish_packet = app_message.build_publish_packet(dup=True)
@@ -264,6 +283,8 @@ class ProtocolHandler:
 
             # Discard inflight message
             del self.session.inflight_out[app_message.packet_id]
+            if self.inflight_log is not None:
+                self.inflight_log.ack_out(self.session.client_id, app_message.packet_id)
         elif app_message.direction == INCOMING:
             # Initiate delivery
             self.logger.debug("Add message to delivery")
@@ -297,6 +318,8 @@ class ProtocolHandler:
                 else:
                     # Store message in session
                     self.session.inflight_out[app_message.packet_id] = app_message
+                    if self.inflight_log is not None:
+                        self.inflight_log.publish_out(self.session.client_id, app_message)
                     publish_packet = app_message.build_publish_packet()
                 # Send PUBLISH packet
                 yield from self._send_packet(publish_packet)
@@ -316,6 +339,8 @@ class ProtocolHandler:
             if not app_message.pubcomp_packet:
                 # Send pubrel
                 app_message.pubrel_packet = PubrelPacket.build(app_message.packet_id)
+                if self.inflight_log is not None:
+                    self.inflight_log.pubrel_out(self.session.client_id, app_message.packet_id)
                 yield from self._send_packet(app_message.pubrel_packet)
                 # Wait for PUBCOMP
                 waiter = asyncio.Future(loop=self._loop)
@@ -325,7 +350,19 @@ class ProtocolHandler:
                 app_message.pubcomp_packet = waiter.result()
             # Discard inflight message
             del self.session.inflight_out[app_message.packet_id]
+            if self.inflight_log is not None:
+                self.inflight_log.ack_out(self.session.client_id, app_message.packet_id)
         elif app_message.direction == INCOMING:
+            if self.inflight_log is not None and app_message.packet_id not in self.session.inflight_in:
+                # The message must be on disk before the client discards it
+                self.inflight_log.publish_in(self.session.client_id, app_message)
+                try:
+                    yield from self.inflight_log.commit()
+                except OSError as e:
+                    # Not acknowledged: the client will publish it again
+                    self.logger.warning("Message %d not acknowledged, can't write it to in-flight log: %s" %
+                                        (app_message.packet_id, e))
+                    return
             self.session.inflight_in[app_message.packet_id] = app_message
             # Send pubrec
             pubrec_packet = PubrecPacket.build(app_message.packet_id)
@@ -347,6 +384,8 @@ class ProtocolHandler:
                 # Initiate delivery and discard message
                 yield from self.session.delivered_message_queue.put(app_message)
                 del self.session.inflight_in[app_message.packet_id]
+                if self.inflight_log is not None:
+                    self.inflight_log.ack_in(self.session.client_id, app_message.packet_id)
                 # Send pubcomp
                 pubcomp_packet = PubcompPacket.build(app_message.packet_id)
                 yield from self._send_packet(pubcomp_packet)
@@ -369,53 +408,61 @@ class ProtocolHandler:
                 if len(running_tasks) > 1:
                     self.logger.debug("handler running tasks: %d" % len(running_tasks))
 
-                fixed_header = yield from asyncio.wait_for(
-                    MQTTFixedHeader.from_stream(self.reader),
-                    keepalive_timeout, loop=self._loop)
-                if fixed_header:
-                    if fixed_header.packet_type == RESERVED_0 or fixed_header.packet_type == RESERVED_15:
+                if isinstance(self.reader, PacketReaderAdapter):
+                    # Packets are already decoded by the transport protocol
+                    packet = yield from asyncio.wait_for(self.reader.read_packet(), keepalive_timeout,
+                                                         loop=self._loop)
+                else:
+                    fixed_header = yield from asyncio.wait_for(
+                        MQTTFixedHeader.from_stream(self.reader),
+                        keepalive_timeout, loop=self._loop)
+                    if fixed_header and fixed_header.packet_type in (RESERVED_0, RESERVED_15):
                         self.logger.warning("%s Received reserved packet, which is forbidden: closing connection" %
                                             (self.session.client_id))
                         yield from self.handle_connection_closed()
-                    else:
+                        continue
+                    if fixed_header:
                         cls = packet_class(fixed_header)
                         packet = yield from cls.from_stream(self.reader, fixed_header=fixed_header)
-                        yield from self.plugins_manager.fire_event(
-                            EVENT_MQTT_PACKET_RECEIVED, packet=packet, session=self.session)
-                        task = None
-                        if packet.fixed_header.packet_type == CONNACK:
-                            task = asyncio.ensure_future(self.handle_connack(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == SUBSCRIBE:
-                            task = asyncio.ensure_future(self.handle_subscribe(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == UNSUBSCRIBE:
-                            task = asyncio.ensure_future(self.handle_unsubscribe(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == SUBACK:
-                            task = asyncio.ensure_future(self.handle_suback(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == UNSUBACK:
-                            task = asyncio.ensure_future(self.handle_unsuback(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == PUBACK:
-                            task = asyncio.ensure_future(self.handle_puback(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == PUBREC:
-                            task = asyncio.ensure_future(self.handle_pubrec(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == PUBREL:
-                            task = asyncio.ensure_future(self.handle_pubrel(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == PUBCOMP:
-                            task = asyncio.ensure_future(self.handle_pubcomp(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == PINGREQ:
-                            task = asyncio.ensure_future(self.handle_pingreq(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == PINGRESP:
-                            task = asyncio.ensure_future(self.handle_pingresp(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == PUBLISH:
-                            task = asyncio.ensure_future(self.handle_publish(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == DISCONNECT:
-                            task = asyncio.ensure_future(self.handle_disconnect(packet), loop=self._loop)
-                        elif packet.fixed_header.packet_type == CONNECT:
-                            self.handle_connect(packet)
-                        else:
-                            self.logger.warning("%s Unhandled packet type: %s" %
-                                                (self.session.client_id, packet.fixed_header.packet_type))
-                        if task:
-                            running_tasks.append(task)
+                    else:
+                        packet = None
+                if packet:
+                    yield from self.plugins_manager.fire_event(
+                        EVENT_MQTT_PACKET_RECEIVED, packet=packet, session=self.session)
+                    task = None
+                    if packet.fixed_header.packet_type == CONNACK:
+                        task = asyncio.ensure_future(self.handle_connack(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == SUBSCRIBE:
+                        task = asyncio.ensure_future(self.handle_subscribe(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == UNSUBSCRIBE:
+                        task = asyncio.ensure_future(self.handle_unsubscribe(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == SUBACK:
+                        task = asyncio.ensure_future(self.handle_suback(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == UNSUBACK:
+                        task = asyncio.ensure_future(self.handle_unsuback(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == PUBACK:
+                        task = asyncio.ensure_future(self.handle_puback(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == PUBREC:
+                        task = asyncio.ensure_future(self.handle_pubrec(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == PUBREL:
+                        task = asyncio.ensure_future(self.handle_pubrel(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == PUBCOMP:
+                        task = asyncio.ensure_future(self.handle_pubcomp(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == PINGREQ:
+                        task = asyncio.ensure_future(self.handle_pingreq(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == PINGRESP:
+                        task = asyncio.ensure_future(self.handle_pingresp(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == PUBLISH:
+                        task = asyncio.ensure_future(self.handle_publish(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == DISCONNECT:
+                        task = asyncio.ensure_future(self.handle_disconnect(packet), loop=self._loop)
+                    elif packet.fixed_header.packet_type == CONNECT:
+                        self.handle_connect(packet)
+                    else:
+                        self.logger.warning("%s Unhandled packet type: %s" %
+                                            (self.session.client_id, packet.fixed_header.packet_type))
+                    if task:
+                        running_tasks.append(task)
                 else:
                     self.logger.debug("No more data (EOF received), stopping reader coro")
                     break
@@ -441,12 +488,23 @@ class ProtocolHandler:
 
     @asyncio.coroutine
     def _send_packet(self, packet):
+        """
+        Send a packet. Packets sent during the same loop iteration are buffered and written to the transport at
+        once at the end of the iteration. Writer is drained only when it asks for it, typically when the transport
+        buffer is over its high-water mark.
+        """
         try:
-            with (yield from self._write_lock):
-                yield from packet.to_stream(self.writer)
+            self._raise_write_exception()
+            self._write_buffer.append(packet)
+            if self._flush_handle is None:
+                self._flush_handle = self._loop.call_soon(self._flush_write_buffer)
+            if self.writer.needs_drain():
+                with (yield from self._write_lock):
+                    self._flush_write_buffer()
+                    self._raise_write_exception()
+                    yield from self.writer.drain()
             if self._keepalive_task:
-                self._keepalive_task.cancel()
-                self._keepalive_task = self._loop.call_later(self.keepalive_timeout, self.handle_write_timeout)
+                self._last_write_time = self._loop.time()
 
             yield from self.plugins_manager.fire_event(EVENT_MQTT_PACKET_SENT, packet=packet, session=self.session)
         except (ConnectionResetError, BrokenPipeError):
@@ -457,6 +515,53 @@ class ProtocolHandler:
             self.logger.warning("Unhandled exception: %s" % e)
             raise
 
+    def _flush_write_buffer(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._write_buffer or self.writer is None:
+            return
+        packets = self._write_buffer
+        self._write_buffer = []
+        now = datetime.now()
+        try:
+            # Small buffers are gathered in a single chunk, large ones (PUBLISH payloads) are written by reference
+            buffers = []
+            chunk = bytearray()
+            for packet in packets:
+                for data in packet.to_buffers():
+                    if len(data) < WRITE_COPY_LIMIT:
+                        chunk.extend(data)
+                    else:
+                        if chunk:
+                            buffers.append(chunk)
+                            chunk = bytearray()
+                        buffers.append(data)
+                packet.protocol_ts = now
+            if chunk:
+                buffers.append(chunk)
+            self.writer.writelines(buffers)
+        except Exception as e:
+            # Flush usually runs from a loop callback: keep the error for the next packet sent
+            self.logger.debug("Write failed: %r" % e)
+            self._write_exception = e
+
+    def _raise_write_exception(self):
+        if self._write_exception is not None:
+            e, self._write_exception = self._write_exception, None
+            raise e
+
+    def _keepalive_expired(self):
+        """
+        Keep-alive timer callback. Sending a packet only records the time of the write: the timer is rearmed here
+        for the remaining delay rather than being recreated for every packet sent.
+        """
+        remaining = self._last_write_time + self.keepalive_timeout - self._loop.time()
+        if remaining <= 0:
+            self.handle_write_timeout()
+            remaining = self.keepalive_timeout
+        self._keepalive_task = self._loop.call_later(remaining, self._keepalive_expired)
+
     @asyncio.coroutine
     def mqtt_deliver_next_message(self):
         if not self._is_attached():
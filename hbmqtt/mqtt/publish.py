@@ -5,7 +5,8 @@ import asyncio
 
 from hbmqtt.mqtt.packet import MQTTPacket, MQTTFixedHeader, PUBLISH, MQTTVariableHeader, MQTTPayload
 from hbmqtt.errors import HBMQTTException, MQTTException
-from hbmqtt.codecs import decode_packet_id, decode_string, encode_string, int_to_bytes
+from hbmqtt.codecs import decode_packet_id, decode_string, encode_string, int_to_bytes, unpack_packet_id, unpack_string, \
+    UINT16
 
 
 class PublishVariableHeader(MQTTVariableHeader):
@@ -40,8 +41,28 @@ class PublishVariableHeader(MQTTVariableHeader):
             packet_id = None
         return cls(topic_name, packet_id)
 
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader):
+        topic_name, offset = unpack_string(buffer, offset)
+        if (fixed_header.flags >> 1) & 0x03:
+            packet_id, offset = unpack_packet_id(buffer, offset)
+        else:
+            packet_id = None
+        return cls(topic_name, packet_id), offset
+
+    @property
+    def bytes_length(self):
+        length = 2 + len(self.topic_name.encode('utf-8'))
+        if self.packet_id is not None:
+            length += 2
+        return length
+
 
 class PublishPayload(MQTTPayload):
+    """
+    PUBLISH packet application message. Received payloads are immutable ``bytes``, copied once out of the receive
+    buffer, so the same object can be shared by every subscriber delivery, retained message and offline queue.
+    """
 
     __slots__ = ('data',)
 
@@ -56,19 +77,88 @@ class PublishPayload(MQTTPayload):
     @asyncio.coroutine
     def from_stream(cls, reader: asyncio.StreamReader, fixed_header: MQTTFixedHeader,
                     variable_header: MQTTVariableHeader):
-        data = bytearray()
+        chunks = []
         data_length = fixed_header.remaining_length - variable_header.bytes_length
         length_read = 0
         while length_read < data_length:
             buffer = yield from reader.read(data_length - length_read)
-            data.extend(buffer)
-            length_read = len(data)
-        return cls(data)
+            chunks.append(buffer)
+            length_read += len(buffer)
+        return cls(chunks[0] if len(chunks) == 1 else b''.join(chunks))
+
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader, variable_header: MQTTVariableHeader):
+        # buffer may be a view on a receive buffer which is reused for next packets
+        return cls(bytes(buffer[offset:]))
 
     def __repr__(self):
         return type(self).__name__ + '(data={0!r})'.format(repr(self.data))
 
 
+class PublishFrame:
+    """
+    PUBLISH packet serialized once and shared by every delivery of a message.
+    Fixed header and topic are encoded a single time and the payload is never copied: deliveries only differ by the
+    fixed header flags and, for QOS_1 and QOS_2, by the packet identifier which is patched in a copy of the
+    encoded header. Mutable payloads are copied once to ``bytes`` as the frame may outlive the caller's buffer.
+    """
+
+    __slots__ = ('topic_name', 'data', '_qos0_header', '_qos12_header')
+
+    def __init__(self, topic_name: str, data: bytes):
+        self.topic_name = topic_name
+        self.data = bytes(data)
+        self._qos0_header = None
+        self._qos12_header = None
+
+    def _encode_header(self, with_packet_id):
+        topic = encode_string(self.topic_name)
+        remaining_length = len(topic) + len(self.data)
+        if with_packet_id:
+            remaining_length += 2
+        out = MQTTFixedHeader(PUBLISH, 0x00, remaining_length).to_bytes()
+        out.extend(topic)
+        if with_packet_id:
+            out.extend(b'\x00\x00')
+        return bytes(out)
+
+    def _header(self, qos):
+        if qos:
+            if self._qos12_header is None:
+                self._qos12_header = self._encode_header(True)
+            return self._qos12_header
+        if self._qos0_header is None:
+            self._qos0_header = self._encode_header(False)
+        return self._qos0_header
+
+    def bytes_length(self, qos):
+        """
+        Length of the encoded packet for a given QoS
+        """
+        return len(self._header(qos)) + len(self.data)
+
+    def to_buffers(self, qos, packet_id=None, dup_flag=False, retain_flag=False):
+        """
+        Get the encoded PUBLISH packet for a delivery, as a list of the encoded header and the payload.
+        QOS_0 deliveries without flags share the same header bytes object.
+        """
+        header = self._header(qos)
+        flags = (qos << 1) | (PublishPacket.DUP_FLAG if dup_flag else 0) | \
+                (PublishPacket.RETAIN_FLAG if retain_flag else 0)
+        if flags:
+            header = bytearray(header)
+            header[0] |= flags
+            if qos:
+                UINT16.pack_into(header, len(header) - 2, packet_id)
+        return [header, self.data]
+
+    def to_bytes(self, qos, packet_id=None, dup_flag=False, retain_flag=False):
+        """
+        Get the encoded PUBLISH packet for a delivery
+        """
+        return b''.join(self.to_buffers(qos, packet_id, dup_flag, retain_flag))
+
+
 class PublishPacket(MQTTPacket):
     VARIABLE_HEADER = PublishVariableHeader
     PAYLOAD = PublishPayload
@@ -88,6 +178,28 @@ class PublishPacket(MQTTPacket):
         super().__init__(header)
         self.variable_header = variable_header
         self.payload = payload
+        self.frame = None
+
+    def to_bytes(self):
+        if self.frame is not None:
+            return self.frame.to_bytes(self.qos, self.packet_id, self.dup_flag, self.retain_flag)
+        return super().to_bytes()
+
+    def to_buffers(self):
+        if self.frame is not None:
+            return self.frame.to_buffers(self.qos, self.packet_id, self.dup_flag, self.retain_flag)
+        header = self.variable_header.to_bytes()
+        data = self.payload.data if self.payload is not None and self.payload.data is not None else b''
+        self.fixed_header.remaining_length = len(header) + len(data)
+        out = self.fixed_header.to_bytes()
+        out.extend(header)
+        return [out, data]
+
+    @property
+    def bytes_length(self):
+        if self.frame is not None:
+            return self.frame.bytes_length(self.qos)
+        return len(self.to_bytes())
 
     def set_flags(self, dup_flag=False, qos=0, retain_flag=False):
         self.dup_flag = dup_flag
@@ -164,3 +276,12 @@ class PublishPacket(MQTTPacket):
         packet.retain_flag = retain
         packet.qos = qos
         return packet
+
+    @classmethod
+    def build_from_frame(cls, frame: PublishFrame, packet_id: int, dup_flag, qos, retain):
+        """
+        Build a PublishPacket whose encoding is taken from a shared :class:`PublishFrame`
+        """
+        packet = cls.build(frame.topic_name, frame.data, packet_id, dup_flag, qos, retain)
+        packet.frame = frame
+        return packet
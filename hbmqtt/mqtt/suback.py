@@ -46,6 +46,10 @@ class SubackPayload(MQTTPayload):
                 break
         return cls(return_codes)
 
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader, variable_header: MQTTVariableHeader):
+        return cls(list(buffer[offset:]))
+
 
 class SubackPacket(MQTTPacket):
     VARIABLE_HEADER = PacketIdVariableHeader
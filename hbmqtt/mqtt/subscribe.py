@@ -5,7 +5,8 @@ import asyncio
 
 from hbmqtt.mqtt.packet import MQTTPacket, MQTTFixedHeader, SUBSCRIBE, PacketIdVariableHeader, MQTTPayload, MQTTVariableHeader
 from hbmqtt.errors import HBMQTTException, NoDataException
-from hbmqtt.codecs import bytes_to_int, decode_string, encode_string, int_to_bytes, read_or_raise
+from hbmqtt.codecs import bytes_to_int, decode_string, encode_string, int_to_bytes, read_or_raise, unpack_byte, \
+    unpack_string
 
 
 class SubscribePayload(MQTTPayload):
@@ -41,6 +42,18 @@ class SubscribePayload(MQTTPayload):
                 break
         return cls(topics)
 
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader, variable_header: MQTTVariableHeader):
+        topics = []
+        while offset < len(buffer):
+            try:
+                topic, offset = unpack_string(buffer, offset)
+                qos, offset = unpack_byte(buffer, offset)
+                topics.append((topic, qos))
+            except NoDataException:
+                break
+        return cls(topics)
+
     def __repr__(self):
         return type(self).__name__ + '(topics={0!r})'.format(self.topics)
 
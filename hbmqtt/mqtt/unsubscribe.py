@@ -5,7 +5,7 @@ import asyncio
 
 from hbmqtt.mqtt.packet import MQTTPacket, MQTTFixedHeader, UNSUBSCRIBE, PacketIdVariableHeader, MQTTPayload, MQTTVariableHeader
 from hbmqtt.errors import HBMQTTException, NoDataException
-from hbmqtt.codecs import decode_string, encode_string
+from hbmqtt.codecs import decode_string, encode_string, unpack_string
 
 
 class UnubscribePayload(MQTTPayload):
@@ -38,6 +38,17 @@ class UnubscribePayload(MQTTPayload):
                 break
         return cls(topics)
 
+    @classmethod
+    def decode(cls, buffer, offset: int, fixed_header: MQTTFixedHeader, variable_header: MQTTVariableHeader):
+        topics = []
+        while offset < len(buffer):
+            try:
+                topic, offset = unpack_string(buffer, offset)
+                topics.append(topic)
+            except NoDataException:
+                break
+        return cls(topics)
+
 
 class UnsubscribePacket(MQTTPacket):
     VARIABLE_HEADER = PacketIdVariableHeader
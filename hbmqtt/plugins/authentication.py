@@ -5,6 +5,15 @@ import logging
 import asyncio
 import binascii
 import datetime
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from passlib.apps import custom_app_context as pwd_context
 from hbmqtt.plugins.secp256k1 import schnorr, ecdsa
@@ -53,11 +62,33 @@ class AnonymousAuthPlugin(BaseAuthPlugin):
         return authenticated
 
 
+def verify_password(password, pwd_hash):
+    """
+    Check a password against a passlib hash. Module level function, so that it can be run in a process pool
+    """
+    return pwd_context.verify(password, pwd_hash)
+
+
 class FileAuthPlugin(BaseAuthPlugin):
+    """
+    Authenticate users with the password file given by the ``password-file`` configuration parameter.
+    Password hashes are checked in a pool of ``password-workers`` threads (or processes if ``password-executor``
+    is ``process``), so that slow hashes do not hold the event loop. Successful checks are cached for
+    ``password-cache-ttl`` seconds, keyed by user name and a keyed digest of the password: plain passwords are
+    never stored.
+    """
     def __init__(self, context):
         super().__init__(context)
         self._users = dict()
         self._read_password_file()
+        self._workers = self.auth_config.get('password-workers', 4)
+        self._executor = None
+        self._semaphore = None
+        self._cache_ttl = self.auth_config.get('password-cache-ttl', 60)
+        self._cache_size = self.auth_config.get('password-cache-size', 10000)
+        self._cache = OrderedDict()
+        # Per-instance key of the password digests
+        self._digest_key = os.urandom(32)
 
     def _read_password_file(self):
         password_file = self.auth_config.get('password-file', None)
@@ -78,6 +109,27 @@ class FileAuthPlugin(BaseAuthPlugin):
         else:
             self.context.logger.debug("Configuration parameter 'password_file' not found")
 
+    def _password_digest(self, password):
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        return hmac.new(self._digest_key, password or b'', hashlib.sha256).digest()
+
+    @asyncio.coroutine
+    def _verify_password(self, password, pwd_hash):
+        loop = self.context.loop or asyncio.get_event_loop()
+        if self._executor is None:
+            if self.auth_config.get('password-executor', 'thread') == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers)
+            self._semaphore = asyncio.Semaphore(self._workers, loop=loop)
+        # Checks waiting for a worker are queued here rather than in the executor
+        yield from self._semaphore.acquire()
+        try:
+            return (yield from loop.run_in_executor(self._executor, verify_password, password, pwd_hash))
+        finally:
+            self._semaphore.release()
+
     @asyncio.coroutine
     def authenticate(self, *args, **kwargs):
         authenticated = super().authenticate(*args, **kwargs)
@@ -89,20 +141,180 @@ class FileAuthPlugin(BaseAuthPlugin):
                     authenticated = False
                     self.context.logger.debug("No hash found for user '%s'" % session.username)
                 else:
-                    authenticated = pwd_context.verify(session.password, hash)
+                    cache_key = (session.username, self._password_digest(session.password))
+                    cached = self._cache.get(cache_key, None)
+                    # Cached check is valid until it expires or the user hash changes
+                    if cached is not None and cached[0] == hash and cached[1] > time.monotonic():
+                        return True
+                    authenticated = yield from self._verify_password(session.password, hash)
+                    if authenticated and self._cache_ttl:
+                        self._cache.pop(cache_key, None)
+                        self._cache[cache_key] = (hash, time.monotonic() + self._cache_ttl)
+                        if len(self._cache) > self._cache_size:
+                            self._cache.popitem(last=False)
             else:
                 return None
         return authenticated
 
+    @asyncio.coroutine
+    def on_broker_post_shutdown(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            loop = self.context.loop or asyncio.get_event_loop()
+            yield from loop.run_in_executor(None, executor.shutdown, True)
+
+
+class SchnorrBatchVerifier:
+    """
+    Collects schnorr signature verifications requested concurrently and checks them by batches, which is much cheaper
+    than checking them one by one. A batch is checked once ``max_size`` verifications are pending or ``delay``
+    seconds after its first verification was requested. Batches are checked in a pool of ``workers`` processes
+    (as many as CPUs if None), so that the event loop keeps running, or on the event loop if ``workers`` is 0.
+    """
+    def __init__(self, loop=None, workers=None, max_size=64, delay=0.005):
+        self._loop = loop
+        self._workers = workers
+        self._executor = None
+        self.max_size = max_size
+        self.delay = delay
+        self._pending = []
+        self._flush_handle = None
+        self._tasks = set()
+
+    @asyncio.coroutine
+    def verify(self, msg, pubkey, sig):
+        """
+        Check a schnorr signature with the next batch
+        :param msg: sha256 message-hash
+        :param pubkey: encoded public key
+        :param sig: signature
+        :return: True if the signature matches
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        future = asyncio.Future(loop=self._loop)
+        self._pending.append((msg, pubkey, sig, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.delay, self._flush)
+        return (yield from future)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._verify_batch(batch), loop=self._loop)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @asyncio.coroutine
+    def _verify_batch(self, batch):
+        msgs, pubkeys, sigs, futures = zip(*batch)
+        try:
+            if self._workers == 0:
+                results = schnorr.verify_batch(msgs, pubkeys, sigs)
+            else:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self._workers)
+                results = yield from self._loop.run_in_executor(
+                    self._executor, schnorr.verify_batch, msgs, pubkeys, sigs)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+
+    @asyncio.coroutine
+    def close(self):
+        """
+        Check pending verifications and stop worker processes
+        """
+        self._flush()
+        if self._tasks:
+            yield from asyncio.wait(list(self._tasks), loop=self._loop)
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            # Wait for worker processes without blocking the event loop
+            yield from self._loop.run_in_executor(None, executor.shutdown, True)
+
+
+class VerificationCache:
+    """
+    Results of the signature verifications made during the current time window, so that a client reconnecting
+    with the same signature within the window is not checked again. Entries are keyed by public key, signature
+    and client id for the time window given to :meth:`get` and :meth:`put`; all of them expire when the window
+    changes. Successful and failed verifications are kept in separate LRU dictionaries of at most ``max_size``
+    entries each, so that bad signatures sent repeatedly are rejected without curve math and do not evict good
+    ones.
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._window = None
+        self._accepted = OrderedDict()
+        self._rejected = OrderedDict()
+        self.hits = 0
+        self.rejected_hits = 0
+        self.misses = 0
+
+    def _set_window(self, window):
+        if window != self._window:
+            self._window = window
+            self._accepted.clear()
+            self._rejected.clear()
+
+    def get(self, window, key):
+        """
+        Get the result of a verification
+        :param window: current time window
+        :param key: (public key, signature, client id)
+        :return: True or False if the verification result is known in the window, None otherwise
+        """
+        self._set_window(window)
+        if key in self._accepted:
+            self._accepted.move_to_end(key)
+            self.hits += 1
+            return True
+        if key in self._rejected:
+            self._rejected.move_to_end(key)
+            self.rejected_hits += 1
+            return False
+        self.misses += 1
+        return None
+
+    def put(self, window, key, result):
+        """
+        Store the result of a verification. Results of a past time window are ignored.
+        """
+        if window != self._window or not self.max_size:
+            return
+        cache = self._accepted if result else self._rejected
+        cache[key] = None
+        if len(cache) > self.max_size:
+            cache.popitem(last=False)
+
 
 class EcdsaAuthPlugin(BaseAuthPlugin):
     """
     This plugin allows secure identification without ssl.
+    Schnorr signatures of concurrent connections are checked by batches, see :class:`SchnorrBatchVerifier`.
+    Verification results are cached for the current time window, see :class:`VerificationCache`.
     """
     def __init__(self, context):
         super().__init__(context)
         self._puks = []  # to store allowed public keys if anonymous not allowed
         self._read_public_keys()
+        self._verification_cache = VerificationCache(self.auth_config.get('ecdsa-cache-size', 10000))
+        self._schnorr_verifier = SchnorrBatchVerifier(
+            loop=self.context.loop,
+            workers=self.auth_config.get('schnorr-batch-workers', None),
+            max_size=self.auth_config.get('schnorr-batch-size', 64),
+            delay=self.auth_config.get('schnorr-batch-delay', 0.005))
 
     def _read_public_keys(self):
         puk_file = self.auth_config.get('puk-file', None)
@@ -129,6 +341,25 @@ class EcdsaAuthPlugin(BaseAuthPlugin):
         else:
             self.context.logger.debug("Configuration parameter 'puk-file' not found")
 
+    @asyncio.coroutine
+    def on_broker_post_shutdown(self):
+        yield from self._schnorr_verifier.close()
+
+    def sys_stats(self):
+        """
+        Verification cache counters, broadcast under $SYS by the broker_sys plugin
+        """
+        return {
+            'auth/ecdsa/cache/hits': self._verification_cache.hits,
+            'auth/ecdsa/cache/rejected': self._verification_cache.rejected_hits,
+            'auth/ecdsa/cache/misses': self._verification_cache.misses,
+        }
+
+    async def _verify(self, secp256k1, msg, puk, sig):
+        if secp256k1 is schnorr:
+            return await self._schnorr_verifier.verify(msg, puk, sig)
+        return secp256k1.verify(msg, puk, sig)
+
     async def authenticate(self, *args, **kwargs):
         authenticated = super().authenticate(*args, **kwargs)
         if authenticated:
@@ -171,21 +402,115 @@ class EcdsaAuthPlugin(BaseAuthPlugin):
                     now = datetime.datetime.utcnow()
 
                     iso_now = now.isoformat()[:18]
-                    msg = secp256k1.hash_sha256(
-                        iso_now + session.client_id
-                    )
-                    authenticated = secp256k1.verify(msg, puk, sig)
-                    if not authenticated:
-                        iso_now_m1 = (
-                            now - datetime.timedelta(1.0 / 8640)  # 86400=24*60*60
-                        ).isoformat()[:18]
-                        msg_m1 = secp256k1.hash_sha256(
-                            iso_now_m1 + session.client_id
+                    cache_key = (puk, sig, session.client_id)
+                    authenticated = self._verification_cache.get(iso_now, cache_key)
+                    if authenticated is None:
+                        msg = secp256k1.hash_sha256(
+                            iso_now + session.client_id
                         )
-                        authenticated = secp256k1.verify(msg_m1, puk, sig)
+                        authenticated = await self._verify(secp256k1, msg, puk, sig)
+                        if not authenticated:
+                            iso_now_m1 = (
+                                now - datetime.timedelta(1.0 / 8640)  # 86400=24*60*60
+                            ).isoformat()[:18]
+                            msg_m1 = secp256k1.hash_sha256(
+                                iso_now_m1 + session.client_id
+                            )
+                            authenticated = await self._verify(secp256k1, msg_m1, puk, sig)
+                        self._verification_cache.put(iso_now, cache_key, authenticated)
 
                     setattr(session, "_secp256k1", authenticated)
                     return None if allow_other_than_ecdsa else authenticated
             else:
                 return None
         return authenticated
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+def encode_token(secret, client_id, expiry, topics=()):
+    """
+    Build a token for :class:`TokenAuthPlugin`, to be sent as CONNECT password
+    :param secret: secret shared with the broker ('token-secret' auth configuration parameter)
+    :param client_id: client id allowed to connect with the token
+    :param expiry: expiry time of the token, in seconds since the epoch
+    :param topics: topic prefixes the client is allowed to publish and subscribe to
+    :return: token string
+    """
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    payload = _b64encode(json.dumps(
+        {'c': client_id, 'e': int(expiry), 't': list(topics)}, separators=(',', ':')).encode('utf-8'))
+    signature = _b64encode(hmac.new(secret, payload, hashlib.sha256).digest())
+    return (payload + b'.' + signature).decode('ascii')
+
+
+class TokenAuthPlugin(BaseAuthPlugin):
+    """
+    Authenticate clients with short-lived tokens sent as CONNECT password, see :func:`encode_token`. A token is
+    signed with HMAC-SHA256 using the 'token-secret' auth configuration parameter and holds the client id allowed
+    to use it, its expiry time and the topic prefixes the client is allowed to use, checked by
+    :class:`hbmqtt.plugins.topic_checking.TokenTopicPlugin`. Checking a token needs no I/O.
+    Passwords which are not tokens are left to other plugins.
+    """
+    def __init__(self, context):
+        super().__init__(context)
+        secret = self.auth_config.get('token-secret', None)
+        if secret is None:
+            self.context.logger.warning("Configuration parameter 'token-secret' not found")
+        elif isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        self._secret = secret
+
+    def _decode_token(self, token):
+        """
+        Get the claims of a token
+        :return: claims dict, None if password is not a token, False if the token signature is wrong
+        """
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        payload, sep, signature = token.partition(b'.')
+        if not sep:
+            return None
+        try:
+            signature = _b64decode(signature)
+        except (binascii.Error, ValueError):
+            return None
+        expected = hmac.new(self._secret, payload, hashlib.sha256).digest()
+        if not hmac.compare_digest(signature, expected):
+            return False
+        try:
+            return json.loads(_b64decode(payload).decode('utf-8'))
+        except (binascii.Error, ValueError):
+            return False
+
+    @asyncio.coroutine
+    def authenticate(self, *args, **kwargs):
+        authenticated = super().authenticate(*args, **kwargs)
+        if authenticated:
+            session = kwargs.get('session', None)
+            if not session.password or self._secret is None:
+                return None
+            claims = self._decode_token(session.password)
+            if claims is None:
+                return None
+            if not claims:
+                self.context.logger.debug("Token signature mismatch for client '%s'" % session.client_id)
+                return False
+            try:
+                if claims['c'] != session.client_id:
+                    self.context.logger.debug("Token not issued for client '%s'" % session.client_id)
+                    return False
+                if claims['e'] < time.time():
+                    self.context.logger.debug("Token of client '%s' expired" % session.client_id)
+                    return False
+                setattr(session, "_token_topics", tuple(claims.get('t', ())))
+            except (KeyError, TypeError):
+                return False
+        return authenticated
@@ -25,7 +25,6 @@ class PacketLoggerPlugin:
     def __init__(self, context):
         self.context = context
 
-    @asyncio.coroutine
     def on_mqtt_packet_received(self, *args, **kwargs):
         packet = kwargs.get('packet')
         session = kwargs.get('session', None)
@@ -35,7 +34,6 @@ class PacketLoggerPlugin:
             else:
                 self.context.logger.debug("<-in-- %s" % repr(packet))
 
-    @asyncio.coroutine
     def on_mqtt_packet_sent(self, *args, **kwargs):
         packet = kwargs.get('packet')
         session = kwargs.get('session', None)
@@ -2,15 +2,18 @@
 #
 # See the file license.txt for copying permission.
 
-__all__ = ['get_plugin_manager', 'BaseContext', 'PluginManager']
+__all__ = ['get_plugin_manager', 'BaseContext', 'PluginManager', 'blocking']
 
 import pkg_resources
 import logging
 import asyncio
 import copy
+import functools
 import sys
+import time
 
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
 Plugin = namedtuple('Plugin', ['name', 'ep', 'object'])
@@ -28,6 +31,51 @@ class BaseContext:
         self.loop = None
         self.logger = None
 
+    @asyncio.coroutine
+    def run_blocking(self, func, *args, **kwargs):
+        """
+        Run a blocking call out of the event loop and wait for its result.
+        PluginManager gives each plugin a context running it in the plugins executor.
+        """
+        loop = self.loop or asyncio.get_event_loop()
+        return (yield from loop.run_in_executor(None, functools.partial(func, *args, **kwargs)))
+
+
+def blocking(hook):
+    """
+    Mark a plugin hook as blocking: PluginManager runs it in its executor, configured by the 'plugins-executor'
+    configuration section, and awaits its result rather than calling it in the event loop.
+    Plugins may also list the names of their blocking hooks in a ``blocking_hooks`` attribute.
+    :param hook: plain plugin method
+    :return: hook
+    """
+    hook.blocking = True
+    return hook
+
+
+def _run_hook(hook, args, kwargs):
+    # Runs in an executor worker: the start time gives the time the call was queued
+    started = time.monotonic()
+    return started, hook(*args, **kwargs)
+
+
+class HookStats:
+    """
+    Executor usage of a blocking plugin hook. Times are in seconds, queue time runs from the call of the hook to
+    the start of its execution by a worker, including the wait for the plugin concurrency limit.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.pending = 0
+        self.queue_time = 0.0
+        self.max_queue_time = 0.0
+
+    def add(self, queue_time):
+        self.calls += 1
+        self.queue_time += queue_time
+        if queue_time > self.max_queue_time:
+            self.max_queue_time = queue_time
+
 
 class PluginManager:
     """
@@ -48,15 +96,26 @@ class PluginManager:
         else:
             self.context = context
         self.context.loop = self._loop
+        self._executor = None
+        self._executor_config = self._get_executor_config()
+        self._plugin_semaphores = dict()
+        self._hook_stats = dict()
         self._plugins = []
+        self._event_handlers = dict()
         self._load_plugins(namespace)
-        self._fired_events = []
+        self._fired_events = set()
         plugins_manager[namespace] = self
 
     @property
     def app_context(self):
         return self.context
 
+    def _get_executor_config(self):
+        config = getattr(self.context, 'config', None)
+        if isinstance(config, dict):
+            return config.get('plugins-executor', None) or dict()
+        return dict()
+
     def _load_plugins(self, namespace):
         self.logger.debug("Loading plugins for namespace %s" % namespace)
         for ep in pkg_resources.iter_entry_points(group=namespace):
@@ -71,6 +130,8 @@ class PluginManager:
             self.logger.debug(" Initializing plugin %s" % ep)
             plugin_context = copy.copy(self.app_context)
             plugin_context.logger = self.logger.getChild(ep.name)
+            # Lets the plugin run its own blocking calls in the executor
+            plugin_context.run_blocking = functools.partial(self._run_blocking_call, ep.name)
             obj = plugin(plugin_context)
             return Plugin(ep.name, ep, obj)
         except ImportError as ie:
@@ -78,6 +139,14 @@ class PluginManager:
         except pkg_resources.UnknownExtra as ue:
             self.logger.warning("Plugin %r dependencies resolution failed: %s" % (ep, ue))
 
+    @asyncio.coroutine
+    def _run_blocking_call(self, plugin_name, func, *args, **kwargs):
+        plugin = self.get_plugin(plugin_name)
+        if plugin is None:
+            # Plugin still initializing
+            plugin = Plugin(plugin_name, None, None)
+        return (yield from self.run_blocking(plugin, func, *args, **kwargs))
+
     def get_plugin(self, name):
         """
         Get a plugin by its name from the plugins loaded for the current namespace
@@ -97,8 +166,9 @@ class PluginManager:
         :return:
         """
         yield from self.map_plugin_coro("close")
-        for task in self._fired_events:
+        for task in list(self._fired_events):
             task.cancel()
+        yield from self.shutdown_executor()
 
     @property
     def plugins(self):
@@ -111,46 +181,145 @@ class PluginManager:
     def _schedule_coro(self, coro):
         return asyncio.ensure_future(coro, loop=self._loop)
 
+    @staticmethod
+    def _is_blocking(plugin, method):
+        return getattr(method, 'blocking', False) or \
+            getattr(method, '__name__', None) in getattr(plugin.object, 'blocking_hooks', ())
+
+    def _get_executor(self):
+        if self._executor is None:
+            workers = self._executor_config.get('workers', None)
+            if self._executor_config.get('type', 'thread') == 'process':
+                # Blocking hooks, their plugin and their arguments must be picklable
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=workers)
+        return self._executor
+
+    def _get_plugin_semaphore(self, plugin):
+        try:
+            return self._plugin_semaphores[plugin.name]
+        except KeyError:
+            limits = self._executor_config.get('limits', None) or dict()
+            limit = limits.get(plugin.name, getattr(plugin.object, 'blocking_limit', None))
+            semaphore = asyncio.Semaphore(limit, loop=self._loop) if limit else None
+            self._plugin_semaphores[plugin.name] = semaphore
+            return semaphore
+
+    @asyncio.coroutine
+    def run_blocking(self, plugin, method, *args, **kwargs):
+        """
+        Run a blocking plugin method in the executor and wait for its result.
+        Calls beyond the concurrency limit of the plugin, set in the 'limits' parameter of the 'plugins-executor'
+        configuration section or by the ``blocking_limit`` attribute of the plugin, wait in the event loop.
+        :param plugin: :class:`Plugin` the method belongs to
+        :param method: plain method
+        :return: method result
+        """
+        key = (plugin.name, getattr(method, '__name__', repr(method)))
+        stats = self._hook_stats.get(key, None)
+        if stats is None:
+            stats = self._hook_stats[key] = HookStats()
+        semaphore = self._get_plugin_semaphore(plugin)
+        queued = time.monotonic()
+        stats.pending += 1
+        try:
+            if semaphore is not None:
+                yield from semaphore.acquire()
+            try:
+                started, result = yield from self._loop.run_in_executor(
+                    self._get_executor(), _run_hook, method, args, kwargs)
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+        finally:
+            stats.pending -= 1
+        stats.add(max(0.0, started - queued))
+        return result
+
+    def hook_stats(self):
+        """
+        Get the executor usage of the blocking hooks called so far
+        :return: dict (plugin name, hook name) => :class:`HookStats`
+        """
+        return dict(self._hook_stats)
+
+    @asyncio.coroutine
+    def shutdown_executor(self):
+        """
+        Wait for the running blocking hooks and free the executor
+        """
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            yield from self._loop.run_in_executor(None, executor.shutdown, True)
+
+    def _get_event_handlers(self, event_name):
+        """
+        Get the plugin methods listening to an event. Dispatch table of an event is built on its first firing, as
+        plugins may provide their "on_" methods dynamically. Blocking methods are replaced by a call running them in
+        the executor.
+        :param event_name:
+        :return: tuple of (plugin, method)
+        """
+        try:
+            return self._event_handlers[event_name]
+        except KeyError:
+            event_method_name = "on_" + event_name
+            handlers = []
+            for plugin in self._plugins:
+                if plugin is None:
+                    continue
+                event_method = getattr(plugin.object, event_method_name, None)
+                if event_method:
+                    if self._is_blocking(plugin, event_method):
+                        event_method = functools.partial(self._run_blocking_event, plugin, event_method)
+                    handlers.append((plugin, event_method))
+            handlers = tuple(handlers)
+            self._event_handlers[event_name] = handlers
+            return handlers
+
     @asyncio.coroutine
     def fire_event(self, event_name, wait=False, *args, **kwargs):
         """
         Fire an event to plugins.
-        PluginManager schedule @asyncio.coroutinecalls for each plugin on method called "on_" + event_name
+        PluginManager calls the method called "on_" + event_name of each plugin which defines it.
         For example, on_connect will be called on event 'connect'
-        Method calls are schedule in the asyn loop. wait parameter must be set to true to wait until all
-        mehtods are completed.
+        Plain methods are called inline. Coroutines, and blocking methods run in the executor, are scheduled in the
+        async loop, wait parameter must be set to true to wait until all coroutines are completed.
         :param event_name:
         :param args:
         :param kwargs:
         :param wait: indicates if fire_event should wait for plugin calls completion (True), or not
         :return:
         """
+        handlers = self._get_event_handlers(event_name)
+        if not handlers:
+            return
         tasks = []
-        event_method_name = "on_" + event_name
-        for plugin in self._plugins:
-            event_method = getattr(plugin.object, event_method_name, None)
-            if event_method:
-                try:
-                    task = self._schedule_coro(event_method(*args, **kwargs))
-                    tasks.append(task)
-
-                    def clean_fired_events(future):
-                        try:
-                            self._fired_events.remove(future)
-                        except (KeyError, ValueError):
-                            pass
-
-                    task.add_done_callback(clean_fired_events)
-                except AssertionError:
-                    self.logger.error("Method '%s' on plugin '%s' is not a coroutine" %
-                                      (event_method_name, plugin.name))
-
-        self._fired_events.extend(tasks)
-        if wait:
-            if tasks:
+        for plugin, event_method in handlers:
+            try:
+                ret = event_method(*args, **kwargs)
+            except Exception as e:
+                self.logger.exception("Method 'on_%s' on plugin '%s' failed: %s" % (event_name, plugin.name, e))
+                continue
+            if ret is not None and (asyncio.iscoroutine(ret) or asyncio.isfuture(ret)):
+                tasks.append(self._schedule_coro(ret))
+
+        if tasks:
+            for task in tasks:
+                self._fired_events.add(task)
+                task.add_done_callback(self._fired_events.discard)
+            if wait:
                 yield from asyncio.wait(tasks, loop=self._loop)
-        if self.logger.isEnabledFor(logging.DEBUG):
-            self.logger.debug("Plugins len(_fired_events)=%d" % (len(self._fired_events)))
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Plugins len(_fired_events)=%d" % (len(self._fired_events)))
+
+    @asyncio.coroutine
+    def _run_blocking_event(self, plugin, event_method, *args, **kwargs):
+        try:
+            yield from self.run_blocking(plugin, event_method, *args, **kwargs)
+        except Exception as e:
+            self.logger.exception("Method '%s' on plugin '%s' failed: %s" % (event_method.__name__, plugin.name, e))
 
     @asyncio.coroutine
     def map(self, coro, *args, **kwargs):
@@ -187,11 +356,13 @@ class PluginManager:
             ret_dict = {}
         return ret_dict
 
-    @staticmethod
     @asyncio.coroutine
-    def _call_coro(plugin, coro_name, *args, **kwargs):
+    def _call_coro(self, plugin, coro_name, *args, **kwargs):
+        method = getattr(plugin.object, coro_name, None)
+        if method is not None and self._is_blocking(plugin, method):
+            return (yield from self.run_blocking(plugin, method, *args, **kwargs))
         try:
-            coro = getattr(plugin.object, coro_name, None)(*args, **kwargs)
+            coro = method(*args, **kwargs)
             return (yield from coro)
         except TypeError:
             # Plugin doesn't implement coro_name
@@ -2,64 +2,473 @@
 #
 # See the file license.txt for copying permission.
 import asyncio
+import itertools
 import sqlite3
-import pickle
+import threading
+
+from collections import OrderedDict
+from struct import Struct, error as struct_error
+
+from hbmqtt.mqtt.pubrel import PubrelPacket
+from hbmqtt.session import Session, OutgoingApplicationMessage, RetainedApplicationMessage
+
+SESSION_FORMAT = b'HBS\x01'
+_SESSION_HEADER = Struct('!BHBH')  # flags, keep alive, will QoS, last packet id
+_MESSAGE_HEADER = Struct('!HBB')  # packet id, QoS, flags
+_LENGTH = Struct('!I')
+_NONE = 0xffffffff
+_NO_QOS = 0xff
+
+_CLEAN_SESSION = 0x01
+_WILL_FLAG = 0x02
+_WILL_RETAIN = 0x04
+_RETAIN = 0x01
+_PUBLISH_SENT = 0x02
+_PUBREL_SENT = 0x04
+
+SYNCHRONOUS = {'off': 'OFF', 'normal': 'NORMAL', 'full': 'FULL'}
+
+
+def _pack_field(parts, value):
+    if value is None:
+        parts.append(_LENGTH.pack(_NONE))
+    else:
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        parts.append(_LENGTH.pack(len(value)))
+        parts.append(bytes(value))
+
+
+def _unpack_field(data, offset):
+    length, = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    if length == _NONE:
+        return None, offset
+    return data[offset:offset + length], offset + length
+
+
+def _unpack_str(data, offset):
+    value, offset = _unpack_field(data, offset)
+    return (bytes(value).decode('utf-8') if value is not None else None), offset
+
+
+def _pack_messages(parts, messages):
+    parts.append(_LENGTH.pack(len(messages)))
+    for packet_id, qos, flags, topic, data in messages:
+        parts.append(_MESSAGE_HEADER.pack(packet_id or 0, _NO_QOS if qos is None else qos, flags))
+        _pack_field(parts, topic)
+        _pack_field(parts, data)
+
+
+def _unpack_messages(data, offset):
+    count, = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    messages = []
+    for i in range(count):
+        packet_id, qos, flags = _MESSAGE_HEADER.unpack_from(data, offset)
+        offset += _MESSAGE_HEADER.size
+        topic, offset = _unpack_str(data, offset)
+        payload, offset = _unpack_field(data, offset)
+        messages.append((packet_id or None, None if qos == _NO_QOS else qos, flags, topic, payload))
+    return messages, offset
+
+
+def encode_session(session, queue=True):
+    """
+    Serialize the persistent state of a session: connection parameters, will, messages in flight to the client and
+    messages queued for it while offline. Runtime state (transports, waiters, caches) is not kept.
+    :param session: :class:`hbmqtt.session.Session`
+    :param queue: False to leave the offline queue out
+    :return: bytes
+    """
+    flags = 0
+    if session.clean_session:
+        flags |= _CLEAN_SESSION
+    if session.will_flag:
+        flags |= _WILL_FLAG
+    if session.will_retain:
+        flags |= _WILL_RETAIN
+    parts = [SESSION_FORMAT, _SESSION_HEADER.pack(
+        flags, session.keep_alive or 0, _NO_QOS if session.will_qos is None else session.will_qos,
+        session._packet_id)]
+    for value in (session.client_id, session.username, session.will_topic, session.will_message):
+        _pack_field(parts, value)
+    inflight = []
+    for message in (session.inflight_out.values() if session.inflight_out_count else ()):
+        message_flags = _RETAIN if message.retain else 0
+        if message.publish_packet is not None:
+            message_flags |= _PUBLISH_SENT
+        if message.pubrel_packet is not None:
+            message_flags |= _PUBREL_SENT
+        inflight.append((message.packet_id, message.qos, message_flags, message.topic, message.data))
+    _pack_messages(parts, inflight)
+    queued = session.retained_messages_snapshot() if queue else ()
+    _pack_messages(parts, [(None, message.qos, 0, message.topic, message.data) for message in queued])
+    return b''.join(parts)
+
+
+def decode_session(data, loop=None):
+    """
+    Build a session from data made by :func:`encode_session`
+    :param data: bytes
+    :param loop: event loop of the session
+    :return: :class:`hbmqtt.session.Session`
+    """
+    data = memoryview(data)
+    if bytes(data[:len(SESSION_FORMAT)]) != SESSION_FORMAT:
+        raise ValueError("Unknown session format")
+    offset = len(SESSION_FORMAT)
+    flags, keep_alive, will_qos, packet_id = _SESSION_HEADER.unpack_from(data, offset)
+    offset += _SESSION_HEADER.size
+    session = Session(loop)
+    session.clean_session = bool(flags & _CLEAN_SESSION)
+    session.will_flag = bool(flags & _WILL_FLAG)
+    session.will_retain = bool(flags & _WILL_RETAIN)
+    session.keep_alive = keep_alive
+    session.will_qos = None if will_qos == _NO_QOS else will_qos
+    session._packet_id = packet_id
+    session.client_id, offset = _unpack_str(data, offset)
+    session.username, offset = _unpack_str(data, offset)
+    session.will_topic, offset = _unpack_str(data, offset)
+    will_message, offset = _unpack_field(data, offset)
+    session.will_message = bytes(will_message) if will_message is not None else None
+    inflight, offset = _unpack_messages(data, offset)
+    for packet_id, qos, message_flags, topic, payload in inflight:
+        message = OutgoingApplicationMessage(packet_id, topic, qos, bytes(payload), bool(message_flags & _RETAIN))
+        # Restored messages are resent as retries by the protocol handler
+        if message_flags & _PUBLISH_SENT:
+            message.publish_packet = message.build_publish_packet()
+        if message_flags & _PUBREL_SENT:
+            message.pubrel_packet = PubrelPacket.build(packet_id)
+        session.inflight_out[packet_id] = message
+    queued, offset = _unpack_messages(data, offset)
+    for packet_id, qos, message_flags, topic, payload in queued:
+        session.retained_messages.put_nowait(RetainedApplicationMessage(None, topic, bytes(payload), qos))
+    return session
+
+
+def connect(db_file, durability='normal'):
+    """
+    Open a database in WAL mode
+    :param db_file: database file path
+    :param durability: 'off', 'normal' or 'full', see :class:`SQLitePlugin`
+    :return: sqlite3 connection
+    """
+    conn = sqlite3.connect(db_file, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=%s" % SYNCHRONOUS[durability])
+    return conn
+
+
+class SessionWriter(threading.Thread):
+    """
+    Writes session store updates from its own thread. An update is a list of (SQL statement, parameters) tuples
+    identified by a key: updates handed over by :meth:`write` replace the pending update with the same key, so that
+    only the last update of a record is written, and are written in order by batches of at most ``batch_size``
+    updates, each batch in a single transaction.
+    """
+    def __init__(self, db_file, durability='normal', batch_size=500, logger=None):
+        super().__init__(name='hbmqtt-session-writer', daemon=True)
+        self.db_file = db_file
+        self.durability = durability
+        self.batch_size = batch_size
+        self.logger = logger
+        self.commits = 0
+        self.written = 0
+        self._pending = OrderedDict()
+        self._writing = False
+        self._condition = threading.Condition()
+        self._closing = False
+
+    def write(self, updates):
+        """
+        :param updates: iterable of (key, statements) tuples
+        """
+        with self._condition:
+            for key, statements in updates:
+                self._pending.pop(key, None)
+                self._pending[key] = statements
+            self._condition.notify_all()
+
+    @property
+    def idle(self):
+        with self._condition:
+            return not self._pending and not self._writing
+
+    def wait_idle(self):
+        """
+        Wait until all updates handed over are written
+        """
+        with self._condition:
+            while (self._pending or self._writing) and self.is_alive():
+                self._condition.wait(0.1)
+
+    def close(self):
+        """
+        Write pending updates and stop the thread
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        if self.is_alive():
+            self.join()
+
+    def _take_batch(self):
+        with self._condition:
+            while not self._pending and not self._closing:
+                self._condition.wait()
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popitem(last=False)[1])
+            self._writing = bool(batch)
+            return batch
+
+    def run(self):
+        conn = connect(self.db_file, self.durability)
+        try:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                try:
+                    with conn:
+                        for statements in batch:
+                            for sql, params in statements:
+                                conn.execute(sql, params)
+                    self.commits += 1
+                    self.written += len(batch)
+                except sqlite3.Error as e:
+                    if self.logger:
+                        self.logger.error("Failed writing %d session updates: %s" % (len(batch), e))
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+        finally:
+            conn.close()
+
+
+_SAVE_SESSION = "INSERT OR REPLACE INTO session (client_id, data) VALUES (?,?)"
+_DELETE_SESSION = "DELETE FROM session where client_id=?"
+_SAVE_SUBSCRIPTION = "INSERT OR REPLACE INTO subscription (client_id, filter, qos) VALUES (?,?,?)"
+_DELETE_SUBSCRIPTION = "DELETE FROM subscription where client_id=? and filter=?"
+_DELETE_SUBSCRIPTIONS = "DELETE FROM subscription where client_id=?"
+_QUEUE_MESSAGE = "INSERT INTO message (client_id, data) VALUES (?,?)"
+_DELETE_MESSAGES = "DELETE FROM message where client_id=?"
+
+
+def _encode_message(message):
+    parts = []
+    _pack_messages(parts, [(None, message.qos, 0, message.topic, message.data)])
+    return b''.join(parts)
+
+
+def _decode_message(data):
+    (packet_id, qos, flags, topic, payload), = _unpack_messages(memoryview(data), 0)[0]
+    return RetainedApplicationMessage(None, topic, bytes(payload), qos)
 
 
 class SQLitePlugin:
+    """
+    Session store keeping persistent sessions in a SQLite database, in WAL mode: sessions, with the messages in
+    flight to their client, subscriptions and messages queued for offline clients are stored in their own tables and
+    updated incrementally.
+    Updates are written behind: they are queued, then saved sessions are serialized every ``flush-interval`` seconds,
+    or as soon as ``batch-size`` updates are queued, and updates are written by a :class:`SessionWriter` thread.
+    Several updates of a record between two flushes are written once.
+    ``durability`` sets the SQLite synchronous mode: ``full`` syncs each batch to disk, ``normal`` (default) keeps
+    written sessions on broker crash but may lose the last batches on power loss, ``off`` leaves syncing to the OS.
+    """
+    # Reads run in the plugins executor, one at a time as they share the connection
+    blocking_limit = 1
+
     def __init__(self, context):
         self.context = context
         self.conn = None
         self.cursor = None
         self.db_file = None
+        self._writer = None
+        self._updates = OrderedDict()
+        self._message_keys = itertools.count()
+        self._flush_handle = None
         try:
             self.persistence_config = self.context.config['persistence']
             self.init_db()
         except KeyError:
-            self.context.logger.warning("'persistence' section not found in context configuration")
+            self.context.logger.debug("'persistence' section not found in context configuration, sessions are not stored")
 
     def init_db(self):
         self.db_file = self.persistence_config.get('file', None)
+        self.flush_interval = self.persistence_config.get('flush-interval', 0.1)
+        self.batch_size = self.persistence_config.get('batch-size', 500)
+        durability = self.persistence_config.get('durability', 'normal')
+        if durability not in SYNCHRONOUS:
+            self.context.logger.warning("Unknown durability '%s', using 'normal'" % durability)
+            durability = 'normal'
         if not self.db_file:
             self.context.logger.warning("'file' persistence parameter not found")
         else:
             try:
-                self.conn = sqlite3.connect(self.db_file)
+                self.conn = connect(self.db_file, durability)
                 self.cursor = self.conn.cursor()
                 self.context.logger.info("Database file '%s' opened" % self.db_file)
             except Exception as e:
                 self.context.logger.error("Error while initializing database '%s' : %s" % (self.db_file, e))
         if self.cursor:
             self.cursor.execute("CREATE TABLE IF NOT EXISTS session(client_id TEXT PRIMARY KEY, data BLOB)")
+            self.cursor.execute("CREATE TABLE IF NOT EXISTS subscription("
+                                "client_id TEXT, filter TEXT, qos INTEGER, PRIMARY KEY (client_id, filter))")
+            self.cursor.execute("CREATE TABLE IF NOT EXISTS message("
+                                "id INTEGER PRIMARY KEY AUTOINCREMENT, client_id TEXT, data BLOB)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS message_client_id ON message(client_id, id)")
+            self.conn.commit()
+            # Started on first write
+            self._writer = SessionWriter(self.db_file, durability, self.batch_size, self.context.logger)
+
+    def _queue_update(self, key, update):
+        self._updates.pop(key, None)
+        self._updates[key] = update
+        if len(self._updates) >= self.batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            loop = self.context.loop or asyncio.get_event_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """
+        Serialize saved sessions and hand queued updates over to the writer thread
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._updates:
+            return
+        updates = []
+        for key, update in self._updates.items():
+            if isinstance(update, Session):
+                try:
+                    update = [(_SAVE_SESSION, (update.client_id, encode_session(update, queue=False)))]
+                except Exception as e:
+                    self.context.logger.error("Failed saving session '%s': %s" % (update, e))
+                    continue
+            updates.append((key, update))
+        self._updates.clear()
+        self._writer.write(updates)
+        if self._writer.ident is None:
+            self._writer.start()
+
+    @asyncio.coroutine
+    def sync(self):
+        """
+        Flush queued updates and wait until they are written
+        """
+        if self._writer:
+            self.flush()
+            if not self._writer.idle:
+                loop = self.context.loop or asyncio.get_event_loop()
+                yield from loop.run_in_executor(None, self._writer.wait_idle)
 
     @asyncio.coroutine
     def save_session(self, session):
-        if self.cursor:
-            dump = pickle.dumps(session)
-            try:
-                self.cursor.execute(
-                    "INSERT OR REPLACE INTO session (client_id, data) VALUES (?,?)", (session.client_id, dump))
-                self.conn.commit()
-            except Exception as e:
-                self.context.logger.error("Failed saving session '%s': %s" % (session, e))
+        """
+        Save a session and the messages in flight to its client. Its offline queue is saved by :meth:`save_queue`.
+        """
+        if self._writer:
+            # Serialized on flush
+            self._queue_update(('session', session.client_id), session)
+
+    @asyncio.coroutine
+    def del_session(self, client_id):
+        """
+        Delete a session with its subscriptions and queued messages
+        """
+        if self._writer:
+            self._queue_update(('delete', client_id), [
+                (_DELETE_SESSION, (client_id,)),
+                (_DELETE_SUBSCRIPTIONS, (client_id,)),
+                (_DELETE_MESSAGES, (client_id,))])
+
+    @asyncio.coroutine
+    def add_subscription(self, client_id, topic_filter, qos):
+        if self._writer:
+            self._queue_update(('subscription', client_id, topic_filter),
+                               [(_SAVE_SUBSCRIPTION, (client_id, topic_filter, qos))])
+
+    @asyncio.coroutine
+    def del_subscription(self, client_id, topic_filter):
+        if self._writer:
+            self._queue_update(('subscription', client_id, topic_filter),
+                               [(_DELETE_SUBSCRIPTION, (client_id, topic_filter))])
+
+    @asyncio.coroutine
+    def queue_message(self, client_id, message):
+        """
+        Append a message to the offline queue of a client
+        :param message: :class:`hbmqtt.session.RetainedApplicationMessage`
+        """
+        if self._writer:
+            self._queue_update(('message', next(self._message_keys)),
+                               [(_QUEUE_MESSAGE, (client_id, _encode_message(message)))])
+
+    @asyncio.coroutine
+    def save_queue(self, client_id, messages):
+        """
+        Replace the offline queue of a client
+        :param messages: iterable of :class:`hbmqtt.session.RetainedApplicationMessage`
+        """
+        if self._writer:
+            self._queue_update(('queue', client_id), [(_DELETE_MESSAGES, (client_id,))])
+            for message in messages:
+                yield from self.queue_message(client_id, message)
+
+    def _read_session(self, client_id):
+        row = self.cursor.execute("SELECT data FROM session where client_id=?", (client_id,)).fetchone()
+        if not row:
+            return None, []
+        messages = self.cursor.execute(
+            "SELECT data FROM message where client_id=? ORDER BY id", (client_id,)).fetchall()
+        return row[0], [m[0] for m in messages]
 
     @asyncio.coroutine
     def find_session(self, client_id):
-        if self.cursor:
-            row = self.cursor.execute("SELECT data FROM session where client_id=?", (client_id,)).fetchone()
-            if row:
-                return pickle.loads(row[0])
-            else:
-                return None
+        """
+        Restore a stored session, with the messages in flight to its client and its offline queue
+        :return: :class:`hbmqtt.session.Session` or None
+        """
+        if self._writer:
+            # Reads see updates once written
+            yield from self.sync()
+            data, messages = yield from self.context.run_blocking(self._read_session, client_id)
+            if data:
+                try:
+                    session = decode_session(data, self.context.loop)
+                    for message in messages:
+                        session.retained_messages.put_nowait(_decode_message(message))
+                    return session
+                except (ValueError, UnicodeDecodeError, struct_error) as e:
+                    self.context.logger.warning("Can't restore session '%s': %s" % (client_id, e))
+            return None
+
+    def _read_subscriptions(self, client_id):
+        return self.cursor.execute("SELECT filter, qos FROM subscription where client_id=?", (client_id,)).fetchall()
 
     @asyncio.coroutine
-    def del_session(self, client_id):
-        if self.cursor:
-            self.cursor.execute("DELETE FROM session where client_id=?", (client_id,))
-            self.conn.commit()
+    def find_subscriptions(self, client_id):
+        """
+        :return: list of (topic filter, QoS) tuples subscribed by a client
+        """
+        if self._writer:
+            yield from self.sync()
+            return (yield from self.context.run_blocking(self._read_subscriptions, client_id))
+        return []
 
     @asyncio.coroutine
     def on_broker_post_shutdown(self):
+        if self._writer:
+            self.flush()
+            loop = self.context.loop or asyncio.get_event_loop()
+            yield from loop.run_in_executor(None, self._writer.close)
+            self.context.logger.debug("%d session updates written in %d transactions" %
+                                      (self._writer.written, self._writer.commits))
         if self.conn:
             self.conn.close()
             self.context.logger.info("Database file '%s' closed" % self.db_file)
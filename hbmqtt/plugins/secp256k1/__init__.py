@@ -166,9 +166,192 @@ def point_add(P1, P2):
     return [x3, (lam * (x(P1) - x3) - y(P1)) % p]
 
 
+# Scalars are read as 256-bit integers, as the former double-and-add loop did
+SCALAR_MASK = (1 << 256) - 1
+# wNAF window width used for scalar multiplication: odd multiples up to 15P
+# are precomputed
+WNAF_WIDTH = 5
+# Window width of the fixed-base table of G: 32 rows of 255 points
+G_TABLE_WIDTH = 8
+_G_TABLE = None
+
+
+def _jacobian_double(J):
+    """
+    Double a point in Jacobian coordinates ``(X, Y, Z)``, with ``x=X/Z²`` and
+    ``y=Y/Z³``. ``None`` is the point at infinity.
+    """
+    if J is None:
+        return None
+    X1, Y1, Z1 = J
+    if Y1 == 0:
+        return None
+    YY = Y1 * Y1 % p
+    S = 4 * X1 * YY % p
+    M = 3 * X1 * X1 % p
+    X3 = (M * M - 2 * S) % p
+    Y3 = (M * (S - X3) - 8 * YY * YY) % p
+    Z3 = 2 * Y1 * Z1 % p
+    return (X3, Y3, Z3)
+
+
+def _jacobian_add(J, P):
+    """
+    Add an affine point to a point in Jacobian coordinates, without modular
+    inversion.
+    """
+    if J is None:
+        return (P[0], P[1], 1)
+    X1, Y1, Z1 = J
+    Z1Z1 = Z1 * Z1 % p
+    H = (P[0] * Z1Z1 - X1) % p
+    R = (P[1] * Z1 * Z1Z1 - Y1) % p
+    if H == 0:
+        if R == 0:
+            return _jacobian_double(J)
+        return None
+    HH = H * H % p
+    HHH = H * HH % p
+    V = X1 * HH % p
+    X3 = (R * R - HHH - 2 * V) % p
+    Y3 = (R * (V - X3) - Y1 * HHH) % p
+    Z3 = Z1 * H % p
+    return (X3, Y3, Z3)
+
+
+def _affine(J):
+    """
+    Convert a point in Jacobian coordinates to affine coordinates with a
+    single modular inversion.
+    """
+    if J is None:
+        return None
+    X, Y, Z = J
+    invZ = pow(Z, p - 2, p)
+    invZ2 = invZ * invZ % p
+    return [X * invZ2 % p, Y * invZ2 * invZ % p]
+
+
+def _batch_affine(points):
+    """
+    Convert points in Jacobian coordinates to affine coordinates sharing a
+    single modular inversion (Montgomery's trick). Points must not be at
+    infinity.
+    """
+    products = []
+    acc = 1
+    for X, Y, Z in points:
+        acc = acc * Z % p
+        products.append(acc)
+    inv = pow(acc, p - 2, p)
+    result = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        X, Y, Z = points[i]
+        invZ = inv * products[i - 1] % p if i else inv
+        inv = inv * Z % p
+        invZ2 = invZ * invZ % p
+        result[i] = (X * invZ2 % p, Y * invZ2 * invZ % p)
+    return result
+
+
+def _odd_multiples(points, w=WNAF_WIDTH):
+    """
+    Return ``[P, 3P, 5P, ..., (2^(w-1)-1)P]`` and their opposites, in affine
+    coordinates, for each point. Normalisations of all points share two
+    modular inversions.
+    """
+    doubles = [_jacobian_double((P[0], P[1], 1)) for P in points]
+    doubled = iter(_batch_affine([J for J in doubles if J is not None]))
+    chains = []
+    for P, P2 in zip(points, doubles):
+        multiples = [(P[0], P[1], 1)]
+        if P2 is not None:
+            P2 = next(doubled)
+            for i in range(1, 1 << (w - 2)):
+                J = _jacobian_add(multiples[-1], P2)
+                if J is None:
+                    break
+                multiples.append(J)
+        chains.append(multiples)
+    normalised = iter(_batch_affine([J for multiples in chains for J in multiples]))
+    result = []
+    for multiples in chains:
+        positive = [next(normalised) for J in multiples]
+        result.append((positive, [(x_, (p - y_) % p) for x_, y_ in positive]))
+    return result
+
+
+def _build_g_table(w=G_TABLE_WIDTH):
+    """
+    Build the fixed-base table of ``G``: row ``i`` holds ``j*2^(w*i)*G`` for
+    ``j`` in ``[1, 2^w[``, so that ``k*G`` only needs one point addition per
+    w-bit window of ``k`` and no doubling.
+    """
+    size = (1 << w) - 1
+    base = (G[0], G[1])
+    points = []
+    for i in range((256 + w - 1) // w):
+        row = [(base[0], base[1], 1)]
+        for j in range(1, size):
+            row.append(_jacobian_add(row[-1], base))
+        points.extend(row)
+        # 2^w*base = (2^w-1)*base + base
+        base = _affine(_jacobian_add(row[-1], base))
+    points = _batch_affine(points)
+    return [points[i:i + size] for i in range(0, len(points), size)]
+
+
+def _g_mul_add(J, k):
+    """
+    Add ``k*G`` to a point in Jacobian coordinates using the fixed-base table,
+    built on first use.
+    """
+    global _G_TABLE
+    if _G_TABLE is None:
+        _G_TABLE = _build_g_table()
+    mask = (1 << G_TABLE_WIDTH) - 1
+    for row in _G_TABLE:
+        if not k:
+            break
+        j = k & mask
+        if j:
+            J = _jacobian_add(J, row[j - 1])
+        k >>= G_TABLE_WIDTH
+    return J
+
+
+def wnaf(k, w=WNAF_WIDTH):
+    """
+    Width-w non-adjacent form of a positive scalar.
+
+    Args:
+        k (:class:`int`): scalar
+        w (:class:`int`): window width
+    Returns:
+        :class:`list`: odd digits in ``]-2^(w-1), 2^(w-1)[`` or 0, least
+        significant first
+    """
+    digits = []
+    window = 1 << w
+    half = window >> 1
+    while k:
+        if k & 1:
+            d = k & (window - 1)
+            if d >= half:
+                d -= window
+            k -= d
+        else:
+            d = 0
+        digits.append(d)
+        k >>= 1
+    return digits
+
+
 def point_mul(P, n):
     """
     Multiply ``secp256k1`` point with scalar.
+    Uses Jacobian coordinates and windowed NAF of the scalar: the result is
+    converted back to affine coordinates with a single modular inversion.
 
     Args:
         P (:class:`list`): ``secp256k1`` point
@@ -176,12 +359,67 @@ def point_mul(P, n):
     Returns:
         :class:`list`: ``secp256k1`` point
     """
+    return point_mul_add(P, n, None, 0)
+
+
+def point_mul_add(P1, k1, P2, k2):
+    """
+    Compute ``k1*P1 + k2*P2`` with a single chain of point doublings
+    (Straus-Shamir trick), both scalars being in windowed NAF. Multiples of
+    ``G`` are added from its fixed-base table instead.
+
+    Args:
+        P1 (:class:`list`): ``secp256k1`` point
+        k1 (:class:`int`): scalar
+        P2 (:class:`list`): ``secp256k1`` point
+        k2 (:class:`int`): scalar
+    Returns:
+        :class:`list`: ``secp256k1`` point, None if point at infinity
+    """
+    return multi_point_mul(((P1, k1), (P2, k2)))
+
+
+def multi_point_mul(terms):
+    """
+    Compute the sum of ``k*P`` for all ``(P, k)`` terms with a single chain of
+    point doublings, as :func:`point_mul_add` does for two terms.
+
+    Args:
+        terms (:class:`list`): ``(P, k)`` pairs of ``secp256k1`` point and
+            scalar
+    Returns:
+        :class:`list`: ``secp256k1`` point, None if point at infinity
+    """
+    points = []
+    scalars = []
+    g_scalar = 0
+    for P, k in terms:
+        k = int(k) & SCALAR_MASK
+        if P is None or not k:
+            continue
+        if P[0] == G[0] and P[1] == G[1]:
+            g_scalar += k
+        else:
+            points.append(P)
+            scalars.append(k)
+    chains = [
+        (wnaf(k), positive, negative)
+        for k, (positive, negative) in zip(scalars, _odd_multiples(points))
+    ]
     R = None
-    for i in range(256):
-        if ((n >> i) & 1):
-            R = point_add(R, P)
-        P = point_add(P, P)
-    return R
+    if chains:
+        for i in range(max(len(digits) for digits, _, _ in chains) - 1, -1, -1):
+            R = _jacobian_double(R)
+            for digits, positive, negative in chains:
+                if i < len(digits):
+                    d = digits[i]
+                    if d > 0:
+                        R = _jacobian_add(R, positive[d >> 1])
+                    elif d < 0:
+                        R = _jacobian_add(R, negative[-d >> 1])
+    if g_scalar:
+        R = _g_mul_add(R, g_scalar % n)
+    return _affine(R)
 
 
 def bytes_from_int(x):
@@ -71,9 +71,9 @@ def verify(msg, pubkey, sig):
     h = int_from_bytes(msg)
     c = pow(s, n-2, n)
 
-    u1G = G * ((h*c) % n)
-    # u2Q = PublicKey.decode(pubkey) * ((r*c) % n)
-    u2Q = point_mul(PublicKey.decode(pubkey), ((r*c) % n))
-    GQ = u1G + u2Q
+    # u1*G + u2*Q computed at once
+    GQ = point_mul_add(G, (h*c) % n, PublicKey.decode(pubkey), (r*c) % n)
+    if GQ is None:
+        return False
 
-    return (GQ.x % n) == r
+    return (x(GQ) % n) == r
@@ -1,5 +1,7 @@
 # -*- encoding:utf-8 -*-
 
+import os
+
 from hbmqtt.plugins.secp256k1 import *
 
 
@@ -70,8 +72,9 @@ norr <https://github.com/bcoin-org/bcrypto/blob/v4.1.0/lib/js/schnorr.js>`_
         return False
 
     e = int_from_bytes(hash_sha256(sig[0:32] + pubkey + msg)) % n
-    R = Point(*(G*s + point_mul(P, n-e)))  # P*(n-e) does not work...
-    if R is None or not is_quad(R.y) or R.x != r:
+    # s*G + (n-e)*P computed at once
+    R = point_mul_add(G, s, P, n-e)
+    if R is None or not is_quad(y(R)) or x(R) != r:
         return False
 
     return True
@@ -183,8 +186,89 @@ ps://github.com/sipa/bips/blob/bip-schnorr/bip-schnorr.mediawiki>`_ spec.
         return False
 
     e = int_from_bytes(tagged_hash("BIPSchnorr", sig[0:32] + pubkey + msg)) % n
-    R = Point(*(G*s + point_mul(P, n-e)))  # P*(n-e) does not work...
-    if R is None or not is_quad(R.y) or R.x != r:
+    # s*G + (n-e)*P computed at once
+    R = point_mul_add(G, s, P, n-e)
+    if R is None or not is_quad(y(R)) or x(R) != r:
         return False
 
     return True
+
+
+def batch_verify(msgs, pubkeys, sigs):
+    """
+    Check several signatures at once according to `BIP schnorr <https://githu\
+b.com/sipa/bips/blob/bip-schnorr/bip-schnorr.mediawiki>`_ batch verification:
+    all equations ``s*G = R + e*P``, weighted with random coefficients, are
+    summed and checked with a single chain of point doublings.
+
+    Args:
+        msgs (:class:`list`): sha256 message-hashes
+        pubkeys (:class:`list`): encoded public keys
+        sigs (:class:`list`): signatures
+    Returns:
+        :class:`bool`: True if all match
+    """
+    if not len(msgs) == len(pubkeys) == len(sigs):
+        raise ValueError('Messages, public keys and signatures must match.')
+
+    terms = []
+    g_scalar = 0
+    for i, (msg, pubkey, sig) in enumerate(zip(msgs, pubkeys, sigs)):
+        if len(msg) != 32:
+            raise ValueError('The message must be a 32-byte array.')
+        if len(pubkey) != 32:
+            raise ValueError('The public key must be a 32-byte array.')
+        if len(sig) != 64:
+            raise ValueError('The signature must be a 64-byte array.')
+
+        P = point_from_bytes(pubkey)
+        if (P is None):
+            return False
+
+        r, s = int_from_bytes(sig[:32]), int_from_bytes(sig[32:])
+        if (r >= p or s >= n):
+            return False
+        # y_from_x returns the square root which is a quadratic residue
+        R = point_from_bytes(sig[:32])
+        if (R is None):
+            return False
+
+        e = int_from_bytes(
+            tagged_hash("BIPSchnorr", sig[0:32] + pubkey + msg)
+        ) % n
+        a = 1 if i == 0 else int_from_bytes(os.urandom(16)) or 1
+        g_scalar += a * s
+        terms.append((R, a))
+        terms.append((P, a * e % n))
+
+    # sum(a*R) + sum(a*e*P) - sum(a*s)*G must be the point at infinity
+    terms.append((G, n - g_scalar % n))
+    return multi_point_mul(terms) is None
+
+
+def verify_batch(msgs, pubkeys, sigs):
+    """
+    Check each signature of a batch. The whole batch is checked with
+    :func:`batch_verify` first; if it fails, signatures are checked one by one
+    to find the failing ones. Malformed signatures do not match.
+
+    Args:
+        msgs (:class:`list`): sha256 message-hashes
+        pubkeys (:class:`list`): encoded public keys
+        sigs (:class:`list`): signatures
+    Returns:
+        :class:`list`: True or False for each signature
+    """
+    if len(sigs) > 1:
+        try:
+            if batch_verify(msgs, pubkeys, sigs):
+                return [True] * len(sigs)
+        except ValueError:
+            pass
+    results = []
+    for msg, pubkey, sig in zip(msgs, pubkeys, sigs):
+        try:
+            results.append(verify(msg, pubkey, sig))
+        except ValueError:
+            results.append(False)
+    return results
@@ -33,6 +33,11 @@ STAT_CLIENTS_CONNECTED = 'clients_connected'
 STAT_CLIENTS_DISCONNECTED = 'clients_disconnected'
 
 
+def _read_json(req):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    return json.loads(urlopen(req, context=ctx, timeout=5).read())
+
+
 class BrokerBlockchainPlugin:
 
     endpoints = property(lambda cls: cls._endpoints.keys(), None, None, "")
@@ -95,10 +100,8 @@ class BrokerBlockchainPlugin:
                 method, req.get_full_url(), data
             )
             try:
-                ctx = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-                result = json.loads(
-                    urlopen(req, context=ctx, timeout=5).read()
-                )
+                # urlopen blocks: it runs in the plugins executor
+                result = await self.context.run_blocking(_read_json, req)
             except Exception as error:
                 return {
                     "status": 500,
@@ -231,9 +234,9 @@ class BlockchainApiPlugin(BrokerBlockchainPlugin):
         try:
             if method in ["POST", "PUT"]:
                 if "webhooks" in topic:
-                    public_ip = self.http_request(
+                    public_ip = (await self.http_request(
                         "/plain", peer="https://ipecho.net"
-                    ).get("raw", None)
+                    )).get("raw", None)
                     if public_ip is not None:
                         data["target"] = "%s/webhook/forward" % public_ip
                 resp = await self.http_request(path, method, data)
@@ -259,7 +262,7 @@ class BlockchainApiPlugin(BrokerBlockchainPlugin):
                 "qos": 2,
                 "venv": os.path.dirname(sys.executable)
             }
-            self.http_request(
+            await self.http_request(
                 "/webhook/register", "POST", data,
                 peer="http://%s" % self._blockchain.get("webhook-listener", {})
                 .get("host", "127.0.0.1:5000")
@@ -313,8 +316,11 @@ class BrokerSysPlugin:
     def on_broker_post_start(self, *args, **kwargs):
         self._stats[STAT_START_TIME] = datetime.now()
         from hbmqtt.version import get_version
-        version = 'HBMQTT version ' + get_version()
-        self.context.retain_message(DOLLAR_SYS_ROOT + 'version', version.encode())
+        version = ('HBMQTT version ' + get_version()).encode()
+        # Retained messages may be stored: don't retain the version again if it did not change
+        retained = self.context.retained_messages.get(DOLLAR_SYS_ROOT + 'version')
+        if retained is None or retained.data != version:
+            self.context.retain_message(DOLLAR_SYS_ROOT + 'version', version)
 
         # Start $SYS topics management
         try:
@@ -377,6 +383,20 @@ class BrokerSysPlugin:
         tasks.append(self.schedule_broadcast_sys_topic('messages/publish/sent', int_to_bytes_str(self._stats[STAT_PUBLISH_SENT])))
         tasks.append(self.schedule_broadcast_sys_topic('messages/retained/count', int_to_bytes_str(len(self.context.retained_messages))))
         tasks.append(self.schedule_broadcast_sys_topic('messages/subscriptions/count', int_to_bytes_str(subscriptions_count)))
+        # Counters of other plugins, given by their sys_stats() method
+        for plugin in self.context.plugins:
+            sys_stats = getattr(plugin.object, 'sys_stats', None)
+            if sys_stats is not None:
+                for topic_basename, value in sys_stats().items():
+                    tasks.append(self.schedule_broadcast_sys_topic(topic_basename, int_to_bytes_str(value)))
+        # Executor usage of blocking plugin hooks, times in milliseconds
+        for (plugin_name, hook_name), stats in self.context.hook_stats.items():
+            topic_basename = 'plugins/%s/%s/' % (plugin_name, hook_name)
+            for name, value in (('calls', stats.calls),
+                                ('pending', stats.pending),
+                                ('queue_time', int(stats.queue_time * 1000)),
+                                ('queue_time/max', int(stats.max_queue_time * 1000))):
+                tasks.append(self.schedule_broadcast_sys_topic(topic_basename + name, int_to_bytes_str(value)))
 
         # Wait until broadcasting tasks end
         while tasks and tasks[0].done():
@@ -386,7 +406,6 @@ class BrokerSysPlugin:
         self.context.logger.debug("Broadcasting $SYS topics")
         self.sys_handle = self.context.loop.call_later(sys_interval, self.broadcast_dollar_sys_topics)
 
-    @asyncio.coroutine
     def on_mqtt_packet_received(self, *args, **kwargs):
         packet = kwargs.get('packet')
         if packet:
@@ -396,7 +415,6 @@ class BrokerSysPlugin:
             if packet.fixed_header.packet_type == PUBLISH:
                 self._stats[STAT_PUBLISH_RECEIVED] += 1
 
-    @asyncio.coroutine
     def on_mqtt_packet_sent(self, *args, **kwargs):
         packet = kwargs.get('packet')
         if packet:
@@ -406,12 +424,10 @@ class BrokerSysPlugin:
             if packet.fixed_header.packet_type == PUBLISH:
                 self._stats[STAT_PUBLISH_SENT] += 1
 
-    @asyncio.coroutine
     def on_broker_client_connected(self, *args, **kwargs):
         self._stats[STAT_CLIENTS_CONNECTED] += 1
         self._stats[STAT_CLIENTS_MAXIMUM] = max(self._stats[STAT_CLIENTS_MAXIMUM], self._stats[STAT_CLIENTS_CONNECTED])
 
-    @asyncio.coroutine
     def on_broker_client_disconnected(self, *args, **kwargs):
         self._stats[STAT_CLIENTS_CONNECTED] -= 1
         self._stats[STAT_CLIENTS_DISCONNECTED] += 1
@@ -1,4 +1,8 @@
-import asyncio
+from hbmqtt.topics import MULTI_LEVEL_WILDCARD, SINGLE_LEVEL_WILDCARD, TOPIC_LEVEL_SEPARATOR
+
+
+USERNAME_TEMPLATE = '%u'
+CLIENT_ID_TEMPLATE = '%c'
 
 
 class BaseTopicPlugin:
@@ -22,7 +26,6 @@ class TopicTabooPlugin(BaseTopicPlugin):
         super().__init__(context)
         self._taboo = ['prohibited', 'top-secret', 'data/classified']
 
-    @asyncio.coroutine
     def topic_filtering(self, *args, **kwargs):
         filter_result = super().topic_filtering(*args, **kwargs)
         if filter_result:
@@ -41,7 +44,6 @@ class EcdsaTopicPlugin(BaseTopicPlugin):
     def __init__(self, context):
         super().__init__(context)
 
-    @asyncio.coroutine
     def topic_filtering(self, *args, **kwargs):
         filter_result = super().topic_filtering(*args, **kwargs)
         if filter_result:
@@ -57,9 +59,168 @@ class EcdsaTopicPlugin(BaseTopicPlugin):
         return filter_result
 
 
+class TokenTopicPlugin(BaseTopicPlugin):
+    """
+    Allow clients authenticated by :class:`hbmqtt.plugins.authentication.TokenAuthPlugin` to use the topics
+    starting with one of the prefixes of their token only. Other clients are left to other plugins.
+    """
+    def topic_filtering(self, *args, **kwargs):
+        filter_result = super().topic_filtering(*args, **kwargs)
+        if filter_result:
+            session = kwargs.get('session', None)
+            topic = kwargs.get('topic', None)
+            prefixes = getattr(session, "_token_topics", None)
+            if prefixes is None:
+                return None
+            return bool(topic) and topic.startswith(prefixes)
+        return filter_result
+
+
+class _AclNode:
+
+    __slots__ = ('children', 'single', 'templates', 'multi', 'terminal')
+
+    def __init__(self):
+        self.children = None
+        self.single = None
+        self.templates = None
+        self.multi = False
+        self.terminal = False
+
+
+def _substitute(template, username, client_id):
+    """
+    Replace %u and %c in an ACL level by the username and client id. Values which are not a valid topic level
+    are not substituted, so that a client can't get wildcard access through its username or client id.
+    :return: substituted level or None
+    """
+    for token, value in ((USERNAME_TEMPLATE, username), (CLIENT_ID_TEMPLATE, client_id)):
+        if token in template:
+            if not value or MULTI_LEVEL_WILDCARD in value or SINGLE_LEVEL_WILDCARD in value:
+                return None
+            template = template.replace(token, value)
+    return template
+
+
+class AccessControlList:
+    """
+    Allowed topics of a user, compiled level by level so that checking a topic walks its levels once instead of
+    comparing it with every allowed topic.
+
+    Topics are allowed as by :meth:`TopicAccessControlListPlugin.topic_ac`: ``+`` allows any single level and
+    ``#`` allows one or more remaining levels. ``%u`` and ``%c`` in a level are replaced by the username and the
+    client id of the session checked, for example ``devices/%c/#``.
+    """
+
+    __slots__ = ('_root', '_topics')
+
+    def __init__(self, allowed_topics=()):
+        self._root = _AclNode()
+        self._topics = set()
+        for allowed_topic in allowed_topics:
+            self.add(allowed_topic)
+
+    def add(self, allowed_topic):
+        special = (MULTI_LEVEL_WILDCARD, SINGLE_LEVEL_WILDCARD, USERNAME_TEMPLATE, CLIENT_ID_TEMPLATE)
+        if not any(token in allowed_topic for token in special):
+            # Topics without wildcard nor template only allow themselves
+            self._topics.add(allowed_topic)
+            return
+        node = self._root
+        for level in allowed_topic.split(TOPIC_LEVEL_SEPARATOR):
+            if level == MULTI_LEVEL_WILDCARD:
+                # Following levels are never compared
+                node.multi = True
+                return
+            if level == SINGLE_LEVEL_WILDCARD:
+                if node.single is None:
+                    node.single = _AclNode()
+                node = node.single
+            elif USERNAME_TEMPLATE in level or CLIENT_ID_TEMPLATE in level:
+                if node.templates is None:
+                    node.templates = dict()
+                child = node.templates.get(level)
+                if child is None:
+                    child = node.templates[level] = _AclNode()
+                node = child
+            else:
+                if node.children is None:
+                    node.children = dict()
+                child = node.children.get(level)
+                if child is None:
+                    child = node.children[level] = _AclNode()
+                node = child
+        node.terminal = True
+
+    def allows(self, topic, username=None, client_id=None):
+        """
+        Check if a topic name, or a topic filter, is allowed
+        :param topic: requested topic
+        :param username: value of %u templates
+        :param client_id: value of %c templates
+        :return: True if allowed
+        """
+        if topic in self._topics:
+            return True
+        nodes = [self._root]
+        for level in topic.split(TOPIC_LEVEL_SEPARATOR):
+            next_nodes = []
+            for node in nodes:
+                if node.multi:
+                    return True
+                if node.children is not None:
+                    child = node.children.get(level)
+                    if child is not None:
+                        next_nodes.append(child)
+                if node.single is not None:
+                    next_nodes.append(node.single)
+                if node.templates is not None:
+                    for template, child in node.templates.items():
+                        if _substitute(template, username, client_id) == level:
+                            next_nodes.append(child)
+            if not next_nodes:
+                return False
+            nodes = next_nodes
+        for node in nodes:
+            if node.terminal:
+                return True
+        return False
+
+
 class TopicAccessControlListPlugin(BaseTopicPlugin):
     def __init__(self, context):
         super().__init__(context)
+        self._acl_config = dict()
+        self._acl = dict()
+        self.load_acl()
+
+    def load_acl(self):
+        """
+        Load the Access Control List from configuration. The allowed topics of a user are compiled on the first
+        check of this user, so loading a large ACL is immediate.
+        Must be called again when the ``acl`` configuration is changed, see
+        :meth:`hbmqtt.broker.Broker.clear_topic_filtering_cache`.
+        """
+        topic_config = getattr(self, 'topic_config', None)
+        if topic_config:
+            self._acl_config = topic_config.get('acl', None) or dict()
+        else:
+            self._acl_config = dict()
+        self._acl = dict()
+
+    def get_acl(self, username):
+        """
+        Get the compiled Access Control List of a user
+        :param username: username, 'anonymous' for anonymous sessions
+        :return: :class:`AccessControlList` or None if the user has no allowed topic
+        """
+        try:
+            return self._acl[username]
+        except KeyError:
+            allowed_topics = self._acl_config.get(username, None)
+            acl = AccessControlList(allowed_topics) if allowed_topics else None
+            self._acl[username] = acl
+            return acl
 
     @staticmethod
     def topic_ac(topic_requested, topic_allowed):
@@ -82,7 +243,6 @@ class TopicAccessControlListPlugin(BaseTopicPlugin):
                 break
         return ret
 
-    @asyncio.coroutine
     def topic_filtering(self, *args, **kwargs):
         filter_result = super().topic_filtering(*args, **kwargs)
         if filter_result:
@@ -92,12 +252,9 @@ class TopicAccessControlListPlugin(BaseTopicPlugin):
                 username = session.username
                 if username is None:
                     username = 'anonymous'
-                allowed_topics = self.topic_config['acl'].get(username, None)
-                if allowed_topics:
-                    for allowed_topic in allowed_topics:
-                        if self.topic_ac(req_topic, allowed_topic):
-                            return True
-                    return False
+                acl = self.get_acl(username)
+                if acl is not None:
+                    return acl.allows(req_topic, session.username, session.client_id)
                 else:
                     return False
             else:
@@ -0,0 +1,541 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+import heapq
+import logging
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from hbmqtt.session import RetainedApplicationMessage
+from hbmqtt.topics import TopicTree, MULTI_LEVEL_WILDCARD, SINGLE_LEVEL_WILDCARD, TOPIC_LEVEL_SEPARATOR
+
+LOG_FORMAT = b'HBRL\x01'
+INDEX_FORMAT = b'HBRX\x01'
+
+# Log header: format, generation
+_LOG_HEADER = struct.Struct('!5sQ')
+# Index header: format, generation of the log, log size covered, garbage bytes in the log, number of topics
+_INDEX_HEADER = struct.Struct('!5sQQQQ')
+# Record header: crc32 of the rest of the record, flags, topic length, payload length
+_RECORD = struct.Struct('!IBHI')
+_OFFSET = struct.Struct('!Q')
+_TOPIC_LENGTH = struct.Struct('!H')
+
+_TOMBSTONE = 0xff
+_NO_QOS = 0xfe
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_record(topic, data, flags):
+    body = _RECORD.pack(0, flags, len(topic), len(data))[4:] + topic + data
+    return struct.pack('!I', zlib.crc32(body)) + body
+
+
+def _topic_matches(topic, filter_levels):
+    topic_levels = topic.split(TOPIC_LEVEL_SEPARATOR)
+    # [MQTT-4.7.2-1] Filters starting with a wildcard don't match topics starting with '$'
+    if filter_levels[0] in (MULTI_LEVEL_WILDCARD, SINGLE_LEVEL_WILDCARD) and topic.startswith('$'):
+        return False
+    for i, level in enumerate(filter_levels):
+        if level == MULTI_LEVEL_WILDCARD:
+            return True
+        if i >= len(topic_levels) or (level != SINGLE_LEVEL_WILDCARD and level != topic_levels[i]):
+            return False
+    return len(topic_levels) == len(filter_levels)
+
+
+class RetainedStore(MutableMapping):
+    """
+    Retained messages indexed by topic name and stored on disk, with the same interface as the
+    :class:`hbmqtt.topics.TopicTree` the broker uses otherwise.
+
+    Messages are appended to a log file, and cleared topics get a tombstone record. An index file lists the log
+    offsets of the live records sorted by topic: it is memory-mapped when the store opens, so that opening the store
+    only replays the records appended since the index was written. Payloads are read from the memory-mapped log when a
+    topic is looked up, the ``cache_size`` most recently used messages being kept in memory.
+
+    :meth:`maintain` writes the index again when many topics changed, and rewrites the log without its dead records
+    when they exceed ``compact_ratio`` of its size. :meth:`start_maintenance` and :meth:`finish_maintenance` do the
+    same with the files written by another thread while the store is used.
+    """
+
+    def __init__(self, path, cache_size=1024, compact_ratio=0.5, checkpoint_size=10000):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.cache_size = cache_size
+        self.compact_ratio = compact_ratio
+        self.checkpoint_size = checkpoint_size
+        self._cache = OrderedDict()
+        # Topics changed since the index was written, with the offset of their record (None when cleared)
+        self._recent = TopicTree()
+        self._file = None
+        self._map = None
+        self._index = None
+        self._index_count = 0
+        self._generation = 0
+        self._size = 0
+        self._count = 0
+        self._garbage = 0
+        self._open()
+
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < _LOG_HEADER.size:
+            with open(self.path, 'wb') as f:
+                f.write(_LOG_HEADER.pack(LOG_FORMAT, 1))
+                f.flush()
+                os.fsync(f.fileno())
+        self._file = open(self.path, 'r+b')
+        log_format, self._generation = _LOG_HEADER.unpack(self._file.read(_LOG_HEADER.size))
+        if log_format != LOG_FORMAT:
+            self._file.close()
+            raise ValueError("Unknown retained store format in '%s'" % self.path)
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._recent = TopicTree()
+        self._count = 0
+        self._garbage = 0
+        self._replay(self._load_index())
+        self._file.seek(self._size)
+
+    def _load_index(self):
+        """
+        Map the index file if it matches the log
+        :return: offset of the first log record not covered by the index
+        """
+        self._index = None
+        self._index_count = 0
+        try:
+            with open(self.index_path, 'rb') as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return _LOG_HEADER.size
+        try:
+            index_format, generation, covered, garbage, count = _INDEX_HEADER.unpack_from(index)
+        except struct.error:
+            index_format = None
+        if index_format != INDEX_FORMAT or generation != self._generation or covered > self._size or \
+                len(index) != _INDEX_HEADER.size + count * _OFFSET.size:
+            logger.warning("Ignoring retained store index '%s' not matching its log" % self.index_path)
+            index.close()
+            return _LOG_HEADER.size
+        self._index = index
+        self._index_count = count
+        self._count = count
+        self._garbage = garbage
+        return covered
+
+    def _replay(self, offset):
+        """
+        Apply the log records appended after the index. A record truncated or corrupted by a crash ends the log.
+        """
+        while offset < self._size:
+            record = self._read_record(offset)
+            if record is None:
+                logger.warning("Retained store '%s' truncated at %d: incomplete last record" % (self.path, offset))
+                self._map.close()
+                self._file.truncate(offset)
+                self._size = offset
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                break
+            flags, topic, data, size = record
+            self._update(topic.decode('utf-8'), None if flags == _TOMBSTONE else offset, size)
+            offset += size
+
+    def _read_record(self, offset):
+        """
+        Read a log record
+        :return: (flags, topic, payload, record size) tuple, topic and payload as bytes, or None if the record is invalid
+        """
+        data_map = self._mapped(offset)
+        if offset + _RECORD.size > len(data_map):
+            return None
+        crc, flags, topic_length, data_length = _RECORD.unpack_from(data_map, offset)
+        start = offset + _RECORD.size
+        end = start + topic_length + data_length
+        if end > len(data_map) or zlib.crc32(data_map[offset + 4:end]) != crc:
+            return None
+        return flags, data_map[start:start + topic_length], data_map[start + topic_length:end], end - offset
+
+    def _read_topic(self, offset):
+        data_map = self._mapped(offset)
+        topic_length = _TOPIC_LENGTH.unpack_from(data_map, offset + 5)[0]
+        start = offset + _RECORD.size
+        return data_map[start:start + topic_length]
+
+    def _record_size(self, offset):
+        topic_length, data_length = struct.unpack_from('!HI', self._mapped(offset), offset + 5)
+        return _RECORD.size + topic_length + data_length
+
+    def _index_offset(self, position):
+        return _OFFSET.unpack_from(self._index, _INDEX_HEADER.size + position * _OFFSET.size)[0]
+
+    def _bisect(self, key):
+        """
+        Position of the first indexed topic greater than or equal to a key
+        """
+        # Indexed records are always mapped: the index only covers records written before the log was mapped
+        index, data_map = self._index, self._map
+        unpack_offset, unpack_length = _OFFSET.unpack_from, _TOPIC_LENGTH.unpack_from
+        low, high = 0, self._index_count
+        while low < high:
+            middle = (low + high) // 2
+            offset = unpack_offset(index, _INDEX_HEADER.size + middle * _OFFSET.size)[0]
+            start = offset + _RECORD.size
+            if data_map[start:start + unpack_length(data_map, offset + 5)[0]] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _index_find(self, topic):
+        key = topic.encode('utf-8')
+        position = self._bisect(key)
+        if position < self._index_count:
+            offset = self._index_offset(position)
+            if self._read_topic(offset) == key:
+                return offset
+        return None
+
+    def _locate(self, topic):
+        """
+        Offset of the live record of a topic, or None
+        """
+        try:
+            return self._recent[topic]
+        except KeyError:
+            return self._index_find(topic)
+
+    def _update(self, topic, offset, size):
+        previous = self._locate(topic)
+        if previous is not None:
+            self._garbage += self._record_size(previous)
+            self._count -= 1
+        if offset is None:
+            self._garbage += size
+        else:
+            self._count += 1
+        self._recent[topic] = offset
+
+    def _append(self, record):
+        offset = self._size
+        self._file.write(record)
+        self._file.flush()
+        self._size += len(record)
+        return offset
+
+    def _mapped(self, offset):
+        """
+        Get the log map, mapped again if the record at an offset was appended since the log was mapped.
+        Records are appended whole, so a mapped offset is followed by its whole record.
+        """
+        if offset >= len(self._map) and self._size > len(self._map):
+            self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _get(self, topic, offset):
+        message = self._cache.get(topic)
+        if message is not None:
+            self._cache.move_to_end(topic)
+            return message
+        flags, _, data, _ = self._read_record(offset)
+        message = RetainedApplicationMessage(None, topic, data, None if flags == _NO_QOS else flags)
+        self._cache_message(topic, message)
+        return message
+
+    def _cache_message(self, topic, message):
+        if self.cache_size <= 0:
+            return
+        self._cache[topic] = message
+        self._cache.move_to_end(topic)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def __getitem__(self, topic):
+        offset = self._locate(topic)
+        if offset is None:
+            raise KeyError(topic)
+        return self._get(topic, offset)
+
+    def __setitem__(self, topic, message):
+        data = bytes(message.data)
+        record = _encode_record(topic.encode('utf-8'), data, _NO_QOS if message.qos is None else message.qos)
+        self._update(topic, self._append(record), len(record))
+        self._cache_message(topic, message)
+
+    def __delitem__(self, topic):
+        if self._locate(topic) is None:
+            raise KeyError(topic)
+        record = _encode_record(topic.encode('utf-8'), b'', _TOMBSTONE)
+        self._append(record)
+        self._update(topic, None, len(record))
+        self._cache.pop(topic, None)
+
+    def __iter__(self):
+        for _, topic, _ in self._iter_records():
+            yield topic
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, topic):
+        return self._locate(topic) is not None
+
+    def __repr__(self):
+        return type(self).__name__ + '(%r)' % self.path
+
+    def _iter_index(self, start=0):
+        """
+        Iterate over (topic, offset) pairs of the index from a position, skipping the topics changed since
+        """
+        recent = self._recent
+        for position in range(start, self._index_count):
+            offset = self._index_offset(position)
+            topic_bytes = self._read_topic(offset)
+            topic = topic_bytes.decode('utf-8')
+            if topic not in recent:
+                yield topic_bytes, topic, offset
+
+    def _iter_records(self):
+        """
+        Iterate over (topic as bytes, topic, offset) tuples of the live records, sorted by topic
+        """
+        recent = sorted((topic.encode('utf-8'), topic, offset)
+                        for topic, offset in self._recent.items() if offset is not None)
+        return heapq.merge(self._iter_index(), recent)
+
+    def iter_filter(self, a_filter):
+        """
+        Iterate over ``(topic, message)`` pairs whose topic name is matched by a topic filter.
+        Topics starting with ``$`` are not matched by filters starting with a wildcard [MQTT-4.7.2-1].
+        :param a_filter: topic filter, with or without wildcards
+        :return: generator of (topic, message) tuples
+        """
+        for topic, offset in self._recent.iter_filter(a_filter):
+            if offset is not None:
+                yield topic, self._get(topic, offset)
+        levels = a_filter.split(TOPIC_LEVEL_SEPARATOR)
+        wildcards = [i for i, level in enumerate(levels) if level in (MULTI_LEVEL_WILDCARD, SINGLE_LEVEL_WILDCARD)]
+        if not wildcards:
+            if a_filter not in self._recent:
+                offset = self._index_find(a_filter)
+                if offset is not None:
+                    yield a_filter, self._get(a_filter, offset)
+            return
+        # Indexed topics are sorted: only the ones starting with the levels before the first wildcard are matched
+        first = wildcards[0]
+        prefix = TOPIC_LEVEL_SEPARATOR.join(levels[:first])
+        if first and levels[first] == SINGLE_LEVEL_WILDCARD:
+            prefix += TOPIC_LEVEL_SEPARATOR
+        key = prefix.encode('utf-8')
+        for topic_bytes, topic, offset in self._iter_index(self._bisect(key)):
+            if not topic_bytes.startswith(key):
+                break
+            if _topic_matches(topic, levels):
+                yield topic, self._get(topic, offset)
+
+    def filter(self, a_filter):
+        """
+        Get the messages of all the topics matched by a topic filter
+        :param a_filter: topic filter
+        :return: list of messages
+        """
+        return [message for _, message in self.iter_filter(a_filter)]
+
+    def _reopen(self):
+        if self._index is not None:
+            self._index.close()
+        self._map.close()
+        self._file.close()
+        self._open()
+
+    def start_maintenance(self, compact=None):
+        """
+        Take a snapshot of the store for a checkpoint or a compaction, run by :meth:`Maintenance.run`, possibly in
+        another thread while the store is used, then applied by :meth:`finish_maintenance`.
+        :param compact: True to compact the log, False to write the index, None to compact the log when dead records
+        exceed ``compact_ratio`` of its size, or write the index when more than ``checkpoint_size`` topics changed
+        since it was written
+        :return: :class:`Maintenance` or None if not needed
+        """
+        if compact is None:
+            if self._garbage > self.compact_ratio * self._size:
+                logger.debug("Compacting retained store '%s' (%d dead bytes)" % (self.path, self._garbage))
+                compact = True
+            elif len(self._recent) >= self.checkpoint_size:
+                compact = False
+            else:
+                return None
+        self._file.flush()
+        return Maintenance(self, compact)
+
+    def finish_maintenance(self, maintenance):
+        """
+        Replace the index, and the log when compacted, by the ones written by a maintenance. Records appended since
+        its snapshot are copied at the end of the compacted log.
+        """
+        if self._file is None or maintenance.generation != self._generation:
+            maintenance.discard()
+            return
+        if maintenance.compact:
+            with open(maintenance.log_path, 'ab') as f:
+                if self._size > maintenance.covered:
+                    f.write(self._mapped(self._size - 1)[maintenance.covered:self._size])
+                    f.flush()
+                    os.fsync(f.fileno())
+            # A crash between both renames leaves an index of another generation, ignored when opening the log
+            os.replace(maintenance.log_path, self.path)
+        os.replace(maintenance.index_path, self.index_path)
+        self._reopen()
+
+    def _maintain(self, compact=None):
+        maintenance = self.start_maintenance(compact)
+        if maintenance is not None:
+            try:
+                maintenance.run()
+            except OSError:
+                maintenance.discard()
+                raise
+            self.finish_maintenance(maintenance)
+
+    def checkpoint(self):
+        """
+        Write the index of the current log, so that opening the store does not replay the records appended until now
+        """
+        self._maintain(False)
+
+    def compact(self):
+        """
+        Rewrite the log with the live records only, and its index
+        """
+        self._maintain(True)
+
+    def maintain(self):
+        """
+        Compact the log when dead records exceed ``compact_ratio`` of its size, otherwise write the index when more
+        than ``checkpoint_size`` topics changed since it was written
+        """
+        self._maintain()
+
+    def sync(self):
+        """
+        Flush the log to disk
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._garbage > self.compact_ratio * self._size:
+            self.compact()
+        elif len(self._recent):
+            self.checkpoint()
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        self._map.close()
+        self._file.close()
+        self._file = None
+        self._cache.clear()
+
+
+class Maintenance:
+    """
+    Checkpoint or compaction of a :class:`RetainedStore`, working on a snapshot of the store: the log records are
+    read from a mapping of its own, so that :meth:`run` can be called in another thread while the store is used.
+    """
+
+    def __init__(self, store, compact):
+        self.compact = compact
+        self.store_path = store.path
+        self.store_index_path = store.index_path
+        self.log_path = store.path + '.tmp'
+        self.index_path = store.index_path + '.tmp'
+        self.generation = store._generation
+        self.covered = store._size
+        self.garbage = store._garbage
+        self.index_count = store._index_count
+        # Topics changed since the index was written, and their live records sorted by topic
+        self.changed = set()
+        self.recent = []
+        for topic, offset in store._recent.items():
+            topic = topic.encode('utf-8')
+            self.changed.add(topic)
+            if offset is not None:
+                self.recent.append((topic, offset))
+        self.recent.sort()
+
+    def _iter_records(self, log_map, index):
+        """
+        Iterate over (topic, offset) pairs of the live records, sorted by topic
+        """
+        changed = self.changed
+        unpack_offset, unpack_length = _OFFSET.unpack_from, _TOPIC_LENGTH.unpack_from
+
+        def indexed():
+            for position in range(self.index_count):
+                offset = unpack_offset(index, _INDEX_HEADER.size + position * _OFFSET.size)[0]
+                start = offset + _RECORD.size
+                topic = log_map[start:start + unpack_length(log_map, offset + 5)[0]]
+                if topic not in changed:
+                    yield topic, offset
+        return heapq.merge(indexed(), self.recent)
+
+    def run(self):
+        """
+        Write the new index, and the compacted log, in temporary files
+        """
+        with open(self.store_path, 'rb') as f:
+            log_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if not self.compact:
+                # The index covers records synced to disk only
+                os.fsync(f.fileno())
+        index = None
+        try:
+            if self.index_count:
+                with open(self.store_index_path, 'rb') as f:
+                    index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.compact:
+                offsets = []
+                with open(self.log_path, 'wb') as f:
+                    f.write(_LOG_HEADER.pack(LOG_FORMAT, self.generation + 1))
+                    position = _LOG_HEADER.size
+                    for _, offset in self._iter_records(log_map, index):
+                        size = _RECORD.size + sum(struct.unpack_from('!HI', log_map, offset + 5))
+                        f.write(log_map[offset:offset + size])
+                        offsets.append(position)
+                        position += size
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._write_index(self.generation + 1, position, 0, offsets)
+            else:
+                self._write_index(self.generation, self.covered, self.garbage,
+                                  [offset for _, offset in self._iter_records(log_map, index)])
+        finally:
+            if index is not None:
+                index.close()
+            log_map.close()
+
+    def _write_index(self, generation, covered, garbage, offsets):
+        with open(self.index_path, 'wb') as f:
+            f.write(_INDEX_HEADER.pack(INDEX_FORMAT, generation, covered, garbage, len(offsets)))
+            for offset in offsets:
+                f.write(_OFFSET.pack(offset))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def discard(self):
+        """
+        Remove the files written by :meth:`run`
+        """
+        for path in (self.log_path, self.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -2,10 +2,9 @@
 #
 # See the file license.txt for copying permission.
 import asyncio
-from transitions import Machine
 from asyncio import Queue
 from collections import OrderedDict
-from hbmqtt.mqtt.publish import PublishPacket
+from hbmqtt.mqtt.publish import PublishPacket, PublishFrame
 from hbmqtt.errors import HBMQTTException
 
 OUTGOING = 0
@@ -93,11 +92,102 @@ class OutgoingApplicationMessage(ApplicationMessage):
         self.direction = OUTGOING
 
 
+class RetainedApplicationMessage:
+    """
+    Message retained by the broker for a topic, or queued for an offline session.
+    The PUBLISH encoding is built on first delivery and shared by all deliveries and queues of the message.
+    """
+
+    __slots__ = ('source_session', 'topic', 'data', 'qos', '_frame')
+
+    def __init__(self, source_session, topic, data, qos=None, frame=None):
+        self.source_session = source_session
+        self.topic = topic
+        self.data = data
+        self.qos = qos
+        self._frame = frame
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            self._frame = PublishFrame(self.topic, self.data)
+            self.data = self._frame.data
+        return self._frame
+
+
+STATE_NEW = 'new'
+STATE_CONNECTED = 'connected'
+STATE_DISCONNECTED = 'disconnected'
+
+# Valid session state transitions: (trigger, source state) -> destination state
+_SESSION_TRANSITIONS = {
+    ('connect', STATE_NEW): STATE_CONNECTED,
+    ('connect', STATE_DISCONNECTED): STATE_CONNECTED,
+    ('disconnect', STATE_CONNECTED): STATE_DISCONNECTED,
+    ('disconnect', STATE_NEW): STATE_DISCONNECTED,
+    ('disconnect', STATE_DISCONNECTED): STATE_DISCONNECTED,
+}
+
+
+class SessionTransitions:
+    """
+    State machine of a session, with the interface of the ``transitions`` machine previously used:
+    ``connect()`` and ``disconnect()`` triggers, ``state`` and ``is_<state>()`` checks. Invalid transitions raise
+    ``ValueError``. The state itself is stored in the session.
+    """
+
+    __slots__ = ('_session',)
+
+    def __init__(self, session):
+        self._session = session
+
+    @property
+    def state(self):
+        return self._session._state
+
+    def _trigger(self, trigger):
+        session = self._session
+        try:
+            session._state = _SESSION_TRANSITIONS[(trigger, session._state)]
+        except KeyError:
+            raise ValueError("Can't trigger event %s from state %s!" % (trigger, session._state))
+        return True
+
+    def connect(self):
+        return self._trigger('connect')
+
+    def disconnect(self):
+        return self._trigger('disconnect')
+
+    def is_new(self):
+        return self._session._state == STATE_NEW
+
+    def is_connected(self):
+        return self._session._state == STATE_CONNECTED
+
+    def is_disconnected(self):
+        return self._session._state == STATE_DISCONNECTED
+
+
 class Session:
-    states = ['new', 'connected', 'disconnected']
+    """
+    MQTT session state, kept by the broker for each client id and by the client for its connection.
+
+    Sessions use ``__slots__`` so that idle sessions stay small: message queues, messages in flight and the topic
+    filtering cache are only created when first used. Plugins may still set their own attributes on sessions.
+    """
+    states = [STATE_NEW, STATE_CONNECTED, STATE_DISCONNECTED]
+
+    __slots__ = (
+        '_state', 'remote_address', 'remote_port', 'client_id', 'clean_session', 'will_flag', 'will_message',
+        'will_qos', 'will_retain', 'will_topic', 'keep_alive', 'publish_retry_delay', 'broker_uri', 'username',
+        'password', 'cafile', 'capath', 'cadata', '_packet_id', 'parent', '_loop', '_inflight_out', '_inflight_in',
+        '_retained_messages', '_delivered_message_queue', '_topic_filtering_cache', '_transitions', '__dict__',
+        '__weakref__',
+    )
 
     def __init__(self, loop=None):
-        self._init_states()
+        self._state = STATE_NEW
         self.remote_address = None
         self.remote_port = None
         self.client_id = None
@@ -121,33 +211,87 @@ class Session:
             self._loop = loop
         else:
             self._loop = asyncio.get_event_loop()
+        self._inflight_out = None
+        self._inflight_in = None
+        self._retained_messages = None
+        self._delivered_message_queue = None
+        self._topic_filtering_cache = None
+        # Read for each subscriber of each broadcast message: created once
+        self._transitions = SessionTransitions(self)
+
+    @property
+    def transitions(self):
+        return self._transitions
+
+    @property
+    def inflight_out(self):
+        """
+        Outgoing ApplicationMessage stored while publish protocol flows, by packet id
+        """
+        if self._inflight_out is None:
+            self._inflight_out = OrderedDict()
+        return self._inflight_out
+
+    @inflight_out.setter
+    def inflight_out(self, value):
+        self._inflight_out = value
+
+    @property
+    def inflight_in(self):
+        """
+        Incoming ApplicationMessage stored while publish protocol flows, by packet id
+        """
+        if self._inflight_in is None:
+            self._inflight_in = OrderedDict()
+        return self._inflight_in
 
-        # Used to store outgoing ApplicationMessage while publish protocol flows
-        self.inflight_out = OrderedDict()
+    @inflight_in.setter
+    def inflight_in(self, value):
+        self._inflight_in = value
 
-        # Used to store incoming ApplicationMessage while publish protocol flows
-        self.inflight_in = OrderedDict()
+    @property
+    def retained_messages(self):
+        """
+        Messages retained for this session while it is disconnected
+        """
+        if self._retained_messages is None:
+            self._retained_messages = Queue(loop=self._loop)
+        return self._retained_messages
 
-        # Stores messages retained for this session
-        self.retained_messages = Queue(loop=self._loop)
+    @retained_messages.setter
+    def retained_messages(self, value):
+        self._retained_messages = value
 
-        # Stores PUBLISH messages ID received in order and ready for application process
-        self.delivered_message_queue = Queue(loop=self._loop)
+    @property
+    def delivered_message_queue(self):
+        """
+        PUBLISH messages received in order and ready for application process
+        """
+        if self._delivered_message_queue is None:
+            self._delivered_message_queue = Queue(loop=self._loop)
+        return self._delivered_message_queue
 
-    def _init_states(self):
-        self.transitions = Machine(states=Session.states, initial='new')
-        self.transitions.add_transition(trigger='connect', source='new', dest='connected')
-        self.transitions.add_transition(trigger='connect', source='disconnected', dest='connected')
-        self.transitions.add_transition(trigger='disconnect', source='connected', dest='disconnected')
-        self.transitions.add_transition(trigger='disconnect', source='new', dest='disconnected')
-        self.transitions.add_transition(trigger='disconnect', source='disconnected', dest='disconnected')
+    @property
+    def topic_filtering_cache(self):
+        """
+        Topic filtering decisions made by the broker for this session, indexed by topic
+        """
+        if self._topic_filtering_cache is None:
+            self._topic_filtering_cache = dict()
+        return self._topic_filtering_cache
+
+    def clear_topic_filtering_cache(self):
+        """
+        Forget topic filtering decisions made for this session
+        """
+        self._topic_filtering_cache = None
 
     @property
     def next_packet_id(self):
         self._packet_id += 1
         if self._packet_id > 65535:
             self._packet_id = 1
-        while self._packet_id in self.inflight_in or self._packet_id in self.inflight_out:
+        while self._packet_id in (self._inflight_in or ()) or self._packet_id in (self._inflight_out or ()):
             self._packet_id += 1
             if self._packet_id > 65535:
                 raise HBMQTTException("More than 65525 messages pending. No free packet ID")
@@ -156,31 +300,48 @@ class Session:
 
     @property
     def inflight_in_count(self):
-        return len(self.inflight_in)
+        return len(self._inflight_in) if self._inflight_in is not None else 0
 
     @property
     def inflight_out_count(self):
-        return len(self.inflight_out)
+        return len(self._inflight_out) if self._inflight_out is not None else 0
 
     @property
     def retained_messages_count(self):
-        return self.retained_messages.qsize()
+        return self._retained_messages.qsize() if self._retained_messages is not None else 0
+
+    def retained_messages_snapshot(self):
+        """
+        Get the messages retained for this session, without removing them from the queue
+        :return: tuple of messages, in queue order
+        """
+        messages = []
+        if self._retained_messages is not None:
+            queue = self._retained_messages
+            for i in range(queue.qsize()):
+                message = queue.get_nowait()
+                messages.append(message)
+                queue.put_nowait(message)
+        return tuple(messages)
 
     def __repr__(self):
-        return type(self).__name__ + '(clientId={0}, state={1})'.format(self.client_id, self.transitions.state)
+        return type(self).__name__ + '(clientId={0}, state={1})'.format(self.client_id, self._state)
 
     def __getstate__(self):
-        state = self.__dict__.copy()
-        # Remove the unpicklable entries.
-        # del state['transitions']
-        del state['retained_messages']
-        del state['delivered_message_queue']
+        # Queues and the event loop are not picklable: queues are created again when used
+        state = {name: getattr(self, name) for name in self.__slots__
+                 if name not in ('_loop', '_retained_messages', '_delivered_message_queue', '_transitions', '__dict__',
+                                 '__weakref__')}
+        state.update(self.__dict__)
         return state
 
-    def __setstate(self, state):
-        self.__dict__.update(state)
-        self.retained_messages = Queue()
-        self.delivered_message_queue = Queue()
+    def __setstate__(self, state):
+        self._loop = asyncio.get_event_loop()
+        self._retained_messages = None
+        self._delivered_message_queue = None
+        self._transitions = SessionTransitions(self)
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def __eq__(self, other):
         return self.client_id == other.client_id
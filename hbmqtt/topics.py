@@ -0,0 +1,180 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+from collections.abc import MutableMapping
+
+
+MULTI_LEVEL_WILDCARD = '#'
+SINGLE_LEVEL_WILDCARD = '+'
+TOPIC_LEVEL_SEPARATOR = '/'
+
+
+class _TopicNode:
+
+    __slots__ = ('children', 'key')
+
+    def __init__(self):
+        self.children = dict()
+        self.key = None
+
+
+class TopicTree(MutableMapping):
+    """
+    Mapping of topic filters to values, indexed level by level so that looking up the filters matching a topic
+    only walks the levels of this topic instead of every stored filter.
+
+    Keys are MQTT topic filters (``+`` and ``#`` wildcards allowed), values are arbitrary objects. Iterating a
+    ``TopicTree`` yields its filters, like a dict.
+    """
+
+    __slots__ = ('_root', '_values')
+
+    def __init__(self, *args, **kwargs):
+        self._root = _TopicNode()
+        self._values = dict()
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, a_filter):
+        return self._values[a_filter]
+
+    def __setitem__(self, a_filter, value):
+        if a_filter not in self._values:
+            node = self._root
+            for level in a_filter.split(TOPIC_LEVEL_SEPARATOR):
+                child = node.children.get(level)
+                if child is None:
+                    child = node.children[level] = _TopicNode()
+                node = child
+            node.key = a_filter
+        self._values[a_filter] = value
+
+    def __delitem__(self, a_filter):
+        del self._values[a_filter]
+        path = []
+        node = self._root
+        for level in a_filter.split(TOPIC_LEVEL_SEPARATOR):
+            path.append((node, level))
+            node = node.children[level]
+        node.key = None
+        # Prune branches left without any filter
+        for parent, level in reversed(path):
+            child = parent.children[level]
+            if child.key is not None or child.children:
+                break
+            del parent.children[level]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, a_filter):
+        return a_filter in self._values
+
+    def __repr__(self):
+        return type(self).__name__ + '(%r)' % self._values
+
+    def iter_match(self, topic):
+        """
+        Iterate over ``(filter, value)`` pairs whose filter matches a topic name, according to MQTT 3.1.1
+        paragraph 4.7 (topic names and topic filters).
+        Filters starting with a wildcard don't match topics starting with ``$`` [MQTT-4.7.2-1].
+        :param topic: topic name (without wildcard)
+        :return: generator of (filter, value) tuples
+        """
+        values = self._values
+        nodes = (self._root,)
+        dollar = topic.startswith('$')
+        for level in topic.split(TOPIC_LEVEL_SEPARATOR):
+            next_nodes = []
+            for node in nodes:
+                children = node.children
+                if not children:
+                    continue
+                if not dollar:
+                    child = children.get(MULTI_LEVEL_WILDCARD)
+                    if child is not None and child.key is not None:
+                        yield child.key, values[child.key]
+                    child = children.get(SINGLE_LEVEL_WILDCARD)
+                    if child is not None:
+                        next_nodes.append(child)
+                child = children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+            if not next_nodes:
+                return
+            nodes = next_nodes
+            dollar = False
+        for node in nodes:
+            if node.key is not None:
+                yield node.key, values[node.key]
+            # 'sport/#' also matches 'sport', the parent level
+            child = node.children.get(MULTI_LEVEL_WILDCARD)
+            if child is not None and child.key is not None:
+                yield child.key, values[child.key]
+
+    def match(self, topic):
+        """
+        Get the values of all the filters matching a topic name
+        :param topic: topic name (without wildcard)
+        :return: list of values
+        """
+        return [value for _, value in self.iter_match(topic)]
+
+    def iter_filter(self, a_filter):
+        """
+        Iterate over ``(topic, value)`` pairs whose topic name is matched by a topic filter. This is the reverse
+        lookup of :meth:`iter_match`, used when keys are topic names (for example retained messages).
+        Topics starting with ``$`` are not matched by filters starting with a wildcard [MQTT-4.7.2-1].
+        :param a_filter: topic filter, with or without wildcards
+        :return: generator of (topic, value) tuples
+        """
+        values = self._values
+        nodes = (self._root,)
+        root_level = True
+        for level in a_filter.split(TOPIC_LEVEL_SEPARATOR):
+            if level == MULTI_LEVEL_WILDCARD:
+                for node in nodes:
+                    for key in self._iter_keys(node, skip_dollar=root_level):
+                        yield key, values[key]
+                return
+            next_nodes = []
+            for node in nodes:
+                if level == SINGLE_LEVEL_WILDCARD:
+                    for name, child in node.children.items():
+                        if not (root_level and name.startswith('$')):
+                            next_nodes.append(child)
+                else:
+                    child = node.children.get(level)
+                    if child is not None:
+                        next_nodes.append(child)
+            if not next_nodes:
+                return
+            nodes = next_nodes
+            root_level = False
+        for node in nodes:
+            if node.key is not None:
+                yield node.key, values[node.key]
+
+    def filter(self, a_filter):
+        """
+        Get the values of all the topics matched by a topic filter
+        :param a_filter: topic filter
+        :return: list of values
+        """
+        return [value for _, value in self.iter_filter(a_filter)]
+
+    @staticmethod
+    def _iter_keys(node, skip_dollar=False):
+        """
+        Iterate over the keys stored in a node and all its descendants
+        """
+        if node.key is not None:
+            yield node.key
+        stack = [child for name, child in node.children.items() if not (skip_dollar and name.startswith('$'))]
+        while stack:
+            node = stack.pop()
+            if node.key is not None:
+                yield node.key
+            stack.extend(node.children.values())
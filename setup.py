@@ -41,9 +41,12 @@ setup(
             'auth_anonymous = hbmqtt.plugins.authentication:AnonymousAuthPlugin',
             'auth_ecdsa = hbmqtt.plugins.authentication:EcdsaAuthPlugin',
             'auth_file = hbmqtt.plugins.authentication:FileAuthPlugin',
+            'auth_token = hbmqtt.plugins.authentication:TokenAuthPlugin',
             'topic_taboo = hbmqtt.plugins.topic_checking:TopicTabooPlugin',
             'topic_ecdsa = hbmqtt.plugins.topic_checking:EcdsaTopicPlugin',
             'topic_acl = hbmqtt.plugins.topic_checking:TopicAccessControlListPlugin',
+            'topic_token = hbmqtt.plugins.topic_checking:TokenTopicPlugin',
+            'persistence_sqlite = hbmqtt.plugins.persistence:SQLitePlugin',
             'broker_sys = hbmqtt.plugins.sys.broker:BrokerSysPlugin',
             'broker_bc = hbmqtt.plugins.sys.broker:BrokerBlockchainPlugin',
             'bc_api = hbmqtt.plugins.sys.broker:BlockchainApiPlugin',
@@ -8,7 +8,7 @@ import random
 from hbmqtt.plugins.manager import PluginManager
 from hbmqtt.session import Session, OutgoingApplicationMessage, IncomingApplicationMessage
 from hbmqtt.mqtt.protocol.handler import ProtocolHandler
-from hbmqtt.adapters import StreamWriterAdapter, StreamReaderAdapter
+from hbmqtt.adapters import StreamWriterAdapter, StreamReaderAdapter, BufferReader, BufferWriter
 from hbmqtt.mqtt.constants import QOS_0, QOS_1, QOS_2
 from hbmqtt.mqtt.publish import PublishPacket
 from hbmqtt.mqtt.puback import PubackPacket
@@ -29,6 +29,20 @@ def adapt(reader, writer):
     return StreamReaderAdapter(reader), StreamWriterAdapter(writer)
 
 
+class CountingWriter(BufferWriter):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        super().write(data)
+
+    def writelines(self, buffers):
+        self.buffers = buffers
+        super().writelines(buffers)
+
+
 class ProtocolHandlerTest(unittest.TestCase):
     def setUp(self):
         self.loop = asyncio.new_event_loop()
@@ -73,6 +87,63 @@ class ProtocolHandlerTest(unittest.TestCase):
         if future.exception():
             raise future.exception()
 
+    def test_send_packets_coalesced(self):
+        @asyncio.coroutine
+        def test_coro():
+            yield from asyncio.gather(*[handler._send_packet(packet) for packet in packets], loop=self.loop)
+            yield from asyncio.sleep(0, loop=self.loop)
+
+        handler = ProtocolHandler(self.plugin_manager, loop=self.loop)
+        writer = CountingWriter()
+        handler.attach(Session(), BufferReader(b''), writer)
+        packets = [PubackPacket.build(packet_id) for packet_id in range(1, 11)]
+        self.loop.run_until_complete(test_coro())
+        self.assertEqual(writer.writes, 1)
+        self.assertEqual(writer.get_buffer(), b''.join(packet.to_bytes() for packet in packets))
+        for packet in packets:
+            self.assertIsNotNone(packet.protocol_ts)
+
+    def test_send_large_payload_by_reference(self):
+        @asyncio.coroutine
+        def test_coro():
+            yield from handler._send_packet(PubackPacket.build(1))
+            yield from handler._send_packet(publish)
+            yield from asyncio.sleep(0, loop=self.loop)
+
+        handler = ProtocolHandler(self.plugin_manager, loop=self.loop)
+        writer = CountingWriter()
+        handler.attach(Session(), BufferReader(b''), writer)
+        data = b'x' * 100000
+        publish = PublishPacket.build('/topic', data, 2, False, QOS_1, False)
+        self.loop.run_until_complete(test_coro())
+        self.assertEqual(len(writer.buffers), 2)
+        self.assertIs(writer.buffers[1], data)
+        self.assertEqual(writer.get_buffer(), PubackPacket.build(1).to_bytes() + publish.to_bytes())
+
+    def test_deferred_write_error(self):
+        class BrokenWriter(BufferWriter):
+            def writelines(self, buffers):
+                raise BrokenPipeError()
+
+        closed = []
+
+        @asyncio.coroutine
+        def connection_closed():
+            closed.append(True)
+
+        @asyncio.coroutine
+        def test_coro():
+            yield from handler._send_packet(PubackPacket.build(1))
+            yield from asyncio.sleep(0, loop=self.loop)
+            self.assertFalse(closed)
+            yield from handler._send_packet(PubackPacket.build(2))
+
+        handler = ProtocolHandler(self.plugin_manager, loop=self.loop)
+        handler.attach(Session(), BufferReader(b''), BrokenWriter())
+        handler.handle_connection_closed = connection_closed
+        self.loop.run_until_complete(test_coro())
+        self.assertEqual(closed, [True])
+
     def test_publish_qos0(self):
         @asyncio.coroutine
         def server_mock(reader, writer):
@@ -0,0 +1,82 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+import unittest
+
+from hbmqtt.mqtt.codec import PacketDecoder
+from hbmqtt.mqtt.publish import PublishPacket
+from hbmqtt.mqtt.pingreq import PingReqPacket
+from hbmqtt.mqtt.subscribe import SubscribePacket
+from hbmqtt.mqtt.constants import QOS_0, QOS_1
+from hbmqtt.errors import MQTTException
+
+
+class PacketDecoderTest(unittest.TestCase):
+    def setUp(self):
+        packets = [PublishPacket.build('a/b', b'x' * i, i + 1, False, QOS_1, False) for i in range(200)]
+        packets.append(SubscribePacket.build([('a/#', QOS_0)], 1))
+        packets.append(PingReqPacket())
+        self.data = b''.join(packet.to_bytes() for packet in packets)
+
+    def check(self, packets):
+        self.assertEqual(len(packets), 202)
+        for i, packet in enumerate(packets[:200]):
+            self.assertIsInstance(packet, PublishPacket)
+            self.assertEqual(packet.topic_name, 'a/b')
+            self.assertEqual(packet.packet_id, i + 1)
+            self.assertEqual(packet.data, b'x' * i)
+        self.assertEqual(packets[200].payload.topics, [('a/#', QOS_0)])
+        self.assertIsInstance(packets[201], PingReqPacket)
+
+    def test_feed_pipelined(self):
+        decoder = PacketDecoder()
+        self.check(decoder.feed(self.data))
+        self.assertEqual(len(decoder), 0)
+
+    def test_feed_chunks(self):
+        for chunk_size in (1, 3, 100, 4096):
+            decoder = PacketDecoder(256)
+            packets = []
+            for i in range(0, len(self.data), chunk_size):
+                packets.extend(decoder.feed(self.data[i:i + chunk_size]))
+            self.check(packets)
+            self.assertEqual(len(decoder), 0)
+
+    def test_partial_tail(self):
+        decoder = PacketDecoder()
+        packet = PublishPacket.build('a/b', b'data', None, False, QOS_0, False).to_bytes()
+        packets = decoder.feed(packet + packet[:3])
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(len(decoder), 3)
+        packets = decoder.feed(packet[3:])
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(packets[0].data, b'data')
+
+    def test_buffer_updated(self):
+        decoder = PacketDecoder(16)
+        packets = []
+        offset = 0
+        while offset < len(self.data):
+            buffer = decoder.get_buffer(-1)
+            nbytes = min(len(buffer), len(self.data) - offset)
+            buffer[:nbytes] = self.data[offset:offset + nbytes]
+            offset += nbytes
+            packets.extend(decoder.buffer_updated(nbytes))
+        self.check(packets)
+
+    def test_payload_outlives_buffer(self):
+        decoder = PacketDecoder(64)
+        first = decoder.feed(PublishPacket.build('a/b', b'first', None, False, QOS_0, False).to_bytes())[0]
+        decoder.feed(PublishPacket.build('a/b', b'other', None, False, QOS_0, False).to_bytes())
+        self.assertIsInstance(first.data, bytes)
+        self.assertEqual(first.data, b'first')
+
+    def test_reserved_packet_type(self):
+        decoder = PacketDecoder()
+        with self.assertRaises(MQTTException):
+            decoder.feed(b'\xf0\x00')
+
+    def test_invalid_remaining_length(self):
+        decoder = PacketDecoder()
+        with self.assertRaises(MQTTException):
+            decoder.feed(b'\x30\xff\xff\xff\xff\x7f')
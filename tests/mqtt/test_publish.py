@@ -4,7 +4,8 @@
 import asyncio
 import unittest
 
-from hbmqtt.mqtt.publish import PublishPacket, PublishVariableHeader, PublishPayload
+from hbmqtt.mqtt.publish import PublishPacket, PublishVariableHeader, PublishPayload, PublishFrame
+from hbmqtt.mqtt.packet import MQTTFixedHeader, PUBLISH
 from hbmqtt.adapters import BufferReader
 from hbmqtt.mqtt.constants import QOS_0, QOS_1, QOS_2
 
@@ -119,3 +120,101 @@ class PublishPacketTest(unittest.TestCase):
         self.assertTrue(packet.dup_flag)
         self.assertEqual(packet.qos, QOS_2)
         self.assertTrue(packet.retain_flag)
+
+
+class CountingReader(BufferReader):
+    def __init__(self, buffer: bytes):
+        super().__init__(buffer)
+        self.reads = 0
+
+    @asyncio.coroutine
+    def read(self, n=-1):
+        self.reads += 1
+        return (yield from super().read(n))
+
+
+class PublishDecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def test_from_stream_whole_packet(self):
+        stream = CountingReader(b'\x33\x13\x00\x05topic\x00\x0a0123456789')
+        message = self.loop.run_until_complete(PublishPacket.from_stream(stream))
+        self.assertEqual(stream.reads, 2)
+        self.assertEqual(message.topic_name, 'topic')
+        self.assertEqual(message.packet_id, 10)
+        self.assertEqual(message.qos, QOS_1)
+        self.assertTrue(message.retain_flag)
+        self.assertEqual(message.data, b'0123456789')
+
+    def test_from_bytes(self):
+        fixed = MQTTFixedHeader(PUBLISH, 0x00, 0x11)
+        message = PublishPacket.from_bytes(fixed, b'\x00\x05topic0123456789')
+        self.assertEqual(message.topic_name, 'topic')
+        self.assertIsNone(message.packet_id)
+        self.assertEqual(message.data, b'0123456789')
+        self.assertEqual(message.to_bytes(), b'\x30\x11\x00\x05topic0123456789')
+
+    def test_from_bytes_immutable_payload(self):
+        fixed = MQTTFixedHeader(PUBLISH, 0x00, 0x11)
+        buffer = bytearray(b'\x00\x05topic0123456789')
+        message = PublishPacket.from_bytes(fixed, memoryview(buffer))
+        buffer[7:] = b'x' * 10
+        self.assertIsInstance(message.data, bytes)
+        self.assertEqual(message.data, b'0123456789')
+
+    def test_variable_header_bytes_length(self):
+        self.assertEqual(PublishVariableHeader('topic', None).bytes_length, 7)
+        self.assertEqual(PublishVariableHeader('topic', 10).bytes_length, 9)
+
+
+class PublishFrameTest(unittest.TestCase):
+    def test_to_bytes(self):
+        frame = PublishFrame('/topic', b'data')
+        for qos in (QOS_0, QOS_1, QOS_2):
+            for dup in (False, True):
+                for retain in (False, True):
+                    packet_id = None if qos == QOS_0 else 0x1234
+                    expected = PublishPacket.build('/topic', b'data', packet_id, dup, qos, retain).to_bytes()
+                    self.assertEqual(frame.to_bytes(qos, packet_id, dup, retain), expected)
+                    self.assertEqual(frame.bytes_length(qos), len(expected))
+
+    def test_to_buffers(self):
+        data = b'data' * 1000
+        frame = PublishFrame('/topic', data)
+        header, payload = frame.to_buffers(QOS_0)
+        self.assertIs(payload, data)
+        self.assertIs(frame.to_buffers(QOS_0)[0], header)
+        header, payload = frame.to_buffers(QOS_1, 1, False, True)
+        self.assertIs(payload, data)
+        self.assertEqual(header + payload, PublishPacket.build('/topic', data, 1, False, QOS_1, True).to_bytes())
+
+    def test_packet_to_buffers(self):
+        data = bytearray(b'data' * 1000)
+        packet = PublishPacket.build('/topic', data, 1, False, QOS_1, False)
+        header, payload = packet.to_buffers()
+        self.assertIs(payload, data)
+        self.assertEqual(header + payload, packet.to_bytes())
+
+    def test_mutable_data(self):
+        data = bytearray(b'data')
+        frame = PublishFrame('/topic', data)
+        data[:] = b'xxxx'
+        self.assertIsInstance(frame.data, bytes)
+        self.assertEqual(frame.to_bytes(QOS_0), b'\x30\x0c\x00\x06/topicdata')
+
+    def test_packet_ids(self):
+        frame = PublishFrame('/topic', b'data')
+        first = frame.to_bytes(QOS_1, 1)
+        second = frame.to_bytes(QOS_1, 2)
+        self.assertEqual(first, b'\x32\x0e\x00\x06/topic\x00\x01data')
+        self.assertEqual(second, b'\x32\x0e\x00\x06/topic\x00\x02data')
+
+    def test_build_from_frame(self):
+        frame = PublishFrame('/topic', b'data')
+        packet = PublishPacket.build_from_frame(frame, 10, False, QOS_2, True)
+        self.assertEqual(packet.packet_id, 10)
+        self.assertEqual(packet.qos, QOS_2)
+        self.assertTrue(packet.retain_flag)
+        self.assertEqual(packet.to_bytes(), PublishPacket.build('/topic', b'data', 10, False, QOS_2, True).to_bytes())
+        self.assertEqual(packet.bytes_length, len(packet.to_bytes()))
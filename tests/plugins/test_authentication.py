@@ -8,9 +8,13 @@ import os
 import asyncio
 import datetime
 import binascii
+import time
 from hbmqtt.plugins.secp256k1 import schnorr, ecdsa
 from hbmqtt.plugins.manager import BaseContext
-from hbmqtt.plugins.authentication import AnonymousAuthPlugin, FileAuthPlugin, EcdsaAuthPlugin
+from hbmqtt.plugins import authentication
+from hbmqtt.plugins.authentication import (
+    AnonymousAuthPlugin, FileAuthPlugin, EcdsaAuthPlugin, SchnorrBatchVerifier, TokenAuthPlugin, VerificationCache,
+    encode_token)
 from hbmqtt.session import Session
 
 formatter = "[%(asctime)s] %(name)s {%(filename)s:%(lineno)d} %(levelname)s - %(message)s"
@@ -114,6 +118,108 @@ class TestFileAuthPlugin(unittest.TestCase):
         self.assertFalse(ret)
 
 
+class TestFileAuthPluginCache(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.context = BaseContext()
+        self.context.logger = logging.getLogger(__name__)
+        self.context.config = {
+            'auth': {
+                'password-file': os.path.join(os.path.dirname(os.path.realpath(__file__)), "passwd"),
+                'password-workers': 2,
+            }
+        }
+        self.checks = []
+        self.verify_password = authentication.verify_password
+
+        def counting_verify_password(password, pwd_hash):
+            self.checks.append(password)
+            return self.verify_password(password, pwd_hash)
+        authentication.verify_password = counting_verify_password
+
+    def tearDown(self):
+        authentication.verify_password = self.verify_password
+        self.loop.close()
+
+    def authenticate(self, auth_plugin, *passwords):
+        @asyncio.coroutine
+        def authenticate():
+            results = []
+            for password in passwords:
+                s = Session()
+                s.username = "user"
+                s.password = password
+                results.append((yield from auth_plugin.authenticate(session=s)))
+            yield from auth_plugin.on_broker_post_shutdown()
+            return results
+        return self.loop.run_until_complete(authenticate())
+
+    def test_cache(self):
+        auth_plugin = FileAuthPlugin(self.context)
+        results = self.authenticate(auth_plugin, "test", "test", "wrong password", "wrong password")
+        self.assertEqual(results, [True, True, False, False])
+        # Only successful checks are cached
+        self.assertEqual(self.checks, ["test", "wrong password", "wrong password"])
+        for username, digest in auth_plugin._cache:
+            self.assertNotIn(b"test", digest)
+
+    def test_cache_invalidated_by_hash(self):
+        auth_plugin = FileAuthPlugin(self.context)
+        self.authenticate(auth_plugin, "test")
+        auth_plugin._users["user"] = authentication.pwd_context.hash("other password")
+        self.assertEqual(self.authenticate(auth_plugin, "test"), [False])
+        self.assertEqual(len(self.checks), 2)
+
+    def test_cache_disabled(self):
+        self.context.config['auth']['password-cache-ttl'] = 0
+        auth_plugin = FileAuthPlugin(self.context)
+        self.assertEqual(self.authenticate(auth_plugin, "test", "test"), [True, True])
+        self.assertEqual(len(self.checks), 2)
+
+
+class TestTokenAuthPlugin(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.context = BaseContext()
+        self.context.logger = logging.getLogger(__name__)
+        self.context.config = {'auth': {'token-secret': 'secret'}}
+        self.auth_plugin = TokenAuthPlugin(self.context)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def authenticate(self, password, client_id='device1'):
+        s = Session()
+        s.client_id = client_id
+        s.password = password
+        return s, self.loop.run_until_complete(self.auth_plugin.authenticate(session=s))
+
+    def test_good_token(self):
+        token = encode_token('secret', 'device1', time.time() + 60, ['devices/device1/', 'public/'])
+        s, ret = self.authenticate(token)
+        self.assertTrue(ret)
+        self.assertEqual(s._token_topics, ('devices/device1/', 'public/'))
+
+    def test_bad_token(self):
+        token = encode_token('other secret', 'device1', time.time() + 60)
+        self.assertFalse(self.authenticate(token)[1])
+        payload, signature = encode_token('secret', 'device1', time.time() + 60).split('.')
+        forged = encode_token('secret', 'device2', time.time() + 60).split('.')[0] + '.' + signature
+        self.assertFalse(self.authenticate(forged, 'device2')[1])
+
+    def test_other_client(self):
+        token = encode_token('secret', 'device1', time.time() + 60)
+        self.assertFalse(self.authenticate(token, 'device2')[1])
+
+    def test_expired(self):
+        token = encode_token('secret', 'device1', time.time() - 1)
+        self.assertFalse(self.authenticate(token)[1])
+
+    def test_not_a_token(self):
+        self.assertIsNone(self.authenticate('password')[1])
+        self.assertIsNone(self.authenticate(None)[1])
+
+
 class TestEcdsaAuthPlugin(unittest.TestCase):
     def setUp(self):
         self.loop = asyncio.new_event_loop()
@@ -125,6 +231,7 @@ class TestEcdsaAuthPlugin(unittest.TestCase):
         context.config = {
             'auth': {
                 'puk-file': os.path.join(os.path.dirname(os.path.realpath(__file__)), "passwd"),
+                'schnorr-batch-workers': 0,
                 'allow-only-registered': False
             }
         }
@@ -149,6 +256,7 @@ class TestEcdsaAuthPlugin(unittest.TestCase):
         context.config = {
             'auth': {
                 'puk-file': os.path.join(os.path.dirname(os.path.realpath(__file__)), "passwd"),
+                'schnorr-batch-workers': 0,
                 'allow-only-registered': False
             }
         }
@@ -173,6 +281,7 @@ class TestEcdsaAuthPlugin(unittest.TestCase):
         context.config = {
             'auth': {
                 'puk-file': os.path.join(os.path.dirname(os.path.realpath(__file__)), "passwd"),
+                'schnorr-batch-workers': 0,
                 'allow-only-registered': False
             }
         }
@@ -197,6 +306,7 @@ class TestEcdsaAuthPlugin(unittest.TestCase):
         context.config = {
             'auth': {
                 'puk-file': os.path.join(os.path.dirname(os.path.realpath(__file__)), "passwd"),
+                'schnorr-batch-workers': 0,
                 'allow-only-registered': True
             }
         }
@@ -221,6 +331,7 @@ class TestEcdsaAuthPlugin(unittest.TestCase):
         context.config = {
             'auth': {
                 'puk-file': os.path.join(os.path.dirname(os.path.realpath(__file__)), "passwd"),
+                'schnorr-batch-workers': 0,
                 'allow-only-registered': False
             }
         }
@@ -237,3 +348,101 @@ class TestEcdsaAuthPlugin(unittest.TestCase):
         auth_plugin = EcdsaAuthPlugin(context)
         ret = self.loop.run_until_complete(auth_plugin.authenticate(session=s))
         self.assertFalse(ret)
+
+
+class TestVerificationCache(unittest.TestCase):
+    def test_window(self):
+        cache = VerificationCache()
+        self.assertIsNone(cache.get('w1', 'good'))
+        cache.put('w1', 'good', True)
+        self.assertIsNone(cache.get('w1', 'bad'))
+        cache.put('w1', 'bad', False)
+        self.assertTrue(cache.get('w1', 'good'))
+        self.assertIs(cache.get('w1', 'bad'), False)
+        # Results expire with their window, late results are ignored
+        self.assertIsNone(cache.get('w2', 'good'))
+        cache.put('w1', 'good', True)
+        self.assertIsNone(cache.get('w2', 'good'))
+        self.assertEqual((cache.hits, cache.rejected_hits, cache.misses), (1, 1, 4))
+
+    def test_lru(self):
+        cache = VerificationCache(max_size=2)
+        cache.get('w', 'a')
+        for key in ('a', 'b'):
+            cache.put('w', key, True)
+        cache.get('w', 'a')
+        cache.put('w', 'c', True)
+        for key in ('x', 'y', 'z'):
+            cache.put('w', key, False)
+        self.assertTrue(cache.get('w', 'a'))
+        self.assertIsNone(cache.get('w', 'b'))
+        self.assertTrue(cache.get('w', 'c'))
+        self.assertIsNone(cache.get('w', 'x'))
+        self.assertIs(cache.get('w', 'z'), False)
+
+    def test_plugin_cache(self):
+        loop = asyncio.new_event_loop()
+        context = BaseContext()
+        context.logger = logging.getLogger(__name__)
+        context.config = {'auth': {'allow-anonymous': False, 'schnorr-batch-workers': 0}}
+        auth_plugin = EcdsaAuthPlugin(context)
+        prk = binascii.unhexlify("fffc49122308b5e5666e6874ff4535d5a0e3f270a3a7545703c59da25378cbb3")
+        s = Session()
+        s.client_id = "client_using_secp256k1"
+        s.username = "02d3a9b4022ab24b9218ae3290d2cbecf6d773ef70769afe9f15e7055a79cc90c4"
+        msg = schnorr.hash_sha256(datetime.datetime.utcnow().isoformat()[:18] + s.client_id)
+        s.password = binascii.hexlify(schnorr.sign(msg, prk))
+        bad = Session()
+        bad.client_id = s.client_id
+        bad.username = s.username
+        bad.password = binascii.hexlify(schnorr.sign(schnorr.hash_sha256("other message"), prk))
+        results = [loop.run_until_complete(auth_plugin.authenticate(session=session))
+                   for session in (s, s, bad, bad)]
+        loop.close()
+        self.assertEqual(results, [True, True, False, False])
+        stats = auth_plugin.sys_stats()
+        self.assertEqual(stats['auth/ecdsa/cache/misses'], 2)
+        self.assertEqual(stats['auth/ecdsa/cache/hits'] + stats['auth/ecdsa/cache/rejected'], 2)
+
+
+class TestSchnorrBatchVerifier(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.signatures = []
+        for i in range(10):
+            prk = schnorr.hash_sha256("secret %d" % i)
+            msg = schnorr.hash_sha256("message %d" % i)
+            puk = schnorr.bytes_from_point(schnorr.G * schnorr.int_from_bytes(prk))
+            self.signatures.append((msg, puk, schnorr.sign(msg, prk)))
+        # Signature of another message
+        msg, puk, sig = self.signatures[3]
+        self.signatures[3] = (schnorr.hash_sha256("other message"), puk, sig)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def verify_all(self, verifier):
+        @asyncio.coroutine
+        def verify():
+            results = yield from asyncio.gather(
+                *[verifier.verify(*signature) for signature in self.signatures], loop=self.loop)
+            yield from verifier.close()
+            return results
+        return self.loop.run_until_complete(verify())
+
+    def test_batches(self):
+        verifier = SchnorrBatchVerifier(loop=self.loop, workers=0, max_size=4)
+        batches = []
+        original = schnorr.verify_batch
+        try:
+            schnorr.verify_batch = lambda *args: batches.append(len(args[0])) or original(*args)
+            results = self.verify_all(verifier)
+        finally:
+            schnorr.verify_batch = original
+        self.assertEqual(results, [i != 3 for i in range(10)])
+        self.assertEqual(batches, [4, 4, 2])
+
+    def test_process_pool(self):
+        verifier = SchnorrBatchVerifier(loop=self.loop, workers=1)
+        self.assertEqual(self.verify_all(verifier), [i != 3 for i in range(10)])
+        self.assertIsNone(verifier._executor)
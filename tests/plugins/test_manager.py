@@ -4,7 +4,9 @@
 import unittest
 import logging
 import asyncio
-from hbmqtt.plugins.manager import PluginManager
+import threading
+import time
+from hbmqtt.plugins.manager import BaseContext, PluginManager, blocking
 
 formatter = "[%(asctime)s] %(name)s {%(filename)s:%(lineno)d} %(levelname)s - %(message)s"
 logging.basicConfig(level=logging.INFO, format=formatter)
@@ -20,12 +22,16 @@ class EventTestPlugin:
         self.context = context
         self.test_flag = False
         self.coro_flag = False
+        self.sync_calls = 0
 
     @asyncio.coroutine
     def on_test(self, *args, **kwargs):
         self.test_flag = True
         self.context.logger.info("on_test")
 
+    def on_test_sync(self, *args, **kwargs):
+        self.sync_calls += 1
+
     @asyncio.coroutine
     def test_coro(self, *args, **kwargs):
         self.coro_flag = True
@@ -34,6 +40,15 @@ class EventTestPlugin:
     def ret_coro(self, *args, **kwargs):
         return "TEST"
 
+    @blocking
+    def on_test_blocking(self, *args, **kwargs):
+        self.blocking_thread = threading.current_thread()
+
+    @blocking
+    def ret_blocking(self, delay=0):
+        time.sleep(delay)
+        return threading.current_thread()
+
 
 class TestPluginManager(unittest.TestCase):
     def setUp(self):
@@ -66,6 +81,32 @@ class TestPluginManager(unittest.TestCase):
         plugin = manager.get_plugin("event_plugin")
         self.assertTrue(plugin.object.test_flag)
 
+    def test_fire_event_sync(self):
+        manager = PluginManager("hbmqtt.test.plugins", context=None, loop=self.loop)
+        self.loop.run_until_complete(manager.fire_event("test_sync"))
+        plugin = manager.get_plugin("event_plugin")
+        # Plain methods are called inline, without task
+        self.assertEqual(plugin.object.sync_calls, 1)
+        self.assertEqual(len(manager._fired_events), 0)
+
+    def test_fire_event_tasks_cleaned(self):
+        @asyncio.coroutine
+        def fire_event():
+            yield from manager.fire_event("test")
+            self.assertEqual(len(manager._fired_events), 1)
+            yield from asyncio.sleep(0.1, loop=self.loop)
+            self.assertEqual(len(manager._fired_events), 0)
+
+        manager = PluginManager("hbmqtt.test.plugins", context=None, loop=self.loop)
+        self.loop.run_until_complete(fire_event())
+
+    def test_event_handlers(self):
+        manager = PluginManager("hbmqtt.test.plugins", context=None, loop=self.loop)
+        handlers = manager._get_event_handlers("test")
+        self.assertEqual([plugin.name for plugin, method in handlers], ["event_plugin"])
+        self.assertIs(manager._get_event_handlers("test"), handlers)
+        self.assertEqual(manager._get_event_handlers("unknown"), ())
+
     def test_map_coro(self):
         @asyncio.coroutine
         def call_coro():
@@ -98,3 +139,32 @@ class TestPluginManager(unittest.TestCase):
         manager = PluginManager("hbmqtt.test.plugins", context=None, loop=self.loop)
         ret = self.loop.run_until_complete(call_coro())
         self.assertTrue(len(ret) == 0)
+
+    def test_fire_event_blocking(self):
+        manager = PluginManager("hbmqtt.test.plugins", context=None, loop=self.loop)
+        self.loop.run_until_complete(manager.fire_event("test_blocking", wait=True))
+        plugin = manager.get_plugin("event_plugin")
+        self.assertIsNot(plugin.object.blocking_thread, threading.current_thread())
+        self.loop.run_until_complete(manager.close())
+
+    def test_map_coro_blocking(self):
+        manager = PluginManager("hbmqtt.test.plugins", context=None, loop=self.loop)
+        ret = self.loop.run_until_complete(manager.map_plugin_coro('ret_blocking'))
+        plugin = manager.get_plugin("event_plugin")
+        self.assertIsNot(ret[plugin], threading.current_thread())
+        stats = manager.hook_stats()[("event_plugin", "ret_blocking")]
+        self.assertEqual(stats.calls, 1)
+        self.assertEqual(stats.pending, 0)
+        self.loop.run_until_complete(manager.close())
+
+    def test_blocking_limit(self):
+        context = BaseContext()
+        context.config = {'plugins-executor': {'workers': 4, 'limits': {'event_plugin': 1}}}
+        manager = PluginManager("hbmqtt.test.plugins", context=context, loop=self.loop)
+        calls = [manager.map_plugin_coro('ret_blocking', delay=0.05) for i in range(3)]
+        self.loop.run_until_complete(asyncio.gather(*calls, loop=self.loop))
+        stats = manager.hook_stats()[("event_plugin", "ret_blocking")]
+        self.assertEqual(stats.calls, 3)
+        # Calls ran one at a time: the last one waited for the two others
+        self.assertGreaterEqual(stats.max_queue_time, 0.09)
+        self.loop.run_until_complete(manager.close())
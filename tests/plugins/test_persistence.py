@@ -8,7 +8,8 @@ import os
 import asyncio
 import sqlite3
 from hbmqtt.plugins.manager import BaseContext
-from hbmqtt.plugins.persistence import SQLitePlugin
+from hbmqtt.plugins.persistence import SQLitePlugin, decode_session, encode_session
+from hbmqtt.session import Session, OutgoingApplicationMessage, RetainedApplicationMessage
 
 formatter = "[%(asctime)s] %(name)s {%(filename)s:%(lineno)d} %(levelname)s - %(message)s"
 logging.basicConfig(level=logging.DEBUG, format=formatter)
@@ -17,9 +18,119 @@ logging.basicConfig(level=logging.DEBUG, format=formatter)
 class TestSQLitePlugin(unittest.TestCase):
     def setUp(self):
         self.loop = asyncio.new_event_loop()
+        self.dbfile = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test.db")
+
+    def tearDown(self):
+        self.loop.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.dbfile + suffix):
+                os.remove(self.dbfile + suffix)
+
+    def new_plugin(self, **config):
+        context = BaseContext()
+        context.loop = self.loop
+        context.logger = logging.getLogger(__name__)
+        config['file'] = self.dbfile
+        context.config = {'persistence': config}
+        return SQLitePlugin(context)
+
+    def new_session(self, client_id):
+        s = Session(loop=self.loop)
+        s.client_id = client_id
+        s.clean_session = False
+        s.username = 'user'
+        s.keep_alive = 10
+        s.will_flag = True
+        s.will_topic = 'will/topic'
+        s.will_message = b'gone'
+        s.will_qos = 1
+        s.will_retain = False
+        return s
+
+    def test_encode_decode_session(self):
+        s = self.new_session('test_session')
+        s._packet_id = 12
+        message = OutgoingApplicationMessage(12, 'a/b', 2, b'data', False)
+        message.publish_packet = message.build_publish_packet()
+        s.inflight_out[12] = message
+        s.retained_messages.put_nowait(RetainedApplicationMessage(None, 'c/d', b'queued', 1))
+        restored = decode_session(encode_session(s), self.loop)
+        for attr in ('client_id', 'clean_session', 'username', 'keep_alive', 'will_flag', 'will_topic',
+                     'will_message', 'will_qos', 'will_retain', '_packet_id'):
+            self.assertEqual(getattr(restored, attr), getattr(s, attr))
+        restored_message = restored.inflight_out[12]
+        self.assertEqual((restored_message.topic, restored_message.qos, restored_message.data), ('a/b', 2, b'data'))
+        self.assertIsNotNone(restored_message.publish_packet)
+        self.assertIsNone(restored_message.pubrel_packet)
+        queued = restored.retained_messages.get_nowait()
+        self.assertEqual((queued.topic, queued.data, queued.qos), ('c/d', b'queued', 1))
+        # Encoding doesn't consume the offline queue
+        self.assertEqual(s.retained_messages.qsize(), 1)
+
+    def test_save_find_session(self):
+        plugin = self.new_plugin(**{'flush-interval': 10})
+        s = self.new_session('test_save_session')
+        for i in range(3):
+            s.keep_alive = i
+            self.loop.run_until_complete(plugin.save_session(s))
+        # Not written yet, but found
+        self.assertEqual(self.loop.run_until_complete(plugin.find_session('test_save_session')).keep_alive, 2)
+        self.loop.run_until_complete(plugin.sync())
+        self.assertEqual(plugin._writer.written, 1)
+        self.assertEqual(plugin._writer.commits, 1)
+        self.loop.run_until_complete(plugin.on_broker_post_shutdown())
+
+        plugin = self.new_plugin()
+        restored = self.loop.run_until_complete(plugin.find_session('test_save_session'))
+        self.assertEqual(restored.client_id, 'test_save_session')
+        self.assertEqual(restored.keep_alive, 2)
+        self.assertIsNone(self.loop.run_until_complete(plugin.find_session('unknown')))
+        self.loop.run_until_complete(plugin.del_session('test_save_session'))
+        self.assertIsNone(self.loop.run_until_complete(plugin.find_session('test_save_session')))
+        self.loop.run_until_complete(plugin.on_broker_post_shutdown())
+
+        conn = sqlite3.connect(self.dbfile)
+        self.assertIsNone(conn.execute("SELECT data FROM session where client_id = 'test_save_session'").fetchone())
+        conn.close()
+
+    def test_batch_size(self):
+        plugin = self.new_plugin(**{'flush-interval': 10, 'batch-size': 10})
+        for i in range(25):
+            self.loop.run_until_complete(plugin.save_session(self.new_session('client%d' % i)))
+        # Full batches are flushed without waiting for the flush interval
+        self.assertEqual(len(plugin._updates), 5)
+        self.loop.run_until_complete(plugin.sync())
+        self.assertEqual(plugin._writer.written, 25)
+        self.loop.run_until_complete(plugin.on_broker_post_shutdown())
+
+    def test_subscriptions_and_queue(self):
+        plugin = self.new_plugin(**{'flush-interval': 10})
+        s = self.new_session('client')
+        run = self.loop.run_until_complete
+        run(plugin.save_session(s))
+        run(plugin.add_subscription('client', 'a/#', 1))
+        run(plugin.add_subscription('client', 'b', 2))
+        run(plugin.del_subscription('client', 'b'))
+        for i in range(3):
+            run(plugin.queue_message('client', RetainedApplicationMessage(None, 'a/b', b'%d' % i, 1)))
+        self.assertEqual(run(plugin.find_subscriptions('client')), [('a/#', 1)])
+        restored = run(plugin.find_session('client'))
+        self.assertEqual([restored.retained_messages.get_nowait().data for i in range(3)], [b'0', b'1', b'2'])
+        # Replaced queue, then appended message
+        run(plugin.save_queue('client', [RetainedApplicationMessage(None, 'a/c', b'kept', 2)]))
+        run(plugin.queue_message('client', RetainedApplicationMessage(None, 'a/d', b'new', 1)))
+        restored = run(plugin.find_session('client'))
+        self.assertEqual(restored.retained_messages.qsize(), 2)
+        self.assertEqual(restored.retained_messages.get_nowait().data, b'kept')
+        # Deleted session is not restored after new updates of another client
+        run(plugin.del_session('client'))
+        run(plugin.add_subscription('other', 'a/#', 0))
+        self.assertIsNone(run(plugin.find_session('client')))
+        self.assertEqual(run(plugin.find_subscriptions('client')), [])
+        run(plugin.on_broker_post_shutdown())
 
     def test_create_tables(self):
-        dbfile = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test.db")
+        dbfile = self.dbfile
         context = BaseContext()
         context.logger = logging.getLogger(__name__)
         context.config = {
@@ -0,0 +1,104 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+import random
+import unittest
+
+from hbmqtt.plugins.secp256k1 import (
+    G, n, PublicKey, _build_g_table, hash_sha256, point_add, point_mul, point_mul_add, wnaf)
+from hbmqtt.plugins.secp256k1 import ecdsa, schnorr
+
+
+def affine_mul(P, k):
+    # Former double-and-add implementation, used as reference
+    R = None
+    for i in range(256):
+        if (k >> i) & 1:
+            R = point_add(R, P)
+        P = point_add(P, P)
+    return R
+
+
+class TestCurveArithmetic(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def test_wnaf(self):
+        for k in [1, 2, 15, 16, 31, n - 1] + [self.random.getrandbits(256) for i in range(20)]:
+            digits = wnaf(k)
+            self.assertEqual(sum(d << i for i, d in enumerate(digits)), k)
+            for i, d in enumerate(digits):
+                self.assertTrue(d == 0 or (d % 2 and -16 < d < 16))
+                if d:
+                    self.assertFalse(any(digits[i + 1:i + 5]))
+
+    def test_point_mul(self):
+        scalars = [1, 2, 3, 15, 16, 17, n - 1, n + 1, (1 << 256) - 1, -5]
+        scalars += [self.random.getrandbits(256) for i in range(10)]
+        for k in scalars:
+            self.assertEqual(point_mul(G, k), affine_mul(G, k))
+        self.assertIsNone(point_mul(G, 0))
+        self.assertIsNone(point_mul(G, n))
+
+    def test_g_table(self):
+        table = _build_g_table(4)
+        self.assertEqual(len(table), 64)
+        for i in (0, 1, 63):
+            self.assertEqual(len(table[i]), 15)
+            for j in (1, 2, 15):
+                self.assertEqual(tuple(table[i][j - 1]), tuple(affine_mul(G, j << (4 * i))))
+
+    def test_point_mul_add(self):
+        for i in range(5):
+            Q = point_mul(G, self.random.getrandbits(256))
+            a = self.random.getrandbits(256)
+            b = self.random.getrandbits(256)
+            self.assertEqual(point_mul_add(G, a, Q, b), point_add(affine_mul(G, a), affine_mul(Q, b)))
+        self.assertEqual(point_mul_add(G, 5, G, 0), point_mul(G, 5))
+        self.assertIsNone(point_mul_add(G, 1, G, n - 1))
+
+    def test_public_key(self):
+        puk = PublicKey.from_secret("secret")
+        self.assertEqual(puk.x, 0xa02b9d5fdd1307c2ee4652ba54d492d1fd11a7d1bb3f3a44c4a05e79f19de933)
+        self.assertEqual(puk.y, 0x924aa2580069952b0140d88de21c367ee4af7c4a906e1498f20ab8f62e4c2921)
+
+
+class TestSignatures(unittest.TestCase):
+    def setUp(self):
+        self.prk = hash_sha256("other secret")
+        self.puk = PublicKey.from_seed(self.prk).encode()
+        self.msg = hash_sha256("message")
+
+    def test_ecdsa(self):
+        sig = ecdsa.rfc6979_sign(self.msg, self.prk)
+        self.assertTrue(ecdsa.verify(self.msg, self.puk, sig))
+        self.assertFalse(ecdsa.verify(hash_sha256("other message"), self.puk, sig))
+
+    def test_schnorr(self):
+        sig = schnorr.sign(self.msg, self.prk)
+        self.assertTrue(schnorr.verify(self.msg, self.puk[1:], sig))
+        self.assertFalse(schnorr.verify(hash_sha256("other message"), self.puk[1:], sig))
+
+    def test_schnorr_batch(self):
+        msgs, puks, sigs = [], [], []
+        for i in range(5):
+            prk = hash_sha256("secret %d" % i)
+            msgs.append(hash_sha256("message %d" % i))
+            puks.append(PublicKey.from_seed(prk).encode()[1:])
+            sigs.append(schnorr.sign(msgs[-1], prk))
+        self.assertTrue(schnorr.batch_verify(msgs, puks, sigs))
+        self.assertEqual(schnorr.verify_batch(msgs, puks, sigs), [True] * 5)
+        sigs[1], sigs[2] = sigs[2], sigs[1]
+        sigs[4] = sigs[4][:32]
+        self.assertFalse(schnorr.batch_verify(msgs[:4], puks[:4], sigs[:4]))
+        self.assertEqual(schnorr.verify_batch(msgs, puks, sigs), [True, False, False, True, False])
+
+    def test_bcrypto410(self):
+        sig = schnorr.bcrypto410_sign(self.msg, self.prk)
+        self.assertTrue(schnorr.bcrypto410_verify(self.msg, self.puk, sig))
+        self.assertFalse(schnorr.bcrypto410_verify(hash_sha256("other message"), self.puk, sig))
+
+    def test_degenerate_signature(self):
+        # s=0 used to raise when adding the point at infinity
+        sig = ecdsa.der_from_sig(1, 0)
+        self.assertFalse(ecdsa.verify(self.msg, self.puk, sig))
@@ -0,0 +1,122 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+import itertools
+import logging
+import unittest
+
+from hbmqtt.plugins.manager import BaseContext
+from hbmqtt.plugins.topic_checking import (
+    AccessControlList, TokenTopicPlugin, TopicAccessControlListPlugin, TopicTabooPlugin)
+from hbmqtt.session import Session
+
+
+ALLOWED = [
+    '#', '+', 'a', 'a/b', 'a/+', 'a/#', 'a/+/c', 'a/b/#', '+/b', '+/+/c', 'a/#/c', '/a', 'a/', '$SYS/#', 'x/y/z',
+]
+
+REQUESTED = [
+    'a', 'b', 'a/b', 'a/c', 'a/b/c', 'a/x/c', 'x/b', 'a/b/c/d', '/a', 'a/', '$SYS', '$SYS/load', 'x/y', 'x/y/z',
+    'a/+', 'a/#', '+/b', '#',
+]
+
+
+class TestAccessControlList(unittest.TestCase):
+    def test_same_as_topic_ac(self):
+        for size in (1, 2, 3):
+            for allowed in itertools.combinations(ALLOWED, size):
+                acl = AccessControlList(allowed)
+                for requested in REQUESTED:
+                    expected = any(TopicAccessControlListPlugin.topic_ac(requested, a) for a in allowed)
+                    self.assertEqual(acl.allows(requested), expected, "%r allowed by %r" % (requested, allowed))
+
+    def test_empty(self):
+        self.assertFalse(AccessControlList().allows('a'))
+
+    def test_templates(self):
+        acl = AccessControlList(['devices/%c/#', 'users/%u', 'groups/%u-%c'])
+        self.assertTrue(acl.allows('devices/dev1/temp', 'user', 'dev1'))
+        self.assertFalse(acl.allows('devices/dev2/temp', 'user', 'dev1'))
+        self.assertTrue(acl.allows('users/user', 'user', 'dev1'))
+        self.assertFalse(acl.allows('users/other', 'user', 'dev1'))
+        self.assertTrue(acl.allows('groups/user-dev1', 'user', 'dev1'))
+        self.assertFalse(acl.allows('users/None', None, 'dev1'))
+
+    def test_wildcard_values_not_substituted(self):
+        acl = AccessControlList(['devices/%c/#'])
+        self.assertFalse(acl.allows('devices/+/temp', 'user', '+'))
+        self.assertFalse(acl.allows('devices/#/temp', 'user', '#'))
+
+
+class TestTopicAccessControlListPlugin(unittest.TestCase):
+    def setUp(self):
+        self.context = BaseContext()
+        self.context.logger = logging.getLogger(__name__)
+        self.context.config = {
+            'topic-check': {
+                'enabled': True,
+                'acl': {
+                    'user': ['public/#', 'devices/%c/#'],
+                    'anonymous': ['public/+'],
+                }
+            }
+        }
+
+    def session(self, username, client_id):
+        session = Session()
+        session.username = username
+        session.client_id = client_id
+        return session
+
+    def test_topic_filtering(self):
+        plugin = TopicAccessControlListPlugin(self.context)
+        user = self.session('user', 'dev1')
+        anonymous = self.session(None, 'dev2')
+        self.assertTrue(plugin.topic_filtering(session=user, topic='public/a/b'))
+        self.assertTrue(plugin.topic_filtering(session=user, topic='devices/dev1/temp'))
+        self.assertFalse(plugin.topic_filtering(session=user, topic='devices/dev2/temp'))
+        self.assertTrue(plugin.topic_filtering(session=anonymous, topic='public/a'))
+        self.assertFalse(plugin.topic_filtering(session=anonymous, topic='public/a/b'))
+        self.assertFalse(plugin.topic_filtering(session=self.session('unknown', 'dev3'), topic='public/a'))
+
+    def test_load_acl(self):
+        plugin = TopicAccessControlListPlugin(self.context)
+        user = self.session('user', 'dev1')
+        self.assertFalse(plugin.topic_filtering(session=user, topic='private/a'))
+        self.context.config['topic-check']['acl']['user'].append('private/+')
+        plugin.load_acl()
+        self.assertTrue(plugin.topic_filtering(session=user, topic='private/a'))
+
+
+class TestTopicTabooPlugin(unittest.TestCase):
+    def test_topic_filtering(self):
+        context = BaseContext()
+        context.logger = logging.getLogger(__name__)
+        context.config = {'topic-check': {'enabled': True}}
+        plugin = TopicTabooPlugin(context)
+        session = Session()
+        session.username = 'user'
+        self.assertTrue(plugin.topic_filtering(session=session, topic='public'))
+        self.assertFalse(plugin.topic_filtering(session=session, topic='prohibited'))
+
+    def test_empty_config_denies(self):
+        context = BaseContext()
+        context.logger = logging.getLogger(__name__)
+        context.config = {'topic-check': {}}
+        plugin = TopicTabooPlugin(context)
+        self.assertIs(plugin.topic_filtering(session=Session(), topic='public'), False)
+
+
+class TestTokenTopicPlugin(unittest.TestCase):
+    def test_topic_filtering(self):
+        context = BaseContext()
+        context.logger = logging.getLogger(__name__)
+        context.config = {'topic-check': {'enabled': True}}
+        plugin = TokenTopicPlugin(context)
+        session = Session()
+        self.assertIsNone(plugin.topic_filtering(session=session, topic='a/b'))
+        session._token_topics = ('devices/dev1/', 'public/')
+        self.assertTrue(plugin.topic_filtering(session=session, topic='devices/dev1/temp'))
+        self.assertTrue(plugin.topic_filtering(session=session, topic='public/#'))
+        self.assertFalse(plugin.topic_filtering(session=session, topic='devices/dev2/temp'))
+        self.assertFalse(plugin.topic_filtering(session=session, topic='#'))
@@ -0,0 +1,136 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+import asyncio
+import unittest
+
+from websockets.exceptions import ConnectionClosed
+
+from hbmqtt.adapters import WebSocketsReader, WebSocketsWriter
+from hbmqtt.mqtt.packet import MQTTFixedHeader
+from hbmqtt.mqtt.publish import PublishPacket
+from hbmqtt.mqtt.pingreq import PingReqPacket
+from hbmqtt.mqtt.constants import QOS_1
+from hbmqtt.mqtt import packet_class
+
+
+class FakeWebSocket:
+    def __init__(self, loop, messages=()):
+        self.loop = loop
+        self.messages = list(messages)
+        self.sent = []
+        self.closed = False
+
+    @asyncio.coroutine
+    def recv(self):
+        if not self.messages:
+            raise ConnectionClosed(1000, '')
+        return self.messages.pop(0)
+
+    @asyncio.coroutine
+    def send(self, data):
+        if self.closed:
+            raise ConnectionClosed(1000, '')
+        self.sent.append(data)
+
+    @asyncio.coroutine
+    def close(self):
+        self.closed = True
+
+
+class WebSocketsReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_read_across_messages(self):
+        reader = WebSocketsReader(FakeWebSocket(self.loop, [b'abc', b'', b'defg', b'h']))
+        self.assertEqual(self.loop.run_until_complete(reader.read(2)), b'ab')
+        self.assertEqual(self.loop.run_until_complete(reader.read(3)), b'cde')
+        self.assertEqual(self.loop.run_until_complete(reader.read(2)), b'fg')
+        self.assertEqual(self.loop.run_until_complete(reader.read(5)), b'h')
+        self.assertEqual(self.loop.run_until_complete(reader.read(1)), b'')
+
+    def test_read_whole_message(self):
+        message = b'message'
+        reader = WebSocketsReader(FakeWebSocket(self.loop, [message]))
+        self.assertIs(self.loop.run_until_complete(reader.read(len(message))), message)
+
+    def test_read_packets_in_message(self):
+        packets = [PublishPacket.build('a/b', b'x' * i, i + 1, False, QOS_1, False) for i in range(10)]
+        packets.append(PingReqPacket())
+        message = b''.join(packet.to_bytes() for packet in packets)
+        reader = WebSocketsReader(FakeWebSocket(self.loop, [message[:5], message[5:]]))
+
+        @asyncio.coroutine
+        def read_packets():
+            read = []
+            for i in range(len(packets)):
+                fixed_header = yield from MQTTFixedHeader.from_stream(reader)
+                read.append((yield from packet_class(fixed_header).from_stream(reader, fixed_header=fixed_header)))
+            return read
+
+        read = self.loop.run_until_complete(read_packets())
+        self.assertEqual([packet.to_bytes() for packet in read], [packet.to_bytes() for packet in packets])
+
+    def test_text_message(self):
+        reader = WebSocketsReader(FakeWebSocket(self.loop, ['text']))
+        with self.assertRaises(TypeError):
+            self.loop.run_until_complete(reader.read(1))
+
+
+class WebSocketsWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_batch_in_one_message(self):
+        websocket = FakeWebSocket(self.loop)
+        writer = WebSocketsWriter(websocket)
+
+        @asyncio.coroutine
+        def write():
+            writer.write(b'ab')
+            writer.writelines([b'cd', b'ef'])
+            self.assertFalse(writer.needs_drain())
+            yield from asyncio.sleep(0, loop=self.loop)
+            writer.write(b'gh')
+            yield from writer.drain()
+
+        self.loop.run_until_complete(write())
+        self.assertEqual(websocket.sent, [b'abcdef', b'gh'])
+
+    def test_high_water(self):
+        writer = WebSocketsWriter(FakeWebSocket(self.loop), high_water=4)
+
+        @asyncio.coroutine
+        def write():
+            writer.write(b'abc')
+            self.assertFalse(writer.needs_drain())
+            writer.write(b'd')
+            self.assertTrue(writer.needs_drain())
+            yield from writer.drain()
+            self.assertFalse(writer.needs_drain())
+
+        self.loop.run_until_complete(write())
+
+    def test_send_error(self):
+        websocket = FakeWebSocket(self.loop)
+        websocket.closed = True
+        writer = WebSocketsWriter(websocket)
+        writer.write(b'data')
+        with self.assertRaises(ConnectionClosed):
+            self.loop.run_until_complete(writer.drain())
+        self.assertTrue(writer.needs_drain())
+
+    def test_close_sends_pending(self):
+        websocket = FakeWebSocket(self.loop)
+        writer = WebSocketsWriter(websocket)
+        writer.write(b'data')
+        self.loop.run_until_complete(writer.close())
+        self.assertEqual(websocket.sent, [b'data'])
+        self.assertTrue(websocket.closed)
@@ -3,10 +3,12 @@
 # See the file license.txt for copying permission.
 import asyncio
 import logging
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, call
 
-from hbmqtt.adapters import StreamReaderAdapter, StreamWriterAdapter
+from hbmqtt.adapters import StreamReaderAdapter, StreamWriterAdapter, PacketProtocol
 from hbmqtt.broker import (
     EVENT_BROKER_PRE_START,
     EVENT_BROKER_POST_START,
@@ -17,8 +19,14 @@ from hbmqtt.broker import (
     EVENT_BROKER_CLIENT_SUBSCRIBED,
     EVENT_BROKER_CLIENT_UNSUBSCRIBED,
     EVENT_BROKER_MESSAGE_RECEIVED,
-    Broker)
+    Broker,
+    BrokerException,
+    RetainedApplicationMessage)
 from hbmqtt.client import MQTTClient, ConnectException
+from hbmqtt.inflight import InflightLog
+from hbmqtt.plugins.manager import BaseContext, Plugin
+from hbmqtt.plugins.persistence import SQLitePlugin
+from hbmqtt.session import Session, OutgoingApplicationMessage
 from hbmqtt.mqtt import (
     ConnectPacket, ConnackPacket, PublishPacket, PubrecPacket,
     PubrelPacket, PubcompPacket, DisconnectPacket)
@@ -469,6 +477,437 @@ class BrokerTest(unittest.TestCase):
         if future.exception():
             raise future.exception()
 
+    @patch('hbmqtt.broker.PluginManager')
+    def test_client_publish_qos1_order(self, MockPluginManager):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                broker = Broker(test_config, plugin_namespace="hbmqtt.test.plugins")
+                yield from broker.start()
+                self.assertTrue(broker.transitions.is_started())
+                sub_client = MQTTClient()
+                yield from sub_client.connect('mqtt://127.0.0.1')
+                ret = yield from sub_client.subscribe([('/order', QOS_1)])
+                self.assertEqual(ret, [QOS_1])
+
+                pub_client = MQTTClient()
+                yield from pub_client.connect('mqtt://127.0.0.1/')
+                for i in range(20):
+                    yield from pub_client.publish('/order', str(i).encode(), QOS_1)
+                yield from pub_client.disconnect()
+                for i in range(20):
+                    message = yield from sub_client.deliver_message()
+                    self.assertEqual(message.data, str(i).encode())
+                handler = broker._get_handler(broker._sessions[sub_client.session.client_id][0])
+                self.assertEqual(handler._outgoing_queue.qsize(), 0)
+                yield from sub_client.disconnect()
+                yield from asyncio.sleep(0.1)
+                yield from broker.shutdown()
+                self.assertTrue(broker.transitions.is_stopped())
+                future.set_result(True)
+            except Exception as ae:
+                future.set_exception(ae)
+
+        future = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(test_coro())
+        if future.exception():
+            raise future.exception()
+
+    @patch('hbmqtt.broker.PluginManager')
+    def test_client_reconnect_queued_messages(self, MockPluginManager):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                # Own port: a broker left running by a failed test does not make this one fail
+                config = dict(test_config, listeners={'default': {'type': 'tcp', 'bind': '127.0.0.1:1884'}})
+                broker = Broker(config, plugin_namespace="hbmqtt.test.plugins")
+                yield from broker.start()
+                sub_client = MQTTClient()
+                yield from sub_client.connect('mqtt://127.0.0.1:1884', cleansession=False)
+                yield from sub_client.subscribe([('/queued', QOS_1)])
+                # Stall the handler writer: messages stay in the outgoing queue until the client disconnects
+                handler = broker._get_handler(broker._sessions[sub_client.session.client_id][0])
+                handler._writer_task.cancel()
+                for i in range(5):
+                    yield from self._client_publish('/queued', str(i).encode(), QOS_1, url='mqtt://127.0.0.1:1884/')
+                self.assertEqual(handler._outgoing_queue.qsize(), 5)
+                yield from sub_client.disconnect()
+                yield from asyncio.sleep(0.1)
+
+                yield from sub_client.reconnect()
+                for i in range(5):
+                    message = yield from sub_client.deliver_message()
+                    self.assertEqual(message.data, str(i).encode())
+                    self.assertEqual(message.qos, QOS_1)
+                yield from sub_client.disconnect()
+                yield from asyncio.sleep(0.1)
+                yield from broker.shutdown()
+                future.set_result(True)
+            except Exception as ae:
+                future.set_exception(ae)
+
+        future = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(test_coro())
+        if future.exception():
+            raise future.exception()
+
+    @patch('hbmqtt.broker.PluginManager')
+    def test_client_session_stored(self, MockPluginManager):
+        def new_broker():
+            config = dict(test_config, listeners={'default': {'type': 'tcp', 'bind': '127.0.0.1:1884'}},
+                          persistence={'file': db_file})
+            broker = Broker(config, plugin_namespace="hbmqtt.test.plugins")
+            context = BaseContext()
+            context.loop = self.loop
+            context.logger = log
+            context.config = config
+            broker._session_stores = [SQLitePlugin(context)]
+            return broker
+
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                broker = new_broker()
+                yield from broker.start()
+                sub_client = MQTTClient()
+                yield from sub_client.connect('mqtt://127.0.0.1:1884', cleansession=False)
+                yield from sub_client.subscribe([('/stored', QOS_1)])
+                yield from sub_client.disconnect()
+                yield from asyncio.sleep(0.1)
+                for i in range(3):
+                    yield from self._client_publish('/stored', str(i).encode(), QOS_1, url='mqtt://127.0.0.1:1884/')
+                yield from asyncio.sleep(0.1)
+                yield from broker.shutdown()
+                yield from broker._session_stores[0].on_broker_post_shutdown()
+
+                # Sessions are restored when their client connects
+                broker = new_broker()
+                yield from broker.start()
+                self.assertNotIn(sub_client.session.client_id, broker._sessions)
+                # ... once authenticated
+                authenticate = broker.authenticate
+                broker.authenticate = asyncio.coroutine(lambda *args: False)
+                intruder = MQTTClient(client_id=sub_client.session.client_id, config={'auto_reconnect': False})
+                # The broker closes the connection without CONNACK
+                with self.assertRaises(Exception):
+                    yield from intruder.connect('mqtt://127.0.0.1:1884', cleansession=False)
+                self.assertNotIn('/stored', broker._subscriptions)
+                self.assertNotIn(sub_client.session.client_id, broker._sessions)
+                broker.authenticate = authenticate
+                yield from sub_client.reconnect()
+                for i in range(3):
+                    message = yield from sub_client.deliver_message()
+                    self.assertEqual(message.data, str(i).encode())
+                yield from self._client_publish('/stored', b'after restart', QOS_1, url='mqtt://127.0.0.1:1884/')
+                message = yield from sub_client.deliver_message()
+                self.assertEqual(message.data, b'after restart')
+                yield from sub_client.disconnect()
+                yield from asyncio.sleep(0.1)
+                yield from broker.shutdown()
+                yield from broker._session_stores[0].on_broker_post_shutdown()
+                future.set_result(True)
+            except Exception as ae:
+                future.set_exception(ae)
+
+        db_dir = tempfile.TemporaryDirectory()
+        db_file = os.path.join(db_dir.name, 'sessions.db')
+        future = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(test_coro())
+        db_dir.cleanup()
+        if future.exception():
+            raise future.exception()
+
+    @patch('hbmqtt.broker.PluginManager')
+    def test_session_store_calls(self, MockPluginManager):
+        class BlockedStore:
+            def __init__(self, loop):
+                self.calls = []
+                self.blocked = asyncio.Future(loop=loop)
+
+            @asyncio.coroutine
+            def find_session(self, client_id):
+                return None
+
+            def __getattr__(self, name):
+                @asyncio.coroutine
+                def call(*args):
+                    self.calls.append((name, args[0]))
+                    if name == 'queue_message':
+                        yield from self.blocked
+                return call
+
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                config = dict(test_config, listeners={'default': {'type': 'tcp', 'bind': '127.0.0.1:1884'}})
+                broker = Broker(config, plugin_namespace="hbmqtt.test.plugins")
+                store = BlockedStore(self.loop)
+                broker._session_stores = [store]
+                yield from broker.start()
+                offline_client = MQTTClient(client_id='offline')
+                yield from offline_client.connect('mqtt://127.0.0.1:1884', cleansession=False)
+                yield from offline_client.subscribe([('/store', QOS_1)])
+                yield from offline_client.disconnect()
+                sub_client = MQTTClient()
+                yield from sub_client.connect('mqtt://127.0.0.1:1884')
+                yield from sub_client.subscribe([('/store', QOS_1)])
+                # A store queuing messages of offline sessions doesn't hold back delivery to other clients
+                for i in range(3):
+                    yield from self._client_publish('/store', str(i).encode(), QOS_1, url='mqtt://127.0.0.1:1884/')
+                for i in range(3):
+                    message = yield from asyncio.wait_for(sub_client.deliver_message(), 2, loop=self.loop)
+                    self.assertEqual(message.data, str(i).encode())
+                yield from sub_client.disconnect()
+                store.blocked.set_result(None)
+                # Store calls run in order: the session deletion is stored before the new session
+                broker.delete_session('offline')
+                yield from broker._store_call('save_session', Session())
+                self.assertEqual(store.calls[-2:], [('del_session', 'offline'), ('save_session', store.calls[-1][1])])
+                self.assertEqual([call for call in store.calls if call[0] == 'queue_message'],
+                                 [('queue_message', 'offline')] * 3)
+                yield from broker.shutdown()
+                future.set_result(True)
+            except Exception as ae:
+                future.set_exception(ae)
+
+        future = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(test_coro())
+        if future.exception():
+            raise future.exception()
+
+    @patch('hbmqtt.broker.PluginManager')
+    def test_client_inflight_recovered(self, MockPluginManager):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                # Message sent by a broker which crashed before the PUBACK
+                log = InflightLog(log_file, loop=self.loop)
+                log.recover()
+                log.publish_out('inflight-client', OutgoingApplicationMessage(1, '/inflight', QOS_1, b'data', False))
+                log.close()
+
+                config = dict(test_config, listeners={'default': {'type': 'tcp', 'bind': '127.0.0.1:1884'}},
+                              **{'inflight-log': {'file': log_file}})
+                broker = Broker(config, plugin_namespace="hbmqtt.test.plugins")
+                yield from broker.start()
+                client = MQTTClient(client_id='inflight-client')
+                yield from client.connect('mqtt://127.0.0.1:1884/', cleansession=False)
+                message = yield from client.deliver_message()
+                self.assertEqual(message.topic, '/inflight')
+                self.assertEqual(message.data, b'data')
+                self.assertTrue(message.publish_packet.dup_flag)
+                yield from asyncio.sleep(0.1)
+                session = broker._sessions['inflight-client'][0]
+                self.assertEqual(len(session.inflight_out), 0)
+                yield from client.disconnect()
+                yield from broker.shutdown()
+
+                log = InflightLog(log_file, loop=self.loop)
+                self.assertEqual(log.recover(), {})
+                log.close()
+                future.set_result(True)
+            except Exception as ae:
+                future.set_exception(ae)
+
+        log_dir = tempfile.TemporaryDirectory()
+        log_file = os.path.join(log_dir.name, 'inflight.log')
+        future = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(test_coro())
+        log_dir.cleanup()
+        if future.exception():
+            raise future.exception()
+
+    @patch('hbmqtt.broker.PluginManager')
+    def test_slow_subscriber_does_not_block_broadcast(self, MockPluginManager):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                config = dict(test_config, listeners={'default': {'type': 'tcp', 'bind': '127.0.0.1:1884'}})
+                config['outgoing-queue-size'] = 2
+                broker = Broker(config, plugin_namespace="hbmqtt.test.plugins")
+                yield from broker.start()
+                slow_client = MQTTClient(config={'auto_reconnect': False})
+                yield from slow_client.connect('mqtt://127.0.0.1:1884', cleansession=False)
+                yield from slow_client.subscribe([('/slow', QOS_1)])
+                slow_session = broker._sessions[slow_client.session.client_id][0]
+                broker._get_handler(slow_session)._writer_task.cancel()
+                sub_client = MQTTClient()
+                yield from sub_client.connect('mqtt://127.0.0.1:1884')
+                yield from sub_client.subscribe([('/slow', QOS_1)])
+
+                for i in range(5):
+                    yield from self._client_publish('/slow', str(i).encode(), QOS_1, url='mqtt://127.0.0.1:1884/')
+                for i in range(5):
+                    message = yield from sub_client.deliver_message()
+                    self.assertEqual(message.data, str(i).encode())
+                yield from asyncio.sleep(0.1)
+                # The slow client was disconnected, its messages are kept in order for its next connection
+                self.assertEqual(slow_session.transitions.state, 'disconnected')
+                queued = []
+                while not slow_session.retained_messages.empty():
+                    queued.append(slow_session.retained_messages.get_nowait())
+                self.assertEqual([message.frame.data for message in queued], [str(i).encode() for i in range(5)])
+                yield from sub_client.disconnect()
+                yield from broker.shutdown()
+                future.set_result(True)
+            except Exception as ae:
+                future.set_exception(ae)
+
+        future = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(test_coro())
+        if future.exception():
+            raise future.exception()
+
+    @patch('hbmqtt.broker.PluginManager')
+    def test_broadcast_burst_does_not_disconnect(self, MockPluginManager):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                config = dict(test_config, listeners={'default': {'type': 'tcp', 'bind': '127.0.0.1:1884'}})
+                config['outgoing-queue-size'] = 10
+                broker = Broker(config, plugin_namespace="hbmqtt.test.plugins")
+                yield from broker.start()
+                sub_client = MQTTClient(config={'auto_reconnect': False})
+                yield from sub_client.connect('mqtt://127.0.0.1:1884', cleansession=False)
+                yield from sub_client.subscribe([('/burst', QOS_1)])
+                sub_session = broker._sessions[sub_client.session.client_id][0]
+                # Broadcasts waiting at once, more than the outgoing queue can hold
+                for i in range(100):
+                    broker._broadcast_queue.put_nowait({'session': sub_session, 'topic': '/burst', 'data': b'%d' % i})
+                for i in range(100):
+                    message = yield from sub_client.deliver_message()
+                    self.assertEqual(message.data, b'%d' % i)
+                self.assertEqual(sub_session.transitions.state, 'connected')
+                self.assertEqual(sub_session.retained_messages_count, 0)
+                yield from sub_client.disconnect()
+                yield from broker.shutdown()
+                future.set_result(True)
+            except Exception as ae:
+                future.set_exception(ae)
+
+        future = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(test_coro())
+        if future.exception():
+            raise future.exception()
+
+    @patch('hbmqtt.broker.PluginManager')
+    def test_max_inflight_messages(self, MockPluginManager):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                config = dict(test_config, listeners={'default': {'type': 'tcp', 'bind': '127.0.0.1:1884'}})
+                config['max-inflight-messages'] = 5
+                broker = Broker(config, plugin_namespace="hbmqtt.test.plugins")
+                yield from broker.start()
+                sub_client = MQTTClient(config={'auto_reconnect': False})
+                yield from sub_client.connect('mqtt://127.0.0.1:1884', cleansession=False)
+                yield from sub_client.subscribe([('/window', QOS_1)])
+                sub_session, sub_handler = broker._sessions[sub_client.session.client_id]
+                # The client reads nothing, so acknowledges nothing
+                sub_client._handler._reader_task.cancel()
+                for i in range(20):
+                    yield from self._client_publish('/window', str(i).encode(), QOS_1, url='mqtt://127.0.0.1:1884/')
+                yield from asyncio.sleep(0.1)
+                self.assertEqual(sub_session.inflight_out_count, 5)
+                self.assertEqual(sub_handler._outgoing_queue.qsize(), 14)
+                self.assertIsNotNone(sub_handler._held_message)
+                # Messages waiting for the window are kept in the session when the client is disconnected
+                yield from sub_handler.stop()
+                self.assertEqual([message.frame.data for message in sub_session.retained_messages_snapshot()],
+                                 [str(i).encode() for i in range(5, 20)])
+                yield from broker.shutdown()
+                future.set_result(True)
+            except Exception as ae:
+                future.set_exception(ae)
+
+        future = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(test_coro())
+        if future.exception():
+            raise future.exception()
+
+    @patch('hbmqtt.broker.PacketProtocol', None)
+    @patch('hbmqtt.broker.PluginManager')
+    def test_buffered_listener_unavailable(self, MockPluginManager):
+        config = dict(test_config, listeners={'default': {'type': 'tcp-buffered', 'bind': '127.0.0.1:1885'}})
+        broker = Broker(config, plugin_namespace="hbmqtt.test.plugins", loop=self.loop)
+        with self.assertRaises(BrokerException):
+            self.loop.run_until_complete(broker.start())
+        self.assertTrue(broker.transitions.is_new())
+
+    @unittest.skipIf(PacketProtocol is None, "asyncio.BufferedProtocol requires Python 3.7")
+    @patch('hbmqtt.broker.PluginManager')
+    def test_client_publish_buffered_listener(self, MockPluginManager):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                config = {
+                    'listeners': {
+                        'default': {'type': 'tcp-buffered', 'bind': '127.0.0.1:1885', 'max_connections': 10},
+                    },
+                    'sys_interval': 0,
+                    'auth': {'allow-anonymous': True},
+                }
+                broker = Broker(config, plugin_namespace="hbmqtt.test.plugins")
+                yield from broker.start()
+                self.assertTrue(broker.transitions.is_started())
+                sub_client = MQTTClient()
+                yield from sub_client.connect('mqtt://127.0.0.1:1885')
+                ret = yield from sub_client.subscribe([('/buffered', QOS_2)])
+                self.assertEqual(ret, [QOS_2])
+
+                pub_client = MQTTClient()
+                yield from pub_client.connect('mqtt://127.0.0.1:1885/')
+                for i in range(20):
+                    yield from pub_client.publish('/buffered', str(i).encode() * 1000, QOS_1)
+                yield from pub_client.disconnect()
+                for i in range(20):
+                    message = yield from sub_client.deliver_message()
+                    self.assertEqual(message.data, str(i).encode() * 1000)
+                yield from sub_client.disconnect()
+                yield from asyncio.sleep(0.1)
+                yield from broker.shutdown()
+                self.assertTrue(broker.transitions.is_stopped())
+                self.assertDictEqual(broker._sessions, {})
+                future.set_result(True)
+            except Exception as ae:
+                future.set_exception(ae)
+
+        future = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(test_coro())
+        if future.exception():
+            raise future.exception()
+
+    @patch('hbmqtt.broker.PluginManager')
+    def test_topic_filtering_cache(self, MockPluginManager):
+        class TopicPlugin:
+            def __init__(self):
+                self.calls = 0
+
+            def topic_filtering(self, session=None, topic=None):
+                self.calls += 1
+                return topic != 'denied'
+
+        topic_plugin = TopicPlugin()
+        broker = Broker(test_config, plugin_namespace="hbmqtt.test.plugins")
+        broker.plugins_manager.plugins = [Plugin('topic_plugin', None, topic_plugin)]
+        session = Session()
+        broker._sessions['client'] = (session, None)
+        self.assertTrue(self.loop.run_until_complete(broker.topic_filtering(session, 'allowed')))
+        self.assertFalse(self.loop.run_until_complete(broker.topic_filtering(session, 'denied')))
+        self.assertTrue(self.loop.run_until_complete(broker.topic_filtering(session, 'allowed')))
+        self.assertEqual(topic_plugin.calls, 2)
+        broker.clear_topic_filtering_cache()
+        self.assertFalse(self.loop.run_until_complete(broker.topic_filtering(session, 'denied')))
+        self.assertEqual(topic_plugin.calls, 3)
+
+    def test_retained_message_frame(self):
+        data = b'data'
+        message = RetainedApplicationMessage(None, '/topic', data, QOS_1)
+        frame = message.frame
+        self.assertIs(message.frame, frame)
+        self.assertIs(frame.data, data)
+        self.assertEqual(frame.topic_name, '/topic')
+
     @patch('hbmqtt.broker.PluginManager')
     def test_client_publish_retain(self, MockPluginManager):
         @asyncio.coroutine
@@ -501,6 +940,49 @@ class BrokerTest(unittest.TestCase):
         if future.exception():
             raise future.exception()
 
+    @patch('hbmqtt.broker.PluginManager')
+    def test_client_publish_retain_stored(self, MockPluginManager):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                config = dict(test_config, listeners={'default': {'type': 'tcp', 'bind': '127.0.0.1:1884'}},
+                              **{'retained-store': {'file': store_file, 'compact-interval': 0.05,
+                                                    'compact-ratio': 0.1}})
+                broker = Broker(config, plugin_namespace="hbmqtt.test.plugins")
+                yield from broker.start()
+                yield from self._client_publish('/stored', b'data', QOS_1, retain=True, url='mqtt://127.0.0.1:1884/')
+                yield from self._client_publish('/cleared', b'data', QOS_0, retain=True, url='mqtt://127.0.0.1:1884/')
+                yield from self._client_publish('/cleared', b'', QOS_0, retain=True, url='mqtt://127.0.0.1:1884/')
+                yield from asyncio.sleep(0.2)
+                # Compacted by the periodic maintenance
+                self.assertEqual(broker._retained_messages._generation, 2)
+                self.assertEqual(broker._retained_messages._garbage, 0)
+                yield from broker.shutdown()
+
+                broker = Broker(config, plugin_namespace="hbmqtt.test.plugins")
+                yield from broker.start()
+                self.assertEqual(list(broker._retained_messages), ['/stored'])
+                sub_client = MQTTClient()
+                yield from sub_client.connect('mqtt://127.0.0.1:1884/')
+                yield from sub_client.subscribe([('/+', QOS_1)])
+                message = yield from sub_client.deliver_message()
+                self.assertEqual(message.topic, '/stored')
+                self.assertEqual(message.data, b'data')
+                self.assertTrue(message.publish_packet.retain_flag)
+                yield from sub_client.disconnect()
+                yield from broker.shutdown()
+                future.set_result(True)
+            except Exception as ae:
+                future.set_exception(ae)
+
+        store_dir = tempfile.TemporaryDirectory()
+        store_file = os.path.join(store_dir.name, 'retained.log')
+        future = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(test_coro())
+        store_dir.cleanup()
+        if future.exception():
+            raise future.exception()
+
     @patch('hbmqtt.broker.PluginManager')
     def test_client_publish_retain_delete(self, MockPluginManager):
         @asyncio.coroutine
@@ -643,7 +1125,7 @@ class BrokerTest(unittest.TestCase):
                 ret = yield from sub_client.subscribe([('+/monitor/Clients', QOS_0)])
                 self.assertEqual(ret, [QOS_0])
 
-                yield from self._client_publish('/test/monitor/Clients', b'data', QOS_0)
+                yield from self._client_publish('test/monitor/Clients', b'data', QOS_0)
                 message = yield from sub_client.deliver_message()
                 self.assertIsNotNone(message)
 
@@ -709,9 +1191,9 @@ class BrokerTest(unittest.TestCase):
             raise future.exception()
 
     @asyncio.coroutine
-    def _client_publish(self, topic, data, qos, retain=False):
+    def _client_publish(self, topic, data, qos, retain=False, url='mqtt://127.0.0.1/'):
         pub_client = MQTTClient()
-        ret = yield from pub_client.connect('mqtt://127.0.0.1/')
+        ret = yield from pub_client.connect(url)
         self.assertEqual(ret, 0)
         ret = yield from pub_client.publish(topic, data, qos, retain)
         yield from pub_client.disconnect()
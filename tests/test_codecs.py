@@ -9,7 +9,10 @@ from hbmqtt.codecs import (
     bytes_to_int,
     decode_string,
     encode_string,
+    unpack_packet_id,
+    unpack_string,
 )
+from hbmqtt.errors import NoDataException
 
 
 class TestCodecs(unittest.TestCase):
@@ -35,3 +38,17 @@ class TestCodecs(unittest.TestCase):
     def test_encode_string(self):
         encoded = encode_string('AA')
         self.assertEqual(b'\x00\x02AA', encoded)
+
+    def test_unpack_string(self):
+        buffer = memoryview(b'\x00\x02AA\x00\x00')
+        self.assertEqual(unpack_string(buffer, 0), ('AA', 4))
+        self.assertEqual(unpack_string(buffer, 4), ('', 6))
+        with self.assertRaises(NoDataException):
+            unpack_string(buffer, 6)
+        with self.assertRaises(NoDataException):
+            unpack_string(memoryview(b'\x00\x05AA'), 0)
+
+    def test_unpack_packet_id(self):
+        self.assertEqual(unpack_packet_id(b'\x00\x0a\x01\x00', 2), (256, 4))
+        with self.assertRaises(NoDataException):
+            unpack_packet_id(b'\x00', 0)
@@ -0,0 +1,129 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+import asyncio
+import os
+import tempfile
+import unittest
+
+from hbmqtt.inflight import InflightLog, iter_records, PUBLISH_OUT, ACK_OUT
+from hbmqtt.mqtt.constants import QOS_1, QOS_2
+from hbmqtt.session import OutgoingApplicationMessage, IncomingApplicationMessage
+
+
+class InflightLogTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'inflight.log')
+        self.log = self.open()
+
+    def tearDown(self):
+        self.log.close()
+        self.loop.close()
+        self.dir.cleanup()
+
+    def open(self, **kwargs):
+        log = InflightLog(self.path, commit_interval=0.001, loop=self.loop, **kwargs)
+        self.recovered = log.recover()
+        return log
+
+    def reopen(self):
+        self.log.close()
+        self.log = self.open()
+
+    def records(self):
+        with open(self.path, 'rb') as f:
+            return list(iter_records(f.read()))
+
+    def test_recover_messages(self):
+        self.log.publish_out('c1', OutgoingApplicationMessage(1, 'a/b', QOS_1, b'one', False))
+        self.log.publish_out('c1', OutgoingApplicationMessage(2, 'a/b', QOS_2, b'two', True))
+        self.log.publish_out('c1', OutgoingApplicationMessage(3, 'a/b', QOS_2, b'three', False))
+        self.log.pubrel_out('c1', 3)
+        self.log.publish_in('c2', IncomingApplicationMessage(7, 'c/d', QOS_2, b'in', False))
+        self.reopen()
+        inflight_out, inflight_in = self.recovered['c1']
+        self.assertEqual(list(inflight_out), [1, 2, 3])
+        self.assertEqual(inflight_out[1].data, b'one')
+        self.assertEqual(inflight_out[1].qos, QOS_1)
+        self.assertTrue(inflight_out[2].retain)
+        self.assertIsNotNone(inflight_out[2].publish_packet)
+        self.assertIsNone(inflight_out[2].pubrel_packet)
+        self.assertIsNotNone(inflight_out[3].pubrel_packet)
+        self.assertEqual(len(inflight_in), 0)
+        inflight_out, inflight_in = self.recovered['c2']
+        self.assertEqual(len(inflight_out), 0)
+        self.assertEqual(inflight_in[7].topic, 'c/d')
+        self.assertEqual(inflight_in[7].publish_packet.data, b'in')
+
+    def test_acknowledged_messages(self):
+        self.log.publish_out('c1', OutgoingApplicationMessage(1, 'a/b', QOS_1, b'one', False))
+        self.log.publish_out('c1', OutgoingApplicationMessage(2, 'a/b', QOS_1, b'two', False))
+        self.log.publish_in('c1', IncomingApplicationMessage(3, 'c/d', QOS_2, b'in', False))
+        self.log.publish_out('c2', OutgoingApplicationMessage(1, 'a/b', QOS_1, b'one', False))
+        self.log.ack_out('c1', 1)
+        self.log.ack_in('c1', 3)
+        self.log.drop('c2')
+        self.reopen()
+        self.assertEqual(list(self.recovered), ['c1'])
+        inflight_out, inflight_in = self.recovered['c1']
+        self.assertEqual(list(inflight_out), [2])
+        self.assertEqual(len(inflight_in), 0)
+        # The log is rewritten with the messages in flight only
+        self.assertEqual([record[:3] for record in self.records()], [(PUBLISH_OUT, 'c1', 2)])
+
+    def test_commit(self):
+        self.log.publish_out('c1', OutgoingApplicationMessage(1, 'a/b', QOS_1, b'one', False))
+        self.log.ack_out('c1', 1)
+        self.loop.run_until_complete(self.log.commit())
+        self.assertEqual([record[:3] for record in self.records()], [(PUBLISH_OUT, 'c1', 1), (ACK_OUT, 'c1', 1)])
+        # Records appended meanwhile are committed together
+        commits = self.log.commits
+        with self.log._condition:
+            for i in range(100):
+                self.log.publish_out('c1', OutgoingApplicationMessage(i, 'a/b', QOS_1, b'', False))
+        self.loop.run_until_complete(asyncio.gather(*[self.log.commit() for i in range(10)], loop=self.loop))
+        self.assertEqual(len(self.records()), 102)
+        self.assertEqual(self.log.commits, commits + 1)
+
+    def test_truncated_record(self):
+        self.log.publish_out('c1', OutgoingApplicationMessage(1, 'a/b', QOS_1, b'one', False))
+        self.log.close()
+        # Record partially written by a crash
+        with open(self.path, 'ab') as f:
+            f.write(b'\x00\x00\x00\x00\x00\x00\x00\x40\x01')
+        self.log = self.open()
+        self.assertEqual(list(self.recovered['c1'][0]), [1])
+        self.assertEqual(len(self.records()), 1)
+
+    def test_max_size(self):
+        self.log.close()
+        self.log = self.open(max_size=1024)
+        self.log.publish_out('c1', OutgoingApplicationMessage(1, 'kept', QOS_1, b'', False))
+        for i in range(2, 100):
+            self.log.publish_out('c1', OutgoingApplicationMessage(i, 'a/b', QOS_1, b'x' * 100, False))
+            self.log.ack_out('c1', i)
+        self.loop.run_until_complete(self.log.commit())
+        self.assertLess(os.path.getsize(self.path), 2048)
+        self.reopen()
+        self.assertEqual(list(self.recovered['c1'][0]), [1])
+
+    def test_write_failure(self):
+        write = self.log._write
+        failures = [OSError("No space left on device")]
+
+        def failing_write(f, batch):
+            if failures:
+                raise failures.pop()
+            return write(f, batch)
+        self.log._write = failing_write
+        self.log.publish_in('c1', IncomingApplicationMessage(1, 'a/b', QOS_2, b'in', False))
+        # The message must not be acknowledged
+        with self.assertRaises(OSError):
+            self.loop.run_until_complete(self.log.commit())
+        # Failed records are written again by a snapshot
+        self.log.publish_in('c1', IncomingApplicationMessage(2, 'a/b', QOS_2, b'in', False))
+        self.loop.run_until_complete(self.log.commit())
+        self.reopen()
+        self.assertEqual(list(self.recovered['c1'][1]), [1, 2])
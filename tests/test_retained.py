@@ -0,0 +1,159 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+import os
+import tempfile
+import unittest
+
+from hbmqtt.retained import RetainedStore
+from hbmqtt.session import RetainedApplicationMessage
+from hbmqtt.topics import TopicTree
+from tests.test_topics import FILTERS, TOPICS
+
+
+def message(topic, data=None, qos=1):
+    return RetainedApplicationMessage(None, topic, data or topic.encode(), qos)
+
+
+class RetainedStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'retained.log')
+        self.store = RetainedStore(self.path, cache_size=4)
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def reopen(self):
+        self.store.close()
+        self.store = RetainedStore(self.path, cache_size=4)
+
+    def crash(self):
+        """
+        Close the store files without writing the index
+        """
+        self.store._map.close()
+        self.store._file.close()
+        self.store._file = None
+        self.store = RetainedStore(self.path, cache_size=4)
+
+    def fill(self):
+        for topic in TOPICS:
+            self.store[topic] = message(topic)
+
+    def assertFilterEquivalence(self):
+        tree = TopicTree()
+        for topic in self.store:
+            tree[topic] = topic
+        for a_filter in FILTERS + TOPICS:
+            self.assertEqual(sorted(m.topic for m in self.store.filter(a_filter)), sorted(tree.filter(a_filter)),
+                             "filter=%s" % a_filter)
+
+    def test_mapping(self):
+        self.fill()
+        self.store['a/b'] = message('a/b', b'other', None)
+        self.assertEqual(len(self.store), len(TOPICS))
+        self.assertEqual(sorted(self.store), sorted(TOPICS))
+        self.assertEqual(self.store['a/b'].data, b'other')
+        self.assertIsNone(self.store['a/b'].qos)
+        del self.store['a/b']
+        self.assertNotIn('a/b', self.store)
+        self.assertEqual(len(self.store), len(TOPICS) - 1)
+        with self.assertRaises(KeyError):
+            del self.store['a/b']
+        with self.assertRaises(KeyError):
+            self.store['unknown']
+
+    def test_reopen(self):
+        self.fill()
+        self.reopen()
+        self.assertEqual(self.store._index_count, len(TOPICS))
+        self.assertEqual(len(self.store._recent), 0)
+        self.assertEqual(sorted(self.store), sorted(TOPICS))
+        self.assertEqual(self.store['sport/tennis'].data, b'sport/tennis')
+        self.assertEqual(self.store['sport/tennis'].qos, 1)
+        self.assertFilterEquivalence()
+
+    def test_replay_without_index(self):
+        self.fill()
+        del self.store['a/b']
+        self.crash()
+        self.assertIsNone(self.store._index)
+        self.assertEqual(len(self.store), len(TOPICS) - 1)
+        self.assertNotIn('a/b', self.store)
+        self.assertFilterEquivalence()
+
+    def test_index_and_recent(self):
+        self.fill()
+        self.store.checkpoint()
+        del self.store['a/b']
+        del self.store['$SYS']
+        self.store['a/b/c'] = message('a/b/c', b'changed')
+        self.store['new/topic'] = message('new/topic')
+        self.assertEqual(len(self.store), len(TOPICS) - 1)
+        self.assertEqual(self.store['a/b/c'].data, b'changed')
+        self.assertEqual([m.data for m in self.store.filter('a/+/c') if m.topic == 'a/b/c'], [b'changed'])
+        self.assertFilterEquivalence()
+        self.reopen()
+        self.assertEqual(len(self.store), len(TOPICS) - 1)
+        self.assertEqual(self.store['a/b/c'].data, b'changed')
+        self.assertFilterEquivalence()
+
+    def test_compact(self):
+        self.fill()
+        for topic in TOPICS[1:]:
+            del self.store[topic]
+        size = self.store._size
+        self.store.maintain()
+        self.assertLess(self.store._size, size)
+        self.assertEqual(self.store._garbage, 0)
+        self.assertEqual(list(self.store), [TOPICS[0]])
+        self.reopen()
+        self.assertEqual(list(self.store), [TOPICS[0]])
+        self.assertEqual(self.store[TOPICS[0]].data, TOPICS[0].encode())
+
+    def test_concurrent_maintenance(self):
+        for compact in (True, False):
+            self.fill()
+            del self.store['a/b']
+            count = len(self.store)
+            maintenance = self.store.start_maintenance(compact)
+            # Changes made while maintenance runs are kept
+            del self.store['a/b/c']
+            self.store['sport/tennis'] = message('sport/tennis', b'changed')
+            self.store['new/topic'] = message('new/topic')
+            maintenance.run()
+            self.store['last/topic'] = message('last/topic')
+            self.store.finish_maintenance(maintenance)
+            if compact:
+                self.assertEqual(self.store._generation, maintenance.generation + 1)
+            self.assertEqual(self.store._index_count, count)
+            expected = sorted(set(TOPICS) - {'a/b', 'a/b/c'} | {'new/topic', 'last/topic'})
+            for i in range(2):
+                self.assertEqual(sorted(self.store), expected)
+                self.assertEqual(len(self.store), len(expected))
+                self.assertEqual(self.store['sport/tennis'].data, b'changed')
+                self.assertEqual(self.store['last/topic'].data, b'last/topic')
+                self.assertFilterEquivalence()
+                self.crash()
+
+    def test_truncated_record(self):
+        self.fill()
+        self.store.checkpoint()
+        self.store['last'] = message('last')
+        self.store._file.truncate(self.store._size - 1)
+        self.crash()
+        self.assertNotIn('last', self.store)
+        self.assertEqual(len(self.store), len(TOPICS))
+        self.store['last'] = message('last')
+        self.reopen()
+        self.assertEqual(self.store['last'].data, b'last')
+
+    def test_cache_size(self):
+        self.fill()
+        self.reopen()
+        for topic in TOPICS:
+            self.store[topic]
+        self.assertEqual(len(self.store._cache), 4)
+        self.assertEqual(list(self.store._cache), TOPICS[-4:])
@@ -0,0 +1,82 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+import asyncio
+import pickle
+import unittest
+
+from hbmqtt.mqtt.constants import QOS_1
+from hbmqtt.session import Session, OutgoingApplicationMessage, RetainedApplicationMessage
+
+
+class SessionTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_transitions(self):
+        session = Session(self.loop)
+        self.assertEqual(session.transitions.state, 'new')
+        self.assertTrue(session.transitions.is_new())
+        session.transitions.connect()
+        self.assertTrue(session.transitions.is_connected())
+        self.assertRaises(ValueError, session.transitions.connect)
+        self.assertEqual(session.transitions.state, 'connected')
+        session.transitions.disconnect()
+        session.transitions.disconnect()
+        self.assertTrue(session.transitions.is_disconnected())
+        session.transitions.connect()
+        self.assertEqual(session.transitions.state, 'connected')
+        self.assertEqual(repr(session), 'Session(clientId=None, state=connected)')
+        self.assertIs(session.transitions, session.transitions)
+
+    def test_lazy_containers(self):
+        session = Session(self.loop)
+        self.assertEqual(session.inflight_in_count, 0)
+        self.assertEqual(session.inflight_out_count, 0)
+        self.assertEqual(session.retained_messages_count, 0)
+        self.assertEqual(session.retained_messages_snapshot(), ())
+        self.assertEqual(session.next_packet_id, 1)
+        session.clear_topic_filtering_cache()
+        for name in ('_inflight_out', '_inflight_in', '_retained_messages', '_delivered_message_queue',
+                     '_topic_filtering_cache'):
+            self.assertIsNone(getattr(session, name))
+        session.inflight_out[2] = OutgoingApplicationMessage(2, 'a/b', QOS_1, b'data', False)
+        session.retained_messages.put_nowait(RetainedApplicationMessage(None, 'a/b', b'data', QOS_1))
+        session.topic_filtering_cache['a/b'] = True
+        self.assertEqual(session.inflight_out_count, 1)
+        self.assertEqual(session.retained_messages_count, 1)
+        self.assertEqual(session.next_packet_id, 3)
+        self.assertEqual([message.topic for message in session.retained_messages_snapshot()], ['a/b'])
+        self.assertEqual(session.retained_messages_count, 1)
+        session.clear_topic_filtering_cache()
+        self.assertEqual(session.topic_filtering_cache, {})
+
+    def test_plugin_attributes(self):
+        session = Session(self.loop)
+        self.assertFalse(hasattr(session, '_token_topics'))
+        session._token_topics = ['a/#']
+        self.assertEqual(getattr(session, '_token_topics', None), ['a/#'])
+
+    def test_pickle(self):
+        session = Session(self.loop)
+        session.client_id = 'client'
+        session.transitions.connect()
+        session.inflight_out[1] = OutgoingApplicationMessage(1, 'a/b', QOS_1, b'data', False)
+        session.retained_messages.put_nowait(RetainedApplicationMessage(None, 'a/b', b'data', QOS_1))
+        session._token_topics = ['a/#']
+        asyncio.set_event_loop(self.loop)
+        try:
+            restored = pickle.loads(pickle.dumps(session))
+        finally:
+            asyncio.set_event_loop(None)
+        self.assertEqual(restored, session)
+        self.assertEqual(restored.transitions.state, 'connected')
+        restored.transitions.disconnect()
+        self.assertEqual(restored.transitions.state, 'disconnected')
+        self.assertEqual(session.transitions.state, 'connected')
+        self.assertEqual(list(restored.inflight_out), [1])
+        self.assertEqual(restored.retained_messages_count, 0)
+        self.assertEqual(restored._token_topics, ['a/#'])
@@ -0,0 +1,152 @@
+# Copyright (c) 2015 Nicolas JOUANIN
+#
+# See the file license.txt for copying permission.
+import itertools
+import unittest
+
+from hbmqtt.broker import Broker
+from hbmqtt.topics import TopicTree
+
+
+FILTERS = [
+    '#', '+', '+/+', '+/#', '/+', '/#', 'a', 'a/b', 'a/+', 'a/#', 'a/b/c', 'a/+/c', 'a/+/#', 'a/b/#', '+/b',
+    '+/b/c', '+/+/c', 'a/+/+', 'b/#', 'sport/tennis/player1', 'sport/tennis/+', 'sport/#', 'sport/+/player1',
+    '$SYS/#', '$SYS/broker/+', '$SYS/broker/version', '+/broker/#',
+]
+
+TOPICS = [
+    'a', 'b', 'a/b', 'a/c', 'b/b', 'a/b/c', 'a/x/c', 'x/b/c', 'a/b/c/d', '/a', 'sport', 'sport/tennis',
+    'sport/tennis/player1', 'sport/tennis/player2', 'sport/golf/player1', 'sport/tennis/player1/ranking',
+    '$SYS', '$SYS/broker', '$SYS/broker/version', '$SYS/broker/load/bytes',
+]
+
+
+def levels(topic):
+    return len(topic.split('/'))
+
+
+def regex_quirk(topic, a_filter):
+    """
+    Broker.matches builds a regex where '+' may span several levels but not match an empty one, and where '#'
+    requires the separator before it. Those cases diverge from MQTT-4.7.1 and are checked separately against the
+    specification.
+    """
+    if '+' in a_filter and '' in topic.split('/'):
+        return True
+    if '+' in a_filter and levels(topic) > levels(a_filter) and not a_filter.endswith('#'):
+        return True
+    if a_filter.endswith('/#') and levels(topic) == levels(a_filter) - 1:
+        return True
+    return False
+
+
+def broker_route(topic, a_filter):
+    if topic.startswith('$') and (a_filter.startswith('+') or a_filter.startswith('#')):
+        return False
+    return bool(Broker.matches(None, topic, a_filter))
+
+
+class TopicTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = TopicTree()
+        for a_filter in FILTERS:
+            self.tree[a_filter] = a_filter
+
+    def test_mapping(self):
+        self.assertEqual(len(self.tree), len(FILTERS))
+        self.assertIn('a/+', self.tree)
+        self.assertNotIn('a/+/+/+', self.tree)
+        self.assertEqual(self.tree['sport/#'], 'sport/#')
+        self.assertEqual(sorted(self.tree), sorted(FILTERS))
+
+    def test_equivalence_with_matches(self):
+        for topic, a_filter in itertools.product(TOPICS, FILTERS):
+            if regex_quirk(topic, a_filter):
+                continue
+            matched = a_filter in self.tree.match(topic)
+            self.assertEqual(matched, broker_route(topic, a_filter), "topic=%s filter=%s" % (topic, a_filter))
+
+    def test_single_level_wildcard(self):
+        self.assertIn('a/+', self.tree.match('a/b'))
+        self.assertNotIn('a/+', self.tree.match('a/b/c'))
+        self.assertNotIn('a/+', self.tree.match('a'))
+        self.assertIn('sport/tennis/+', self.tree.match('sport/tennis/player2'))
+        self.assertNotIn('sport/tennis/+', self.tree.match('sport/tennis/player1/ranking'))
+        self.assertIn('/+', self.tree.match('/a'))
+        self.assertIn('+/+', self.tree.match('/a'))
+
+    def test_multi_level_wildcard(self):
+        self.assertIn('sport/#', self.tree.match('sport'))
+        self.assertIn('sport/#', self.tree.match('sport/tennis/player1/ranking'))
+        self.assertIn('a/+/#', self.tree.match('a/b'))
+        self.assertIn('#', self.tree.match('a/b/c/d'))
+        self.assertNotIn('b/#', self.tree.match('a/b'))
+
+    def test_dollar_topics(self):
+        matches = self.tree.match('$SYS/broker/version')
+        self.assertIn('$SYS/#', matches)
+        self.assertIn('$SYS/broker/+', matches)
+        self.assertIn('$SYS/broker/version', matches)
+        self.assertNotIn('#', matches)
+        self.assertNotIn('+/broker/#', matches)
+        self.assertNotIn('#', self.tree.match('$SYS'))
+
+    def test_no_duplicates(self):
+        for topic in TOPICS:
+            matches = self.tree.match(topic)
+            self.assertEqual(len(matches), len(set(matches)))
+
+    def test_delete(self):
+        del self.tree['a/+/#']
+        self.assertNotIn('a/+/#', self.tree)
+        self.assertNotIn('a/+/#', self.tree.match('a/b/c'))
+        self.assertIn('a/+/c', self.tree.match('a/b/c'))
+        for a_filter in list(self.tree):
+            del self.tree[a_filter]
+        self.assertEqual(len(self.tree), 0)
+        self.assertEqual(self.tree._root.children, {})
+        self.assertEqual(self.tree.match('a/b'), [])
+
+    def test_delete_unknown(self):
+        with self.assertRaises(KeyError):
+            del self.tree['unknown/filter']
+
+    def test_replace_value(self):
+        self.tree['a/b'] = 'other'
+        self.assertEqual(len(self.tree), len(FILTERS))
+        self.assertIn('other', self.tree.match('a/b'))
+        self.assertNotIn('a/b', self.tree.match('a/b'))
+
+
+class TopicTreeFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = TopicTree()
+        for topic in TOPICS:
+            self.tree[topic] = topic
+
+    def test_equivalence_with_match(self):
+        filters = TopicTree()
+        for a_filter in FILTERS:
+            filters[a_filter] = a_filter
+        for a_filter in FILTERS:
+            expected = sorted(topic for topic in TOPICS if a_filter in filters.match(topic))
+            self.assertEqual(sorted(self.tree.filter(a_filter)), expected, "filter=%s" % a_filter)
+
+    def test_filter(self):
+        self.assertEqual(self.tree.filter('a/b'), ['a/b'])
+        self.assertEqual(self.tree.filter('a/b/d'), [])
+        self.assertEqual(sorted(self.tree.filter('a/+')), ['a/b', 'a/c'])
+        self.assertEqual(sorted(self.tree.filter('sport/#')), [
+            'sport', 'sport/golf/player1', 'sport/tennis', 'sport/tennis/player1', 'sport/tennis/player1/ranking',
+            'sport/tennis/player2'])
+
+    def test_dollar_topics(self):
+        self.assertNotIn('$SYS', self.tree.filter('#'))
+        self.assertNotIn('$SYS', self.tree.filter('+'))
+        self.assertEqual(sorted(self.tree.filter('$SYS/#')), [
+            '$SYS', '$SYS/broker', '$SYS/broker/load/bytes', '$SYS/broker/version'])
+        self.assertEqual(self.tree.filter('$SYS/+/version'), ['$SYS/broker/version'])
+
+    def test_mapping_equality(self):
+        self.assertEqual(TopicTree(), {})
+        self.assertEqual(TopicTree({'a/b': 1}), {'a/b': 1})